@@ -0,0 +1,268 @@
+""" Benchmark of the hot paths: check-in, login, members listing, statistics and attendance analytics.
+
+    Seeds synthetic SQLite databases in a temporary folder and drives the endpoints in-process
+    (FastAPI TestClient, no network) with concurrent clients. Reports p50/p95/p99 latency and throughput.
+
+    Usage:
+        python benchmark.py --members 5000 --passes 10 --checkins 200000 --clients 16 --requests 2000
+        python benchmark.py --scenarios checkin statistics --json results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable
+
+SCENARIOS = ("checkin", "login", "members", "statistics", "attendance")
+BENCH_PASSWORD = "benchmark"
+#===========================================================
+
+""" SETUP
+"""
+def prepare_environment(folder: Path) -> None:
+    """ Must be executed before anything from the project is imported: database URLs are read on import """
+    os.environ["DB_MEMBERS_URL"] = "sqlite:///{path}".format(path=Path(folder, "members.db").as_posix())
+    os.environ["DB_CHECKINS_URL"] = "sqlite:///{path}".format(path=Path(folder, "checkins.db").as_posix())
+
+    # Values needed by the application startup
+    defaults = {
+        "ROOT_NAME": "Root", "ROOT_SURNAME": "Benchmark", "ROOT_LOGIN": "root",
+        "ROOT_PASS": BENCH_PASSWORD, "ROOT_EMAIL": "root@benchmark.local",
+        "SEND_WELCOME_EMAIL": "False", "QR_CODE_VALUE_LEN": "12",
+        "SECRET_KEY": "benchmark", "SECRET_SALT": "benchmark",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+def seed_databases(members: int, passes: int, checkins: int, instructors: int = 10, seed: int = 0) -> dict:
+    """ Fills synthetic databases. Every member gets "passes" expired passes plus one active,
+        check-in history is spread over the last year.
+        Returns card IDs to be used by the scenarios.
+    """
+    from sqlalchemy import insert
+
+    import checkin_rollup
+    import project_utils as utils
+    from database import SessionLocal_Checkins, SessionLocal_Members
+    from models import CheckIn, Member, MemberPass, PassType
+
+    rnd = random.Random(seed)
+    utils.databases_init_tables()
+
+    # Argon2 is slow on purpose --> one hash shared by every synthetic member
+    password_hash = utils.hash_string(BENCH_PASSWORD)
+    today = date.today()
+
+    def member_row(i: int, account_type: utils.AccountType) -> dict:
+        return {
+            "card_id": "BENCH{i:07d}".format(i=i),
+            "name": "Name{i}".format(i=i),
+            "surname": "Surname{i}".format(i=i),
+            "email": "member{i}@benchmark.local".format(i=i),
+            "registration_date": today - timedelta(days=rnd.randint(0, 3 * 365)),
+            "account_type": account_type.value,
+            "username": "member{i}".format(i=i),
+            "password_hash": password_hash,
+            "activated": True,
+        }
+
+    member_rows = [member_row(0, utils.AccountType.ROOT)]
+    member_rows += [member_row(i, utils.AccountType.INSTRUCTOR) for i in range(1, instructors + 1)]
+    member_rows += [member_row(i, utils.AccountType.MEMBER) for i in range(instructors + 1, instructors + 1 + members)]
+    card_ids = [row["card_id"] for row in member_rows[instructors + 1:]]
+    instructor_rows = member_rows[1:instructors + 1]
+
+    with SessionLocal_Members() as db:
+        db.execute(insert(Member), member_rows)
+        db.execute(insert(PassType), [{"name": "Monthly", "price": 150, "validity_days": 30,
+                                       "maximum_entries": None, "is_ext_event_pass": False}])
+
+        # Pass history --> inserted in chunks to keep memory flat
+        chunk = []
+        for card_id in card_ids:
+            for _ in range(passes):
+                purchase_date = today - timedelta(days=rnd.randint(31, 3 * 365))
+                chunk.append({"member_card_id": card_id, "pass_type_id": 1, "pass_type_name": "Monthly",
+                              "purchase_date": purchase_date, "expiration_date": purchase_date + timedelta(days=30),
+                              "entries_left": 0, "is_ext_event_pass": False, "is_closed": False})
+            chunk.append({"member_card_id": card_id, "pass_type_id": 1, "pass_type_name": "Monthly",
+                          "purchase_date": today, "expiration_date": today + timedelta(days=30),
+                          "entries_left": None, "is_ext_event_pass": False, "is_closed": False})
+            if len(chunk) >= 50_000:
+                db.execute(insert(MemberPass), chunk)
+                chunk = []
+        if chunk:
+            db.execute(insert(MemberPass), chunk)
+        db.commit()
+
+    with SessionLocal_Checkins() as db:
+        chunk = []
+        start = datetime.now() - timedelta(days=365)
+        for _ in range(checkins):
+            member = rnd.choice(card_ids)
+            instructor = rnd.choice(instructor_rows)
+            chunk.append({"member_card_id": member, "member_name": "Name", "member_surname": "Surname",
+                          "validated_by_card_id": instructor["card_id"],
+                          "validated_by_name": instructor["name"],
+                          "validated_by_surnamename": instructor["surname"],
+                          "pass_name": "Monthly",
+                          "date_time": start + timedelta(seconds=rnd.randint(0, 365 * 24 * 60 * 60)),
+                          "is_successful": rnd.random() > 0.05})
+            if len(chunk) >= 50_000:
+                db.execute(insert(CheckIn), chunk)
+                chunk = []
+        if chunk:
+            db.execute(insert(CheckIn), chunk)
+        db.commit()
+
+        # History bypasses the check-in writer --> rollups are built the same way as "manage.py backfill-rollup"
+        checkin_rollup.backfill(db)
+
+    return {"members": card_ids, "instructors": [row["card_id"] for row in instructor_rows]}
+#===========================================================
+
+""" MEASUREMENT
+"""
+def run_scenario(name: str, requests: int, clients: int, call: Callable[[int], int]) -> dict:
+    """ Executes "call(i)" for i in range(requests) on "clients" threads.
+        "call" returns HTTP status code of the response.
+    """
+    def timed(i: int) -> tuple[float, int]:
+        start = time.perf_counter()
+        status_code = call(i)
+        return time.perf_counter() - start, status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    status_codes: dict[int, int] = {}
+    for _, status_code in results:
+        status_codes[status_code] = status_codes.get(status_code, 0) + 1
+
+    return {
+        "scenario": name,
+        "requests": requests,
+        "clients": clients,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentiles[49], 2),
+        "p95_ms": round(percentiles[94], 2),
+        "p99_ms": round(percentiles[98], 2),
+        "max_ms": round(latencies[-1], 2),
+        "status_codes": status_codes,
+    }
+
+def print_report(results: list[dict]) -> None:
+    header = "{:<12} {:>9} {:>8} {:>11} {:>9} {:>9} {:>9}  {}".format(
+        "scenario", "requests", "clients", "req/s", "p50 ms", "p95 ms", "p99 ms", "status codes")
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print("{:<12} {:>9} {:>8} {:>11} {:>9} {:>9} {:>9}  {}".format(
+            result["scenario"], result["requests"], result["clients"], result["throughput_rps"],
+            result["p50_ms"], result["p95_ms"], result["p99_ms"], result["status_codes"]))
+#===========================================================
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark of the check-in hot path and related endpoints")
+    parser.add_argument("--members", type=int, default=5000, help="Synthetic members")
+    parser.add_argument("--passes", type=int, default=10, help="Expired passes per member (pass history)")
+    parser.add_argument("--checkins", type=int, default=200_000, help="Rows of check-in history")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per scenario [login: 1/10 of it]")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, default=None, help="Write results to the file as well")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="impact_bench_") as folder:
+        prepare_environment(Path(folder))
+
+        print("Seeding: {m} members, {p} passes/member, {c} check-ins ...".format(
+            m=args.members, p=args.passes, c=args.checkins))
+        started = time.perf_counter()
+        seeded = seed_databases(args.members, args.passes, args.checkins, seed=args.seed)
+        print("Seeded in {s:.1f} s".format(s=time.perf_counter() - started))
+
+        # Import application only now: it binds to the synthetic databases
+        from fastapi.testclient import TestClient
+        from database import SessionLocal_Members
+        from endpoints_passes import explain_member_pass_active_internal
+        import main as application
+
+        with SessionLocal_Members() as db:
+            print("Active pass lookup: {plan}".format(plan=explain_member_pass_active_internal(db)))
+
+        rnd = random.Random(args.seed)
+        members = seeded["members"][:]
+        rnd.shuffle(members)
+        instructors = seeded["instructors"]
+        date_to = date.today()
+        date_from = date_to - timedelta(days=365)
+
+        def checkin(i: int) -> int:
+            # Every member once --> repeated members hit the anti-double-scan window (403)
+            req = {"member_card_id": members[i % len(members)],
+                   "validated_by_card_id": instructors[i % len(instructors)],
+                   "external_provider_id": None}
+            return client.post("/logging/checkin", json=req).status_code
+
+        def login(i: int) -> int:
+            req = {"username": "member{i}".format(i=len(instructors) + 1 + i % len(members)),
+                   "password": BENCH_PASSWORD}
+            return client.post("/login/username", json=req).status_code
+
+        def members_page(i: int) -> int:
+            pages = max(1, min(1000, len(members) // 100))
+            return client.get("/members", params={"page": i % pages, "page_size": 100}).status_code
+
+        def statistics_call(i: int) -> int:
+            if i % 2 == 0:
+                req = {"date_from": date_from.isoformat(), "date_to": date_to.isoformat()}
+                return client.post("/statistics/instructors_checkins", json=req).status_code
+            req = {"validated_by_card_id": instructors[i % len(instructors)],
+                   "date_from": date_from.isoformat(), "date_to": date_to.isoformat(),
+                   "page": i % 10, "page_size": 50}
+            return client.post("/statistics/instructor_checkins/detailed", json=req).status_code
+
+        def attendance(i: int) -> int:
+            req = {"date_from": date_from.isoformat(), "date_to": date_to.isoformat()}
+            return client.post("/statistics/attendance", json=req).status_code
+
+        calls = {
+            "checkin": (checkin, args.requests),
+            "login": (login, max(1, args.requests // 10)),
+            "members": (members_page, args.requests),
+            "statistics": (statistics_call, args.requests),
+            "attendance": (attendance, max(1, args.requests // 10)),
+        }
+
+        results = []
+        client = TestClient(application.app)
+        with client, contextlib.redirect_stdout(io.StringIO()):  # Silence per-request timing prints
+            for scenario in args.scenarios:
+                call, requests = calls[scenario]
+                results.append(run_scenario(scenario, requests, args.clients, call))
+
+    print_report(results)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    # Application expects to be started from the project folder ("static", "templates", ...)
+    os.chdir(Path(__file__).resolve().parent)
+    sys.path.insert(0, str(Path.cwd()))
+    sys.exit(main())
@@ -0,0 +1,170 @@
+import os
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable
+
+from sqlalchemy import create_engine, delete, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import SessionLocal_Checkins, SessionLocal_Checkins_Async, engine_checkins
+from models import CheckIn
+#===========================================================
+
+""" MONTHLY PARTITIONS OF THE CHECKIN LOG
+    Live "checkins.db" keeps recent months only. Older months are moved by "python manage.py archive-checkins"
+    into one SQLite file per month: "<folder of checkins.db>/archive/checkins_YYYY_MM.db".
+    Archive files are written once and then read-only (opened as immutable --> no locking at all).
+
+    Readers of the raw log ask for the sessions overlapping their date range: archives come first
+    in chronological order, live DB last. Rollup tables are never archived, they stay in the live DB.
+"""
+PATH_ARCHIVE = Path(engine_checkins.url.database).resolve().parent / "archive"
+ARCHIVE_FILE_PREFIX = "checkins_"
+
+@dataclass(frozen=True)
+class Partition:
+    month: date     # First day of the month
+    path: Path
+
+    @property
+    def month_end(self) -> date:
+        """ First day of the next month """
+        return next_month(self.month)
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def partition_path(month: date) -> Path:
+    return Path(PATH_ARCHIVE, "{prefix}{year:04d}_{month:02d}.db".format(
+        prefix=ARCHIVE_FILE_PREFIX, year=month.year, month=month.month))
+
+def list_partitions() -> list[Partition]:
+    partitions = []
+    for path in PATH_ARCHIVE.glob(ARCHIVE_FILE_PREFIX + "*.db"):
+        try:
+            month = datetime.strptime(path.stem[len(ARCHIVE_FILE_PREFIX):], "%Y_%m").date()
+        except ValueError:
+            continue
+        partitions.append(Partition(month=month, path=path))
+    return sorted(partitions, key=lambda partition: partition.month)
+
+def partitions_for_range(date_from: date | None, date_to: date | None) -> list[Partition]:
+    """ Archives overlapping the days [date_from, date_to] (inclusive) [None - unbounded] """
+    return [partition for partition in list_partitions()
+            if (date_from is None or partition.month_end > date_from)
+            and (date_to is None or partition.month <= date_to)]
+#===========================================================
+
+""" SESSIONS
+"""
+_lock = threading.Lock()
+_engines: dict[Path, Engine] = {}
+_engines_async: dict[Path, AsyncEngine] = {}
+
+def archive_url(path: Path, driver: str = "sqlite") -> str:
+    return "{driver}:///file:{path}?mode=ro&immutable=1&uri=true".format(driver=driver, path=path.as_posix())
+
+def get_engine(partition: Partition) -> Engine:
+    with _lock:
+        engine = _engines.get(partition.path)
+        if engine is None:
+            engine = _engines[partition.path] = create_engine(archive_url(partition.path),
+                                                              connect_args={"check_same_thread": False})
+        return engine
+
+def get_engine_async(partition: Partition) -> AsyncEngine:
+    with _lock:
+        engine = _engines_async.get(partition.path)
+        if engine is None:
+            engine = _engines_async[partition.path] = create_async_engine(archive_url(partition.path, "sqlite+aiosqlite"))
+        return engine
+
+def sessions_for_range(date_from: date | None, date_to: date | None) -> list[tuple[Partition | None, Callable[[], Session]]]:
+    """ (partition, session factory) in chronological order, live DB last [partition None] """
+    sources = [(partition, sessionmaker(bind=get_engine(partition), autoflush=False))
+               for partition in partitions_for_range(date_from, date_to)]
+    sources.append((None, SessionLocal_Checkins))
+    return sources
+
+def sessions_for_range_async(date_from: date | None, date_to: date | None) -> list[tuple[Partition | None, Callable[[], AsyncSession]]]:
+    """ Same as sessions_for_range() for AsyncSession """
+    sources = [(partition, async_sessionmaker(bind=get_engine_async(partition), class_=AsyncSession,
+                                              autoflush=False, expire_on_commit=False))
+               for partition in partitions_for_range(date_from, date_to)]
+    sources.append((None, SessionLocal_Checkins_Async))
+    return sources
+#===========================================================
+
+""" ARCHIVING [manage.py]
+"""
+def months_to_archive(db: Session, keep_months: int, today: date = None) -> list[date]:
+    """ Months with rows in the live DB older than the current month and "keep_months" months before it """
+    cutoff = (today or date.today()).replace(day=1)
+    for _ in range(keep_months):
+        cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+
+    month = func.strftime("%Y-%m-01", CheckIn.date_time)
+    rows = db.execute(select(month).where(CheckIn.date_time < cutoff).distinct().order_by(month)).scalars().all()
+    return [date.fromisoformat(row) for row in rows]
+
+def archive_month(month: date) -> int:
+    """ Moves CheckIn rows of the month from the live DB into its archive file. Returns amount of rows moved.
+
+        File is built under a temporary name and renamed only when complete, then rows are deleted
+        from the live DB. If the process dies in between, next run finds the archive and only finishes
+        the deletion. Rows logged for an already archived month later on (offline sync) stay in the live DB.
+    """
+    PATH_ARCHIVE.mkdir(parents=True, exist_ok=True)
+    path = partition_path(month)
+    month_range = (CheckIn.date_time >= month, CheckIn.date_time < next_month(month))
+
+    if path.exists() is False:
+        temporary = path.with_suffix(".tmp")
+        temporary.unlink(missing_ok=True)
+
+        # Same table and indexes as the live DB
+        engine = create_engine("sqlite:///{path}".format(path=temporary.as_posix()))
+        CheckIn.__table__.create(bind=engine)
+        engine.dispose()
+
+        with engine_checkins.connect() as connection:
+            connection.exec_driver_sql("ATTACH DATABASE ? AS archive", (str(temporary),))
+            try:
+                columns = ", ".join(column.name for column in CheckIn.__table__.columns)
+                connection.exec_driver_sql(
+                    "INSERT INTO archive.{table} ({columns}) SELECT {columns} FROM main.{table} "
+                    "WHERE date_time >= ? AND date_time < ? ORDER BY date_time, id".format(
+                        table=CheckIn.__tablename__, columns=columns),
+                    (month.isoformat(), next_month(month).isoformat()))
+                connection.commit()
+            finally:
+                connection.exec_driver_sql("DETACH DATABASE archive")
+
+        os.chmod(temporary, 0o444)
+        os.replace(temporary, path)
+
+    # Delete only what is in the archive
+    archived_ids = select(CheckIn.id).where(*month_range)
+    archive = create_engine(archive_url(path))
+    try:
+        with archive.connect() as connection:
+            ids = connection.execute(archived_ids).scalars().all()
+    finally:
+        archive.dispose()
+
+    moved = 0
+    with SessionLocal_Checkins() as db:
+        for start in range(0, len(ids), 500):
+            moved += db.execute(delete(CheckIn).where(CheckIn.id.in_(ids[start:start + 500]))).rowcount
+        db.commit()
+    return moved
+
+def vacuum_live() -> None:
+    """ Gives space of the moved rows back to the file system [needs exclusive access for a while] """
+    with engine_checkins.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("VACUUM")
+#===========================================================
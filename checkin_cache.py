@@ -0,0 +1,301 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, Optional
+
+from models import CheckIn, ExternalProvider, Member, MemberPass
+#===========================================================
+
+""" CACHED DATA
+    Plain snapshots of the rows used by the check-in hot path.
+    ORM objects are never stored: they are bound to the session that loaded them.
+"""
+@dataclass
+class CachedMember:
+    card_id: str
+    name: str
+    surname: str
+    account_type: int
+
+    @classmethod
+    def from_orm(cls, member: Member) -> "CachedMember":
+        return cls(card_id=member.card_id,
+                   name=member.name,
+                   surname=member.surname,
+                   account_type=member.account_type)
+
+@dataclass
+class CachedMemberPass:
+    id: int
+    pass_type_name: str
+    expiration_date: Optional[date]
+    entries_left: Optional[int]
+    is_ext_event_pass: bool
+    ext_event_code: Optional[str]
+    external_provider_id: Optional[int]
+    external_provider_name: Optional[str]
+
+    @classmethod
+    def from_orm(cls, member_pass: MemberPass) -> "CachedMemberPass":
+        return cls(id=member_pass.id,
+                   pass_type_name=member_pass.pass_type_name,
+                   expiration_date=member_pass.expiration_date,
+                   entries_left=member_pass.entries_left,
+                   is_ext_event_pass=member_pass.is_ext_event_pass,
+                   ext_event_code=member_pass.ext_event_code,
+                   external_provider_id=member_pass.external_provider_id,
+                   external_provider_name=member_pass.external_provider_name)
+
+    def is_active(self, day: date) -> bool:
+        """ Same conditions as endpoints_passes.get_member_pass_active_internal_by_member_id """
+        if self.expiration_date is not None and self.expiration_date <= day:
+            return False
+        if self.entries_left is not None and self.entries_left <= 0:
+            return False
+        return True
+
+@dataclass(frozen=True)
+class CachedExternalProvider:
+    id: int
+    name: str
+    is_deleted: bool
+
+    @classmethod
+    def from_orm(cls, provider: ExternalProvider) -> "CachedExternalProvider":
+        return cls(id=provider.id,
+                   name=provider.name,
+                   is_deleted=bool(provider.is_deleted))
+#===========================================================
+
+class CheckInCache:
+    """ Process-local cache for the check-in validation.
+
+        Members and their active MemberPass are keyed by card ID, ExternalProviders are kept as a whole catalog.
+        Only positive lookups are cached: unknown card IDs or members without an active pass are
+        always read from the DB, so a pass sold through another worker is visible on the very next scan.
+
+        Entries are dropped explicitly by the endpoints that change underlying rows (invalidate_*).
+        TTL only bounds how long changes done by other workers (gunicorn) may stay unnoticed.
+
+    Args:
+        ttl_seconds: float -> Maximum age of any cached entry.
+        max_entries: int -> Maximum amount of members (and passes) kept; least recently used are dropped first.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 50_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._members: OrderedDict[str, tuple[float, CachedMember]] = OrderedDict()
+        self._passes: OrderedDict[str, tuple[float, CachedMemberPass]] = OrderedDict()
+        self._providers: Optional[tuple[float, dict[int, CachedExternalProvider]]] = None
+
+        # Incremented on every invalidation --> loads started before it are not stored
+        self._version = 0
+
+    def configure(self, ttl_seconds: float = None, max_entries: int = None) -> None:
+        if ttl_seconds is not None:
+            self.ttl_seconds = ttl_seconds
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self.clear()
+
+    """ LOOKUPS
+        "load" callables are executed only on a miss and return ORM object(s) [or None].
+    """
+    def get_member(self, card_id: str, load: Callable[[], Optional[Member]]) -> Optional[CachedMember]:
+        if card_id is None:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._get_fresh(self._members, card_id, now)
+            if entry is not None:
+                return entry
+            version = self._version
+
+        member = load()
+        if member is None:
+            return None
+
+        cached = CachedMember.from_orm(member)
+        with self._lock:
+            if version == self._version:
+                self._put(self._members, card_id, cached, now)
+        return cached
+
+    def get_active_pass(self, card_id: str, load: Callable[[], Optional[MemberPass]],
+                        day: date = None) -> Optional[CachedMemberPass]:
+        day = day or date.today()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._get_fresh(self._passes, card_id, now)
+            if entry is not None:
+                if entry.is_active(day):
+                    return entry
+                self._passes.pop(card_id, None)
+            version = self._version
+
+        member_pass = load()
+        if member_pass is None:
+            return None
+
+        cached = CachedMemberPass.from_orm(member_pass)
+        with self._lock:
+            if version == self._version:
+                self._put(self._passes, card_id, cached, now)
+        return cached
+
+    def get_external_provider(self, id: int, load: Callable[[], list[ExternalProvider]]) -> Optional[CachedExternalProvider]:
+        if id is None:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            if self._providers is not None and now - self._providers[0] <= self.ttl_seconds:
+                provider = self._providers[1].get(id)
+                if provider is not None:
+                    return provider
+            version = self._version
+
+        # Miss --> reload the whole catalog (it is small, and new providers become visible at once)
+        catalog = {provider.id: CachedExternalProvider.from_orm(provider) for provider in load()}
+        with self._lock:
+            if version == self._version:
+                self._providers = (now, catalog)
+        return catalog.get(id)
+
+    """ UPDATES done by the check-in itself
+    """
+    def update_after_checkin(self, card_id: str, member_pass_id: int, entries_left: int) -> None:
+        """ entries_left: value returned by the DB after the decrement """
+        with self._lock:
+            entry = self._passes.get(card_id)
+            if entry is not None and entry[1].id == member_pass_id:
+                entry[1].entries_left = entries_left
+
+    """ INVALIDATION
+    """
+    def invalidate_member(self, card_id: str) -> None:
+        """ Drops member and its MemberPass """
+        with self._lock:
+            self._version += 1
+            self._members.pop(card_id, None)
+            self._passes.pop(card_id, None)
+
+    def invalidate_member_pass(self, card_id: str) -> None:
+        with self._lock:
+            self._version += 1
+            self._passes.pop(card_id, None)
+
+    def invalidate_members(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._members.clear()
+            self._passes.clear()
+
+    def invalidate_external_providers(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._providers = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._members.clear()
+            self._passes.clear()
+            self._providers = None
+
+    """ INTERNAL: must be called with the lock held
+    """
+    def _get_fresh(self, storage: OrderedDict, key: str, now: float):
+        entry = storage.get(key)
+        if entry is None:
+            return None
+        if now - entry[0] > self.ttl_seconds:
+            del storage[key]
+            return None
+        storage.move_to_end(key)
+        return entry[1]
+
+    def _put(self, storage: OrderedDict, key: str, value, now: float) -> None:
+        storage[key] = (now, value)
+        storage.move_to_end(key)
+        while len(storage) > self.max_entries:
+            storage.popitem(last=False)
+#===========================================================
+
+class CheckInDebounce:
+    """ Anti-double-scan window: after a successful scan member can not be scanned again for 5 minutes,
+        after a rejected one - for 30 seconds.
+
+        Recent scans of every member seen recently are kept in memory, so members already inside are
+        rejected without touching any database. On a miss (restart, scan done by another worker, replayed scan
+        older than what is in memory) rows of the CheckIn log itself are used --> members table is not involved at all.
+
+        Only scans within the window around the time of the new scan count, before or after it:
+        a scan replayed by an offline scanner hours later is judged by what happened around its own time.
+    """
+
+    WINDOW_SUCCESS_SECONDS: int = 5 * 60
+    WINDOW_REJECTED_SECONDS: int = 30
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scans: dict[str, list[tuple[datetime, bool]]] = {}     # Sorted by time, newest last
+        self._records_since_prune = 0
+
+    def seconds_left(self, card_id: str, date_time: datetime,
+                     load: Callable[[], list[CheckIn]]) -> int:
+        """ Returns how many seconds are left until member can be scanned again [0 - can be scanned now].
+            "load" returns CheckIn rows of the member within WINDOW_SUCCESS_SECONDS around "date_time",
+            executed only if memory does not cover that time.
+        """
+        span = timedelta(seconds=self.WINDOW_SUCCESS_SECONDS)
+        with self._lock:
+            scans = list(self._scans.get(card_id, ()))
+
+        # Memory keeps 2 windows before the newest scan --> covers the whole window around "date_time"
+        if not scans or date_time < scans[-1][0] - span:
+            scans = [(check_in.date_time, check_in.is_successful) for check_in in load()]
+
+        seconds_left = 0
+        for scan_time, is_successful in scans:
+            window = self.WINDOW_SUCCESS_SECONDS if is_successful else self.WINDOW_REJECTED_SECONDS
+            seconds_since_scan = int((date_time - scan_time).total_seconds())
+            if seconds_since_scan > window or seconds_since_scan < -window:
+                continue
+            # Scan logged after this one [offline replay] --> whole window
+            seconds_left = max(seconds_left, 1, window - max(seconds_since_scan, 0))
+        return seconds_left
+
+    def record(self, card_id: str, is_successful: bool, date_time: datetime) -> None:
+        """ Adds the scan in time order [replayed older scans included] """
+        border = timedelta(seconds=2 * self.WINDOW_SUCCESS_SECONDS)
+        with self._lock:
+            scans = self._scans.setdefault(card_id, [])
+            bisect.insort(scans, (date_time, is_successful))
+            while scans[0][0] < scans[-1][0] - border:
+                del scans[0]
+
+            # Every now and then drop members whose window is over for sure
+            self._records_since_prune += 1
+            if self._records_since_prune >= 1000:
+                self._records_since_prune = 0
+                now = datetime.now()
+                self._scans = {key: value for key, value in self._scans.items()
+                               if value[-1][0] >= now - border}
+
+    def forget(self, card_id: str) -> None:
+        with self._lock:
+            self._scans.pop(card_id, None)
+#===========================================================
+
+cache = CheckInCache()
+debounce = CheckInDebounce()
+#===========================================================
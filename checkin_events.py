@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Optional
+#===========================================================
+
+@dataclass(eq=False)
+class Subscription:
+    """ One connected client (front desk tablet, etc.).
+
+    Args:
+        hall: str -> Receive only check-ins from this hall [None - from all].
+        validated_by_card_id: str -> Receive only check-ins done by this validator [None - by anyone].
+        dropped: int -> Events lost because the client was too slow to read them.
+    """
+    loop: asyncio.AbstractEventLoop
+    queue: asyncio.Queue
+    hall: Optional[str] = None
+    validated_by_card_id: Optional[str] = None
+    dropped: int = 0
+
+    def matches(self, row: dict) -> bool:
+        if self.hall is not None and row.get("hall") != self.hall:
+            return False
+        if self.validated_by_card_id is not None and row.get("validated_by_card_id") != self.validated_by_card_id:
+            return False
+        return True
+
+    def put(self, row: Optional[dict]) -> None:
+        """ Executed inside the event loop. Queue is bounded: when full --> the oldest event is dropped """
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(row)
+
+    async def get(self) -> Optional[dict]:
+        """ Next committed CheckIn [None - stream is closed] """
+        return await self.queue.get()
+#===========================================================
+
+class CheckInBroadcaster:
+    """ Pushes every committed CheckIn row to subscribed clients (SSE / WebSocket).
+
+        publish() is called by the check-in writer thread after the commit. It never waits for subscribers:
+        every subscriber has its own bounded queue, so a slow client loses old events instead of
+        stalling the check-in path. Nothing is read from the database.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscriptions: set[Subscription] = set()
+
+    def subscribe(self, hall: str = None, validated_by_card_id: str = None) -> Subscription:
+        """ Must be called from the event loop the subscriber will be read in """
+        subscription = Subscription(loop=asyncio.get_running_loop(),
+                                    queue=asyncio.Queue(maxsize=self.queue_size),
+                                    hall=hall,
+                                    validated_by_card_id=validated_by_card_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subscriptions)
+
+    def publish(self, rows: list[dict]) -> None:
+        """ Thread-safe. Rows are CheckIn column values [with "id"] """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        if not subscriptions:
+            return
+
+        for subscription in subscriptions:
+            matched = [row for row in rows if subscription.matches(row)]
+            if not matched:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(self._put_many, subscription, matched)
+            except RuntimeError:
+                # Event loop of the subscriber is already closed
+                self.unsubscribe(subscription)
+
+    def close(self) -> None:
+        """ Ends all streams [on shutdown] """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            self._subscriptions.clear()
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, None)
+            except RuntimeError:
+                pass
+
+    @staticmethod
+    def _put_many(subscription: Subscription, rows: list[dict]) -> None:
+        for row in rows:
+            subscription.put(row)
+#===========================================================
+
+broadcaster = CheckInBroadcaster()
+#===========================================================
@@ -0,0 +1,125 @@
+import csv
+import io
+from datetime import date, datetime, timedelta
+from typing import Iterator
+
+from sqlalchemy import Boolean, DateTime, Integer, select
+from sqlalchemy.orm import Session
+
+import checkin_archive
+from models import CheckIn
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet export is optional
+    pyarrow = None
+#===========================================================
+
+EXPORT_COLUMNS = [column for column in CheckIn.__table__.columns]
+EXPORT_CHUNK_ROWS = 5000
+#===========================================================
+
+""" QUERY
+"""
+def export_query(date_from: date, date_to: date, filters: dict):
+    """ CheckIn rows of the days [date_from, date_to] (both inclusive), in the log order.
+        "filters": column name --> required value [None values are skipped].
+    """
+    query = (
+        select(*EXPORT_COLUMNS)
+        .where(CheckIn.date_time >= date_from,
+               CheckIn.date_time < date_to + timedelta(days=1))
+        .order_by(CheckIn.date_time, CheckIn.id)
+    )
+    for name, value in filters.items():
+        if value is not None:
+            query = query.where(CheckIn.__table__.columns[name] == value)
+    return query
+
+def iterate_chunks(db: Session, query) -> Iterator[list[tuple]]:
+    """ Server-side cursor: rows are fetched "EXPORT_CHUNK_ROWS" at a time, never the whole result """
+    result = db.execute(query.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_ROWS))
+    for partition in result.partitions():
+        yield partition
+
+def iterate_chunks_for_range(date_from: date, date_to: date, query) -> Iterator[list[tuple]]:
+    """ Same query on every archived month overlapping the range, then on the live DB [chronological order] """
+    for _, session_factory in checkin_archive.sessions_for_range(date_from, date_to):
+        with session_factory() as db:
+            yield from iterate_chunks(db, query)
+#===========================================================
+
+""" FORMATS
+    Generators of bytes for StreamingResponse, memory is bounded by one chunk.
+"""
+def stream_csv(chunks: Iterator[list[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow([column.key for column in EXPORT_COLUMNS])
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Header only --> empty export is still a valid CSV
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink(io.RawIOBase):
+    """ Write-only file collecting bytes written since the last take() """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def parquet_schema():
+    def arrow_type(column):
+        if isinstance(column.type, Integer):
+            return pyarrow.int64()
+        if isinstance(column.type, Boolean):
+            return pyarrow.bool_()
+        if isinstance(column.type, DateTime):
+            return pyarrow.timestamp("us")
+        return pyarrow.string()
+
+    return pyarrow.schema([(column.key, arrow_type(column)) for column in EXPORT_COLUMNS])
+
+def stream_parquet(chunks: Iterator[list[tuple]]) -> Iterator[bytes]:
+    """ Every chunk becomes one row group, flushed to the client as soon as it is written """
+    schema = parquet_schema()
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_batch(pyarrow.record_batch([pyarrow.array(values, type=field.type)
+                                                     for values, field in zip(columns, schema)],
+                                                    schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+def is_parquet_available() -> bool:
+    return pyarrow is not None
+#===========================================================
@@ -0,0 +1,222 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models import CheckIn, CheckInDailyRollup, CheckInHourlyRollup
+import checkin_archive
+#===========================================================
+
+""" KEYS
+    Key columns are never NULL [NULL breaks the unique key --> "" is stored instead].
+    Python version is used by the writer, SQL version by the backfill: both must give the same values.
+"""
+# Same text as SQLAlchemy stores DateTime in SQLite --> rows from the backfill and from the writer share keys
+SQL_HOUR_FORMAT = "%Y-%m-%d %H:00:00.000000"
+
+def daily_key(row: dict) -> tuple:
+    return (row["date_time"].date(), row.get("validated_by_card_id") or "")
+
+def hourly_key(row: dict) -> tuple:
+    return (row["date_time"].replace(minute=0, second=0, microsecond=0),
+            row.get("hall") or "",
+            row.get("pass_name") or "",
+            row.get("external_provider_name") or "")
+#===========================================================
+
+""" INCREMENTAL MAINTENANCE
+    Executed by the check-in writer inside the transaction that inserts CheckIn rows,
+    so the rollups never disagree with the log.
+"""
+def aggregate_daily(rows: list[dict]) -> list[dict]:
+    counters: dict[tuple, dict] = {}
+    for row in rows:
+        key = daily_key(row)
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = {"day": key[0], "validated_by_card_id": key[1],
+                                       "successful": 0, "rejected": 0}
+        # Last known name of the validator
+        counter["validated_by_name"] = row.get("validated_by_name")
+        counter["validated_by_surnamename"] = row.get("validated_by_surnamename")
+        counter["rejected" if row.get("is_successful") is False else "successful"] += 1
+    return list(counters.values())
+
+def aggregate_hourly(rows: list[dict]) -> list[dict]:
+    counters: dict[tuple, dict] = {}
+    for row in rows:
+        key = hourly_key(row)
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = {"hour": key[0], "hall": key[1], "pass_name": key[2],
+                                       "external_provider_name": key[3],
+                                       "successful": 0, "rejected": 0}
+        counter["rejected" if row.get("is_successful") is False else "successful"] += 1
+    return list(counters.values())
+
+def upsert_rows(db: Session, rows: list[dict]) -> None:
+    """ Adds CheckIn rows to the rollups [does not commit] """
+    if not rows:
+        return
+
+    query = sqlite_insert(CheckInDailyRollup)
+    query = query.on_conflict_do_update(
+        index_elements=[CheckInDailyRollup.day, CheckInDailyRollup.validated_by_card_id],
+        set_={
+            "successful": CheckInDailyRollup.successful + query.excluded.successful,
+            "rejected": CheckInDailyRollup.rejected + query.excluded.rejected,
+            "validated_by_name": query.excluded.validated_by_name,
+            "validated_by_surnamename": query.excluded.validated_by_surnamename,
+        })
+    db.execute(query, aggregate_daily(rows))
+
+    query = sqlite_insert(CheckInHourlyRollup)
+    query = query.on_conflict_do_update(
+        index_elements=[CheckInHourlyRollup.hour, CheckInHourlyRollup.hall,
+                        CheckInHourlyRollup.pass_name, CheckInHourlyRollup.external_provider_name],
+        set_={
+            "successful": CheckInHourlyRollup.successful + query.excluded.successful,
+            "rejected": CheckInHourlyRollup.rejected + query.excluded.rejected,
+        })
+    db.execute(query, aggregate_hourly(rows))
+#===========================================================
+
+""" BACKFILL
+    Rollups cover the whole log: archived months (checkin_archive) and the live DB. Every source is
+    aggregated by SQL in its own file, the results are summed into the live rollup tables.
+"""
+def aggregate_queries(date_from: date = None, date_to: date = None) -> tuple:
+    """ (daily, hourly) GROUP BY queries over CheckIn rows of the days [None - unbounded],
+        columns in the order of the rollup tables
+    """
+    conditions = []
+    if date_from is not None:
+        conditions.append(CheckIn.date_time >= date_from)
+    if date_to is not None:
+        conditions.append(CheckIn.date_time < date_to + timedelta(days=1))
+
+    successful = func.sum(case((CheckIn.is_successful.is_(False), 0), else_=1))
+    rejected = func.sum(case((CheckIn.is_successful.is_(False), 1), else_=0))
+
+    day = func.date(CheckIn.date_time)
+    validator = func.coalesce(CheckIn.validated_by_card_id, "")
+    daily = (
+        select(day, validator,
+               func.max(CheckIn.validated_by_name), func.max(CheckIn.validated_by_surnamename),
+               successful, rejected)
+        .where(*conditions)
+        .group_by(day, validator)
+    )
+
+    hourly_keys = (func.strftime(SQL_HOUR_FORMAT, CheckIn.date_time),
+                   func.coalesce(CheckIn.hall, ""),
+                   func.coalesce(CheckIn.pass_name, ""),
+                   func.coalesce(CheckIn.external_provider_name, ""))
+    hourly = (
+        select(*hourly_keys, successful, rejected)
+        .where(*conditions)
+        .group_by(*hourly_keys)
+    )
+    return daily, hourly
+
+def add_aggregates(db: Session, daily: list[tuple], hourly: list[tuple]) -> None:
+    """ Adds rows of aggregate_queries() to the rollups [does not commit] """
+    if daily:
+        query = sqlite_insert(CheckInDailyRollup)
+        query = query.on_conflict_do_update(
+            index_elements=[CheckInDailyRollup.day, CheckInDailyRollup.validated_by_card_id],
+            set_={
+                "successful": CheckInDailyRollup.successful + query.excluded.successful,
+                "rejected": CheckInDailyRollup.rejected + query.excluded.rejected,
+                "validated_by_name": query.excluded.validated_by_name,
+                "validated_by_surnamename": query.excluded.validated_by_surnamename,
+            })
+        db.execute(query, [{"day": date.fromisoformat(day), "validated_by_card_id": validator,
+                            "validated_by_name": name, "validated_by_surnamename": surname,
+                            "successful": successful, "rejected": rejected}
+                           for day, validator, name, surname, successful, rejected in daily])
+
+    if hourly:
+        query = sqlite_insert(CheckInHourlyRollup)
+        query = query.on_conflict_do_update(
+            index_elements=[CheckInHourlyRollup.hour, CheckInHourlyRollup.hall,
+                            CheckInHourlyRollup.pass_name, CheckInHourlyRollup.external_provider_name],
+            set_={
+                "successful": CheckInHourlyRollup.successful + query.excluded.successful,
+                "rejected": CheckInHourlyRollup.rejected + query.excluded.rejected,
+            })
+        db.execute(query, [{"hour": datetime.strptime(hour, SQL_HOUR_FORMAT), "hall": hall, "pass_name": pass_name,
+                            "external_provider_name": provider, "successful": successful, "rejected": rejected}
+                           for hour, hall, pass_name, provider, successful, rejected in hourly])
+
+def backfill(db: Session, date_from: date = None, date_to: date = None) -> int:
+    """ Rebuilds the rollups from the CheckIn log [archives included] for the given days [None - unbounded]
+        and commits. "db" must be a session of the live DB.
+        Runs as one write transaction: check-in batches committed meanwhile wait for it (busy_timeout)
+        and are added on top afterwards, so nothing is counted twice or lost.
+        Returns amount of rollup rows written.
+    """
+    conditions_daily = []
+    conditions_hourly = []
+    if date_from is not None:
+        conditions_daily.append(CheckInDailyRollup.day >= date_from)
+        conditions_hourly.append(CheckInHourlyRollup.hour >= date_from)
+    if date_to is not None:
+        conditions_daily.append(CheckInDailyRollup.day <= date_to)
+        conditions_hourly.append(CheckInHourlyRollup.hour < date_to + timedelta(days=1))
+
+    daily, hourly = aggregate_queries(date_from, date_to)
+    try:
+        db.execute(delete(CheckInDailyRollup).where(*conditions_daily))
+        db.execute(delete(CheckInHourlyRollup).where(*conditions_hourly))
+
+        # Chronological order --> validator names of the newest rows win
+        for partition, session_factory in checkin_archive.sessions_for_range(date_from, date_to):
+            if partition is None:
+                add_aggregates(db, db.execute(daily).tuples().all(), db.execute(hourly).tuples().all())
+                continue
+            with session_factory() as db_archive:
+                add_aggregates(db, db_archive.execute(daily).tuples().all(), db_archive.execute(hourly).tuples().all())
+
+        written = db.execute(select(func.count()).select_from(CheckInDailyRollup).where(*conditions_daily)).scalar_one()
+        written += db.execute(select(func.count()).select_from(CheckInHourlyRollup).where(*conditions_hourly)).scalar_one()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return written
+#===========================================================
+
+""" VERIFICATION [manage.py]
+"""
+def verify(db: Session, date_from: date = None, date_to: date = None) -> list[tuple[date, int, int]]:
+    """ Days on which the daily rollup disagrees with the CheckIn log [archives included]:
+        (day, check-ins in the log, check-ins in the rollup). Empty list --> rollups are correct.
+    """
+    daily, _ = aggregate_queries(date_from, date_to)
+    logged: dict[date, int] = {}
+    for partition, session_factory in checkin_archive.sessions_for_range(date_from, date_to):
+        if partition is None:
+            rows = db.execute(daily).tuples().all()
+        else:
+            with session_factory() as db_archive:
+                rows = db_archive.execute(daily).tuples().all()
+        for day, _, _, _, successful, rejected in rows:
+            day = date.fromisoformat(day)
+            logged[day] = logged.get(day, 0) + successful + rejected
+
+    conditions = []
+    if date_from is not None:
+        conditions.append(CheckInDailyRollup.day >= date_from)
+    if date_to is not None:
+        conditions.append(CheckInDailyRollup.day <= date_to)
+    rolled_up = dict(db.execute(
+        select(CheckInDailyRollup.day, func.sum(CheckInDailyRollup.successful + CheckInDailyRollup.rejected))
+        .where(*conditions)
+        .group_by(CheckInDailyRollup.day)).tuples().all())
+
+    return [(day, logged.get(day, 0), rolled_up.get(day, 0))
+            for day in sorted(logged.keys() | rolled_up.keys())
+            if logged.get(day, 0) != rolled_up.get(day, 0)]
+#===========================================================
@@ -0,0 +1,314 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+from sqlalchemy import DateTime, insert
+from sqlalchemy.orm import Session
+
+import checkin_rollup
+from database import SessionLocal_Checkins, engine_checkins
+from models import CheckIn
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process [uvicorn] --> thread lock is enough
+    fcntl = None
+#===========================================================
+
+""" JOURNAL
+    Rows the writer could not commit [DB locked / full disk / shutdown during an outage] are appended
+    to a JSON-lines file next to "checkins.db" and written again by the next start() --> no scan is discarded.
+
+    Every process appends to its own file "checkins_journal.<pid>.jsonl" [gunicorn workers share the folder].
+    A file is replayed by one process only: it takes an exclusive flock, renames the file to
+    "checkins_journal.<pid>.<ns>.replaying" [appends go to a new file from then on], writes the rows
+    and removes it. Lock is held until the file is gone --> a file left by a crashed replay is taken by the next one.
+"""
+PATH_JOURNAL_DIR = Path(engine_checkins.url.database).resolve().parent
+JOURNAL_PREFIX = "checkins_journal."
+DATETIME_COLUMNS = {column.key for column in CheckIn.__table__.columns if isinstance(column.type, DateTime)}
+
+def encode_row(row: dict) -> str:
+    return json.dumps({key: value.isoformat() if key in DATETIME_COLUMNS and value is not None else value
+                       for key, value in row.items()})
+
+def decode_row(line: str) -> dict:
+    return {key: datetime.fromisoformat(value) if key in DATETIME_COLUMNS and value is not None else value
+            for key, value in json.loads(line).items()}
+
+def lock_file(file, blocking: bool = True) -> bool:
+    """ Exclusive flock of an open file [released by closing it]. False if "blocking" is off and it is taken """
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+def is_same_file(file, path: Path) -> bool:
+    """ Open file is still the one at "path" [not renamed / removed by a replay meanwhile] """
+    try:
+        return os.path.samestat(os.fstat(file.fileno()), os.stat(path))
+    except FileNotFoundError:
+        return False
+#===========================================================
+
+class CheckInWriter:
+    """ Write-behind queue for the CheckIn log.
+
+        Request thread only copies column values of the CheckIn into the queue and returns.
+        Background thread collects queued rows into batches and writes every batch as one transaction,
+        so the cost of a commit (fsync) is shared by the whole batch.
+        Rollups (checkin_rollup) are updated in the same transaction.
+
+        Rows are kept in memory until flushed: graceful shutdown (stop()) writes everything left.
+        submit() returns before the row is on disk --> "/logging/checkin" answers 202 for a scan that is
+        only queued. Hard kill / power loss loses every queued row: normally the last "flush_interval",
+        during a DB outage everything waiting for a retry (up to "spill_after" attempts) and the queue behind it.
+        Callers that need the row on disk before answering use write() ["/logging/checkin/sync"].
+        If writer is not started (scripts, CLI) --> submit() writes synchronously.
+
+        Failed batch is retried with capped exponential backoff (0.1 s doubled up to "max_retry_delay").
+        After "spill_after" failed attempts in a row, or when stopping, it is appended to the journal instead
+        and the writer moves on. Journal is written again by start() and after the next successful batch.
+
+    Args:
+        batch_size: int -> Maximum amount of rows written in one transaction.
+        flush_interval: float -> Maximum time [s] a row waits in the queue before it is written.
+        max_queue: int -> Queue bound. When full --> submit() blocks (back-pressure instead of unbounded memory).
+        journal_dir: Path -> Folder of the journal files [None - retry in memory until success].
+        max_retry_delay: float -> Upper bound [s] of the delay between attempts.
+        spill_after: int -> Failed attempts of one batch before it is moved to the journal.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session],
+                 batch_size: int = 200, flush_interval: float = 0.05, max_queue: int = 10_000,
+                 journal_dir: Path = None, max_retry_delay: float = 5.0, spill_after: int = 10):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal_dir = journal_dir
+        self.max_retry_delay = max_retry_delay
+        self.spill_after = spill_after
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._listeners: list[Callable[[list[dict]], None]] = []
+        self._journal_lock = threading.Lock()
+        self._spilled = False                       # Own journal file has rows not replayed yet
+
+    def configure(self, batch_size: int = None, flush_interval: float = None, max_queue: int = None) -> None:
+        """ Must be called before start() """
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if max_queue is not None:
+            self._queue = queue.Queue(maxsize=max_queue)
+
+    def add_listener(self, listener: Callable[[list[dict]], None]) -> None:
+        """ "listener" is called with every committed batch [column values, "id" included].
+            Executed on the writer thread --> must be fast and must not raise.
+        """
+        self._listeners.append(listener)
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self.replay_journal()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="checkin-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ Flush-on-shutdown: writes every queued row before returning """
+        if not self.is_running:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, check_in: CheckIn) -> None:
+        row = self._to_row(check_in)
+        if not self.is_running:
+            self._write_batch([row])
+            return
+        self._queue.put(row)
+
+    def write(self, check_ins: list[CheckIn],
+              before_commit: Callable[[Session, list[int]], None] = None) -> None:
+        """ Writes rows synchronously as one transaction, bypassing the queue [for callers that need durability].
+            "before_commit(db, ids)" is executed in the same transaction with IDs of the inserted rows.
+        """
+        if not check_ins and before_commit is None:
+            return
+        self._write_batch([self._to_row(check_in) for check_in in check_ins], before_commit)
+
+    def flush(self) -> None:
+        """ Blocks until all rows queued so far are written """
+        if not self.is_running:
+            return
+        self._queue.join()
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def journal_path(self) -> Path | None:
+        """ Journal file of this process """
+        if self.journal_dir is None:
+            return None
+        return Path(self.journal_dir, "{prefix}{pid}.jsonl".format(prefix=JOURNAL_PREFIX, pid=os.getpid()))
+
+    def replay_journal(self) -> int:
+        """ Writes rows of every journal file [all processes, crashed ones included] and removes them,
+            one transaction per file. Returns amount of rows written.
+            Files locked by another process are skipped, on a failure the file is kept for the next attempt.
+        """
+        if self.journal_dir is None:
+            return 0
+        written = 0
+        with self._journal_lock:
+            self._spilled = False
+            for path in sorted(Path(self.journal_dir).glob(JOURNAL_PREFIX + "*")):
+                try:
+                    written += self._replay_file(path)
+                except Exception as e:
+                    self._spilled = True
+                    print(f"CheckIn writer: journal {path.name} not written yet: {e}")
+        if written:
+            print(f"CheckIn writer: {written} rows written from the journal")
+        return written
+
+    """ INTERNAL
+    """
+    @staticmethod
+    def _to_row(check_in: CheckIn) -> dict:
+        return {column.key: getattr(check_in, column.key)
+                for column in CheckIn.__table__.columns
+                if column.key != "id"}
+
+    def _run(self) -> None:
+        while not (self._stopping.is_set() and self._queue.empty()):
+            # Wait for the first row --> collect the rest of the batch until it is full or time is out
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0 and not self._stopping.is_set():
+                        batch.append(self._queue.get(timeout=timeout))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._write_batch_with_retry(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch_with_retry(self, rows: list[dict]) -> None:
+        """ Until the batch is committed or spilled to the journal, rows are never dropped """
+        delay = 0.1
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self._write_batch(rows)
+                break
+            except Exception as e:
+                print(f"CheckIn writer: batch of {len(rows)} rows failed [attempt {attempt}]: {e}")
+
+            if self.journal_dir is not None and (self._stopping.is_set() or attempt >= self.spill_after):
+                self._spill(rows)
+                return
+            # Shutdown interrupts the wait --> one more attempt, then the journal
+            self._stopping.wait(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+        # DB is writable again --> rows spilled earlier
+        if self._spilled:
+            self.replay_journal()
+
+    def _spill(self, rows: list[dict]) -> None:
+        path = self.journal_path
+        with self._journal_lock:
+            while True:
+                with open(path, "a", encoding="utf-8") as file:
+                    lock_file(file)
+                    # Renamed by a replay between open() and the lock --> new file
+                    if not is_same_file(file, path):
+                        continue
+                    file.writelines(encode_row(row) + "\n" for row in rows)
+                    file.flush()
+                    os.fsync(file.fileno())
+                    break
+            self._spilled = True
+        print(f"CheckIn writer: {len(rows)} rows moved to the journal {path}")
+
+    def _replay_file(self, path: Path) -> int:
+        """ Must be called with the journal lock held """
+        try:
+            file = open(path, encoding="utf-8")
+        except FileNotFoundError:   # Taken by another process meanwhile
+            return 0
+        with file:
+            if not lock_file(file, blocking=False) or not is_same_file(file, path):
+                return 0
+            if path.suffix != ".replaying":
+                claimed = path.with_name("{prefix}{pid}.{ns}.replaying".format(
+                    prefix=JOURNAL_PREFIX, pid=os.getpid(), ns=time.time_ns()))
+                os.replace(path, claimed)
+                path = claimed
+            rows = [decode_row(line) for line in file if line.strip()]
+            self._write_batch(rows)
+            path.unlink()
+        return len(rows)
+
+    def _write_batch(self, rows: list[dict],
+                     before_commit: Callable[[Session, list[int]], None] = None) -> None:
+        db = self.session_factory()
+        try:
+            ids = []
+            if rows:
+                ids = db.execute(insert(CheckIn).returning(CheckIn.id, sort_by_parameter_order=True), rows)\
+                    .scalars().all()
+                checkin_rollup.upsert_rows(db, rows)
+            if before_commit is not None:
+                before_commit(db, ids)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        # Notify about committed rows
+        if self._listeners:
+            committed = [{**row, "id": id} for row, id in zip(rows, ids)]
+            for listener in self._listeners:
+                try:
+                    listener(committed)
+                except Exception as e:
+                    print(f"CheckIn writer: listener failed: {e}")
+#===========================================================
+
+writer = CheckInWriter(SessionLocal_Checkins, journal_dir=PATH_JOURNAL_DIR)
+#===========================================================
@@ -1,21 +1,83 @@
-from sqlalchemy import create_engine
+import os
+
+import dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-DB_MEMBERS_URL = "sqlite:///./databases/members.db"
-DB_CHECKINS_URL = "sqlite:///./databases/checkins.db"
+# Engines are created on import --> ".env" has to be read already here
+dotenv.load_dotenv()
+
+# Can be overridden from the environment [e.g. benchmark.py runs on its own synthetic databases]
+DB_MEMBERS_URL = os.getenv("DB_MEMBERS_URL", "sqlite:///./databases/members.db")
+DB_CHECKINS_URL = os.getenv("DB_CHECKINS_URL", "sqlite:///./databases/checkins.db")
 DB_PASSTYPE_URL = "sqlite:///./databases/passtype.db"
 
+""" SQLITE PERFORMANCE PROFILE
+    Applied to every new connection (sync and async engines).
+    WAL: readers (statistics) do not block the writer (door scans) and vice versa.
+    synchronous=NORMAL: in WAL mode DB stays consistent, only the last commits may be lost on power failure.
+"""
+SQLITE_PRAGMAS = {
+    "journal_mode":     os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous":      os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout":     os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "mmap_size":        os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "cache_size":       os.getenv("SQLITE_CACHE_SIZE", str(-64 * 1024)),    # Negative --> KiB, i.e. 64 MiB
+    "temp_store":       os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    "foreign_keys":     os.getenv("SQLITE_FOREIGN_KEYS", "OFF"),
+}
+
+# Pool is per process: with gunicorn every worker keeps its own connections
+POOL_OPTIONS = {
+    "pool_size":        int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow":     int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout":     float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle":     int(os.getenv("DB_POOL_RECYCLE", "3600")),
+}
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        if value:
+            cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def create_sqlite_engine(url: str) -> Engine:
+    engine = create_engine(url, connect_args={"check_same_thread": False}, **POOL_OPTIONS)
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+    return engine
+
 # Database for the members
-engine_members = create_engine(DB_MEMBERS_URL, connect_args={"check_same_thread": False})
+engine_members = create_sqlite_engine(DB_MEMBERS_URL)
 SessionLocal_Members = sessionmaker(bind=engine_members, autoflush=False, autocommit=False)
 Base_Members = declarative_base()
 
 # Database to log all entrances done
-engine_checkins = create_engine(DB_CHECKINS_URL, connect_args={"check_same_thread": False})
+engine_checkins = create_sqlite_engine(DB_CHECKINS_URL)
 SessionLocal_Checkins = sessionmaker(bind=engine_checkins, autoflush=False, autocommit=False)
 Base_Checkins = declarative_base()
 
+# Async engines on the same files [aiosqlite]: used by "async def" endpoints, do not occupy the threadpool.
+# expire_on_commit=False --> returned objects can be serialized after commit without lazy loads.
+def to_async_url(url: str) -> str:
+    return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+def create_sqlite_engine_async(url: str):
+    engine = create_async_engine(to_async_url(url), **POOL_OPTIONS)
+    event.listen(engine.sync_engine, "connect", apply_sqlite_pragmas)
+    return engine
+
+engine_members_async = create_sqlite_engine_async(DB_MEMBERS_URL)
+SessionLocal_Members_Async = async_sessionmaker(bind=engine_members_async, class_=AsyncSession,
+                                                autoflush=False, expire_on_commit=False)
+
+engine_checkins_async = create_sqlite_engine_async(DB_CHECKINS_URL)
+SessionLocal_Checkins_Async = async_sessionmaker(bind=engine_checkins_async, class_=AsyncSession,
+                                                 autoflush=False, expire_on_commit=False)
+
 # Database to store and modify all pass types
 # engine_passtype = create_engine(DB_PASSTYPE_URL, connect_args={"check_same_thread": False})
 # SessionLocal_PassType = sessionmaker(bind=engine_passtype, autoflush=False, autocommit=False)
@@ -1,50 +1,75 @@
-from datetime import datetime, timezone
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
 
-from endpoints_passes import get_member_pass_active_internal_by_member_id
+from checkin_cache import CachedExternalProvider, CachedMember, CachedMemberPass, CheckInDebounce, cache as checkin_cache, debounce as checkin_debounce
+from checkin_events import broadcaster as checkin_broadcaster
+import checkin_export
+from checkin_writer import writer as checkin_writer
+from endpoints_passes import consume_member_pass_entry, get_member_pass_active_internal_by_member_id
 
-from models import CheckIn, ExternalProvider, Member, MemberPass
-from schemas import Req_CheckIn_Add, Resp_ChecIn_Inst
+from models import CheckIn, CheckInSyncScan, ExternalProvider
+from schemas import Req_CheckIn_Add, Req_CheckIn_Sync_Batch, Resp_ChecIn_Inst, Resp_CheckIn_Sync, Resp_CheckIn_Sync_Batch
 
 import project_utils as utils
 #===========================================================
 
-router = APIRouter()
-#===========================================================
+""" UTILS: CheckIn
+"""
+def get_checkins_near(db_logging: Session, member_card_id: str, date_time: datetime) -> list[CheckIn]:
+    """ Logged scans of the member close enough to "date_time" to matter for the anti-double-scan window """
+    window = timedelta(seconds=CheckInDebounce.WINDOW_SUCCESS_SECONDS)
+    return db_logging.query(CheckIn)\
+        .filter(CheckIn.member_card_id == member_card_id,
+                CheckIn.date_time.between(date_time - window, date_time + window))\
+        .order_by(CheckIn.date_time)\
+        .all()
+
+def checkin_process(db: Session, db_logging: Session, req: Req_CheckIn_Add, current_time: datetime) -> CheckIn:
+    """ Validates a single scan and does all members.db writes for it [without commit].
+        Returns CheckIn row to be logged, raises HTTPException if scan can not be logged at all.
+        Check-in cache and anti-double-scan table are updated immediately, so next scan of the same member
+        in the same transaction sees this one --> on rollback use commit_or_invalidate().
+    """
 
-@router.post("/logging/checkin",
-             response_model=Resp_ChecIn_Inst,
-             response_model_exclude_none=True,
-             response_model_exclude_unset=True,
-             status_code=status.HTTP_202_ACCEPTED)
-def post_checkin_add(req: Req_CheckIn_Add,
-                     db: Session = Depends(utils.get_db_members),
-                     db_logging: Session = Depends(utils.get_db_checkins)):
-    
     # Local variables to operate on
     is_successful = True
     rejected_reason = None
-    current_time = datetime.now() 
-
-    # Get all data from request
-    member: Member = utils.get_member_by_card_id_with_raise(db, req.member_card_id)
-    validator: Member = utils.get_member_by_card_id(db, req.validated_by_card_id)
-    external_provider : ExternalProvider = utils.get_external_provider_by_id(db, req.external_provider_id)
-    member_pass: MemberPass = get_member_pass_active_internal_by_member_id(db, req.member_card_id)
-
-    # Assert last Checkin was done at least 5 minutes before
-    if member.last_checkin_success and member.last_checkin_datetime:
-        if member.last_checkin_success == True:
-            time_window_seconds = 5 * 60 # 5 minutes in seconds
-        else:
-            time_window_seconds = 30
-
-        seconds_since_last_scan = (current_time - member.last_checkin_datetime).seconds
-        if seconds_since_last_scan <= time_window_seconds:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                detail="Too few time since last attempt." \
-                                "Next attempt in {sec}".format(sec=time_window_seconds-seconds_since_last_scan))
+    entries_left = None
+
+    # Get all data from request [warm scan is served from the cache without any reads]
+    member: CachedMember = checkin_cache.get_member(req.member_card_id,
+        lambda: utils.get_member_by_card_id(db, req.member_card_id))
+    if not member:
+        raise HTTPException(status_code=400,
+                            detail="No mmeber with such id was found in DB")
+    validator: CachedMember = checkin_cache.get_member(req.validated_by_card_id,
+        lambda: utils.get_member_by_card_id(db, req.validated_by_card_id))
+    external_provider: CachedExternalProvider = checkin_cache.get_external_provider(req.external_provider_id,
+        lambda: db.query(ExternalProvider).all())
+    member_pass: CachedMemberPass = checkin_cache.get_active_pass(req.member_card_id,
+        lambda: get_member_pass_active_internal_by_member_id(db, req.member_card_id, day=current_time.date()),
+        day=current_time.date())
+
+    # Assert last Checkin was done at least 5 minutes before [30 seconds if it was rejected]
+    seconds_left = checkin_debounce.seconds_left(member.card_id, current_time,
+        lambda: get_checkins_near(db_logging, member.card_id, current_time))
+    if seconds_left:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Too few time since last attempt." \
+                            "Next attempt in {sec}".format(sec=seconds_left))
+
+    # Consume one entry [success is decided by the same statement that decrements]
+    if member_pass and member_pass.entries_left is not None:
+        entries_left = consume_member_pass_entry(db, member_pass.id)
+        if entries_left is None:
+            # Last entry was used by a concurrent scan
+            checkin_cache.invalidate_member_pass(member.card_id)
+            member_pass = None
 
     # Validate one of ExternalProvider or MemberPass still present
     if (not external_provider and
@@ -60,6 +85,7 @@ def post_checkin_add(req: Req_CheckIn_Add,
     check_in.member_surname = member.surname 
 
     check_in.date_time = current_time 
+    check_in.hall = req.hall
 
     if validator:
         check_in.validated_by_card_id = validator.card_id
@@ -78,10 +104,6 @@ def post_checkin_add(req: Req_CheckIn_Add,
         check_in.external_provider_id = member_pass.external_provider_id
         check_in.external_provider_name = member_pass.external_provider_name
 
-        # Decrement amount of entries if needed
-        if member_pass.entries_left:
-            member_pass.entries_left = member_pass.entries_left - 1
-
     # utilize ExternalProvider information directly only if there is no MemberPass present. 
     if external_provider and not member_pass:
         check_in.external_provider_id = external_provider.id
@@ -90,18 +112,264 @@ def post_checkin_add(req: Req_CheckIn_Add,
     check_in.is_successful = is_successful
     check_in.rejected_reason = rejected_reason
 
-    # Update information about member and used pass 
-    member.last_checkin_success = is_successful
-    member.last_checkin_datetime = current_time
+    # Remember the scan [members table is not written] --> keep the cache in sync with used pass
+    checkin_debounce.record(member.card_id, is_successful, current_time)
+    if entries_left is not None:
+        checkin_cache.update_after_checkin(member.card_id, member_pass.id, entries_left)
+    return check_in
+
+def get_sync_scan_responses(db_logging: Session, client_scan_ids: list[str]) -> dict[str, str]:
+    """ client_scan_id --> stored Resp_CheckIn_Sync JSON of scans replayed already """
+    responses = {}
+    for start in range(0, len(client_scan_ids), 500):    # SQLite bound parameters limit
+        chunk = client_scan_ids[start:start + 500]
+        responses.update(db_logging.execute(
+            select(CheckInSyncScan.client_scan_id, CheckInSyncScan.response)
+            .where(CheckInSyncScan.client_scan_id.in_(chunk))).tuples().all())
+    return responses
+
+def rollback_and_invalidate(db: Session, card_ids: list[str]) -> None:
+    """ Reverts members.db changes done by checkin_process() and drops cache entries already updated for these members """
+    db.rollback()
+    for card_id in card_ids:
+        checkin_cache.invalidate_member(card_id)
+        checkin_debounce.forget(card_id)
+
+def commit_or_invalidate(db: Session, card_ids: list[str]) -> None:
+    """ Commits members.db changes done by checkin_process(). 
+        On failure cache entries already updated for these members are dropped.
+    """
+    try:
+        db.commit()
+    except Exception:
+        rollback_and_invalidate(db, card_ids)
+        raise
+#===========================================================
+
+router = APIRouter()
+
+CHECKIN_SYNC_MAX_SCANS: int = 1000
+#===========================================================
 
-    db.commit()
-    db.refresh(member)
-    if member_pass: 
-        db.refresh(member_pass)
+@router.post("/logging/checkin",
+             response_model=Resp_ChecIn_Inst,
+             response_model_exclude_none=True,
+             response_model_exclude_unset=True,
+             status_code=status.HTTP_202_ACCEPTED,
+             description="202 means the scan was validated and queued, not yet written: the CheckIn row is "
+                         "committed in the next batch [~50 ms, \"id\" is not returned]. A crash of the server "
+                         "before that loses the row. Scanners that must not lose scans use \"/logging/checkin/sync\", "
+                         "which answers only after the rows are committed.")
+def post_checkin_add(req: Req_CheckIn_Add,
+                     db: Session = Depends(utils.get_db_members),
+                     db_logging: Session = Depends(utils.get_db_checkins)):
+    check_in: CheckIn = checkin_process(db, db_logging, req, datetime.now())
+    commit_or_invalidate(db, [req.member_card_id])
 
-    # Add new row to checkin history --> return response
-    db_logging.add(check_in)
-    db_logging.commit()
-    db_logging.refresh(check_in)
+    # Queue new row to checkin history [written in batches, "id" is not known yet] --> return response
+    checkin_writer.submit(check_in)
     return check_in
+
+@router.post("/logging/checkin/sync",
+             response_model=Resp_CheckIn_Sync_Batch,
+             response_model_exclude_none=True,
+             status_code=status.HTTP_200_OK)
+def post_checkin_sync(req: Req_CheckIn_Sync_Batch,
+                      db: Session = Depends(utils.get_db_members),
+                      db_logging: Session = Depends(utils.get_db_checkins)):
+    """ Replays scans buffered by an offline scanner [in the order given].
+        Every scan goes through the same validation as "/logging/checkin", using its original time.
+        All members.db changes are committed at once, all CheckIn rows are written as one transaction
+        before the response --> scanner may drop its buffer as soon as it gets the answer.
+        Outcomes are stored by "client_scan_id": a re-sent scan gets its original outcome back, it is not replayed again.
+
+        CheckIn rows and outcomes are committed first, members.db [entries used] after them:
+            checkins.db fails --> members.db is rolled back, the re-sent batch is replayed from scratch,
+            members.db fails  --> outcomes are stored already, the re-sent batch gets them back.
+        So one scan never consumes an entry twice [in the second case it consumes none].
+    """
+
+    if len(req.scans) > CHECKIN_SYNC_MAX_SCANS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Too many scans in one batch. Maximum is {CHECKIN_SYNC_MAX_SCANS}")
+
+    now = datetime.now()
+    results: list[Resp_CheckIn_Sync] = []
+    check_ins: list[CheckIn] = []
+    card_ids: list[str] = []
+    seen_scan_ids: set[str] = set()
+    stored_responses = get_sync_scan_responses(db_logging, [scan.client_scan_id for scan in req.scans])
+    new_results: list[Resp_CheckIn_Sync] = []       # To be stored
+    accepted_results: list[Resp_CheckIn_Sync] = []  # In the order of "check_ins"
+
+    for scan in req.scans:
+        # Batch re-sent [response was lost] --> original outcome
+        if scan.client_scan_id in stored_responses and scan.client_scan_id not in seen_scan_ids:
+            seen_scan_ids.add(scan.client_scan_id)
+            results.append(Resp_CheckIn_Sync.model_validate_json(stored_responses[scan.client_scan_id]))
+            continue
+
+        # Same scan sent twice in one batch --> keep the first one
+        if scan.client_scan_id in seen_scan_ids:
+            results.append(Resp_CheckIn_Sync(client_scan_id=scan.client_scan_id,
+                                             status_code=status.HTTP_409_CONFLICT,
+                                             detail="Duplicate client_scan_id in the batch"))
+            continue
+        seen_scan_ids.add(scan.client_scan_id)
+
+        # Scanner clock is trusted for the past only
+        scan_time = scan.date_time
+        if scan_time.tzinfo is not None:
+            scan_time = scan_time.astimezone().replace(tzinfo=None)
+        scan_time = min(scan_time, now)
+
+        try:
+            check_in = checkin_process(db, db_logging, scan, scan_time)
+        except HTTPException as e:
+            result = Resp_CheckIn_Sync(client_scan_id=scan.client_scan_id,
+                                       status_code=e.status_code,
+                                       detail=e.detail)
+            results.append(result)
+            new_results.append(result)
+            continue
+
+        check_ins.append(check_in)
+        card_ids.append(scan.member_card_id)
+        result = Resp_CheckIn_Sync(client_scan_id=scan.client_scan_id,
+                                   status_code=status.HTTP_202_ACCEPTED,
+                                   check_in=Resp_ChecIn_Inst.model_validate(check_in))
+        results.append(result)
+        new_results.append(result)
+        accepted_results.append(result)
+
+    def store_outcomes(db_logging: Session, ids: list[int]) -> None:
+        for result, id in zip(accepted_results, ids):
+            result.check_in.id = id
+        if new_results:
+            db_logging.execute(insert(CheckInSyncScan), [{
+                "client_scan_id": result.client_scan_id,
+                "processed_at": now,
+                "status_code": result.status_code,
+                "response": result.model_dump_json(),
+            } for result in new_results])
+
+    try:
+        checkin_writer.write(check_ins, before_commit=store_outcomes)
+    except Exception:
+        rollback_and_invalidate(db, card_ids)
+        raise
+    commit_or_invalidate(db, card_ids)
+    return Resp_CheckIn_Sync_Batch(items=results)
+#===========================================================
+
+""" EXPORT
+    Whole CheckIn log of a date range streamed as a file: rows go from a server-side cursor straight
+    to CSV / Parquet chunks --> memory does not depend on the range size.
+"""
+@router.get("/logging/checkin/export",
+            response_class=StreamingResponse,
+            summary="Check-in log of the days [date_from, date_to] as CSV or Parquet")
+def get_checkin_export(date_from: date,
+                       date_to: date,
+                       format: Literal["csv", "parquet"] = "csv",
+                       validated_by_card_id: str | None = None,
+                       member_card_id: str | None = None,
+                       hall: str | None = None,
+                       is_successful: bool | None = None,
+                       external_provider_id: int | None = None):
+    if date_to < date_from:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="date_to is earlier than date_from")
+    if format == "parquet" and checkin_export.is_parquet_available() is False:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail="Parquet export requires \"pyarrow\" to be installed")
+
+    query = checkin_export.export_query(date_from, date_to, {
+        "validated_by_card_id": validated_by_card_id,
+        "member_card_id": member_card_id,
+        "hall": hall,
+        "is_successful": is_successful,
+        "external_provider_id": external_provider_id,
+    })
+    stream, media_type = {
+        "csv": (checkin_export.stream_csv, "text/csv"),
+        "parquet": (checkin_export.stream_parquet, "application/vnd.apache.parquet"),
+    }[format]
+
+    def content():
+        # Own sessions [archived months + live DB]: request dependencies may be closed while the response is still being sent
+        yield from stream(checkin_export.iterate_chunks_for_range(date_from, date_to, query))
+
+    filename = "checkins_{date_from}_{date_to}.{format}".format(date_from=date_from, date_to=date_to, format=format)
+    return StreamingResponse(content(),
+                             media_type=media_type,
+                             headers={"Content-Disposition": f"attachment; filename=\"{filename}\""})
+#===========================================================
+
+""" LIVE CHECK-INS
+    Every committed CheckIn is pushed to subscribers [no polling, no queries].
+    Optional filters: hall, validated_by_card_id.
+"""
+CHECKIN_STREAM_KEEPALIVE_SECONDS: int = 15
+
+@router.get("/logging/checkin/stream",
+            response_class=StreamingResponse)
+async def get_checkin_stream(request: Request,
+                             hall: str | None = None,
+                             validated_by_card_id: str | None = None):
+    """ Server-Sent Events: one "checkin" event per committed CheckIn """
+    subscription = checkin_broadcaster.subscribe(hall=hall, validated_by_card_id=validated_by_card_id)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    row = await asyncio.wait_for(subscription.get(), timeout=CHECKIN_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if row is None:
+                    break
+                data = Resp_ChecIn_Inst.model_validate(row).model_dump_json(exclude_none=True)
+                yield f"event: checkin\nid: {row['id']}\ndata: {data}\n\n"
+        finally:
+            checkin_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(events(),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.websocket("/logging/checkin/ws")
+async def websocket_checkin_stream(websocket: WebSocket,
+                                   hall: str | None = None,
+                                   validated_by_card_id: str | None = None):
+    """ WebSocket: one JSON message per committed CheckIn """
+    await websocket.accept()
+    subscription = checkin_broadcaster.subscribe(hall=hall, validated_by_card_id=validated_by_card_id)
+
+    # Socket is read alongside [messages of the client are ignored] --> disconnect is noticed
+    # at once, not only by the next send, and the subscription does not outlive the client
+    receive = asyncio.create_task(websocket.receive())
+    get = asyncio.create_task(subscription.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait({receive, get}, return_when=asyncio.FIRST_COMPLETED)
+            if receive in done:
+                if receive.result()["type"] == "websocket.disconnect":
+                    break
+                receive = asyncio.create_task(websocket.receive())
+
+            if get in done:
+                row = get.result()
+                if row is None:     # Broadcaster closed [shutdown]
+                    await websocket.close()
+                    break
+                await websocket.send_text(Resp_ChecIn_Inst.model_validate(row).model_dump_json(exclude_none=True))
+                get = asyncio.create_task(subscription.get())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receive.cancel()
+        get.cancel()
+        checkin_broadcaster.unsubscribe(subscription)
 #===========================================================
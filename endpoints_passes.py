@@ -1,9 +1,10 @@
 from datetime import date, timedelta
 
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Query, Session
 
+from checkin_cache import cache as checkin_cache
 from models import Member, ExternalProvider, MemberPass, PassType
 from schemas import Req_Create_ExternalProviders, Req_MemberPass_Add, Req_PassTypes_Create, Req_PassTypes_Update, Req_Update_ExternalProviders, Resp_Instance_ExternalProviders, Resp_MemberPass_Inst, Resp_PassTypes_Inst
 
@@ -41,13 +42,17 @@ def get_pass_type_by_name_not_deleted(db: Session, name: str) -> PassType:
 
 """ UTILS: memberPass
 """
-def get_member_pass_active_internal_by_member_id(db: Session, member_card_id: str):
+def get_member_pass_active_internal_by_member_id(db: Session, member_card_id: str, day: date = None):
     """ For now only one active MemberPass is possible to have for one User --> 
         It is a good function to get current MemberPass
+        "day": day the pass has to be active on [today by default, replayed offline scans pass their own]
     """
+    return query_member_pass_active_internal(db, member_card_id, day).first()
+
+def query_member_pass_active_internal(db: Session, member_card_id: str, day: date = None) -> Query:
     return db.query(MemberPass).filter(MemberPass.member_card_id == member_card_id,
                                        or_(
-                                           MemberPass.expiration_date > date.today(),
+                                           MemberPass.expiration_date > (day or date.today()),
                                            MemberPass.expiration_date.is_(None)
                                        ),
                                        or_(
@@ -55,7 +60,29 @@ def get_member_pass_active_internal_by_member_id(db: Session, member_card_id: st
                                            MemberPass.entries_left.is_(None)
                                        ),
                                        MemberPass.is_ext_event_pass.is_(False),
-                                       MemberPass.is_closed.is_(False)).first()
+                                       MemberPass.is_closed.is_(False))
+
+def explain_member_pass_active_internal(db: Session) -> list[str]:
+    """ Query plan of the active MemberPass lookup done on every scan.
+        Raises RuntimeError if SQLite would scan the whole "member_passes" table instead of an index seek.
+    """
+    plan = utils.explain_query_plan(db, query_member_pass_active_internal(db, "card_id"))
+    if not any(detail.startswith("SEARCH member_passes USING INDEX") for detail in plan):
+        raise RuntimeError("Active MemberPass lookup is not an index seek: {plan}".format(plan=plan))
+    return plan
+
+def consume_member_pass_entry(db: Session, member_pass_id: int) -> int | None:
+    """ Atomically takes one entry from the MemberPass: "UPDATE ... WHERE entries_left > 0 RETURNING".
+        Returns entries left after the decrement or None if there was nothing to take
+        [pass is exhausted / closed, e.g. by a concurrent scan]. Commit is left to the caller.
+    """
+    return db.execute(update(MemberPass)
+                      .where(MemberPass.id == member_pass_id,
+                             MemberPass.entries_left > 0,
+                             MemberPass.is_closed.is_(False))
+                      .values(entries_left=MemberPass.entries_left - 1)
+                      .returning(MemberPass.entries_left))\
+        .scalar_one_or_none()
 
 def has_member_active_internal_pass(db: Session, member_card_id: str) -> bool:
     # Passes for external events are not counted.
@@ -93,6 +120,7 @@ def post_external_provider_create(
     db.add(provider)
     db.commit()
     db.refresh(provider)
+    checkin_cache.invalidate_external_providers()
     return provider
 
 @router.get("/external_providers/{id}",
@@ -139,6 +167,7 @@ def put_external_provider_update(req: Req_Update_ExternalProviders,
     # Save changes in Database
     db.commit()
     db.refresh(provider)
+    checkin_cache.invalidate_external_providers()
     return provider
 
 def delete_external_provider():
@@ -244,6 +273,7 @@ def post_member_pass_add(req: Req_MemberPass_Add,
     db.add(member_pass)
     db.commit()
     db.refresh(member_pass)
+    checkin_cache.invalidate_member_pass(req.member_card_id)
     return member_pass
 
 @router.get("/member_pass/active/{member_card_id}",
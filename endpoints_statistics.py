@@ -1,12 +1,15 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy import func, or_
-from sqlalchemy.orm import Session
+from sqlalchemy import Integer, case, cast, func, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from models import CheckIn, Member
+from models import CheckIn, CheckInDailyRollup, CheckInHourlyRollup, ExternalProvider, Member, MemberPass, PassType
+import checkin_archive
+from password_hashing import pool as hashing_pool
 import project_utils as utils
-from schemas import Req_Statistics_InstructorCheckInsDetailed, Req_Statistics_InstructorsCheckIns, Resp_Paginated_Statistics_InstructorCheckInsDetailed, Resp_Statistics_InstructorCheckInsDetailed, Resp_Statistics_InstructorsCheckIns
+from schemas import Req_Statistics_Attendance, Resp_Statistics_HashingPool, Req_Statistics_Revenue, Resp_Statistics_Revenue, Resp_Statistics_RevenueRow, Req_Statistics_InstructorCheckInsDetailed, Req_Statistics_InstructorsCheckIns, Resp_Paginated_Statistics_InstructorCheckInsDetailed, Resp_Statistics_Attendance, Resp_Statistics_HallOccupancy, Resp_Statistics_InstructorCheckInsDetailed, Resp_Statistics_InstructorsCheckIns, Resp_Statistics_PassTypeAttendance
 #===========================================================
 
 router = APIRouter()
@@ -14,67 +17,252 @@ router = APIRouter()
 
 @router.post("/statistics/instructors_checkins",
              response_model=list[Resp_Statistics_InstructorsCheckIns])
-def post_statistics_admin_instructors_checkins(req: Req_Statistics_InstructorsCheckIns,
-                                               db: Session = Depends(utils.get_db_checkins)):
+async def post_statistics_admin_instructors_checkins(req: Req_Statistics_InstructorsCheckIns,
+                                                     db: AsyncSession = Depends(utils.get_db_checkins_async)):
+    # Read from the daily rollup --> (days x validators) rows instead of the whole CheckIn log
     results = (
-        db.query(CheckIn.validated_by_card_id,
-                 CheckIn.validated_by_name, 
-                 CheckIn.validated_by_surnamename,
-                 func.count().label("count"))
-        .filter(CheckIn.date_time.between(req.date_from, req.date_to),
-                CheckIn.is_successful.is_(True))
-        .order_by(CheckIn.date_time, CheckIn.validated_by_card_id)
-        .all()
-    )
+        await db.execute(
+            select(CheckInDailyRollup.validated_by_card_id,
+                   func.coalesce(func.max(CheckInDailyRollup.validated_by_name), "").label("validated_by_name"),
+                   func.coalesce(func.max(CheckInDailyRollup.validated_by_surnamename), "").label("validated_by_surnamename"),
+                   func.sum(CheckInDailyRollup.successful).label("count"))
+            .where(CheckInDailyRollup.day.between(req.date_from, req.date_to),
+                   CheckInDailyRollup.validated_by_card_id != "")
+            .group_by(CheckInDailyRollup.validated_by_card_id)
+            .order_by(CheckInDailyRollup.validated_by_card_id)
+        )
+    ).all()
     return results
 
 @router.post("/statistics/instructor_checkins/detailed",
              response_model=Resp_Paginated_Statistics_InstructorCheckInsDetailed)
-def post_statistics_admin_instructors_checkins_detailed(req: Req_Statistics_InstructorCheckInsDetailed,
-                                                        db: Session = Depends(utils.get_db_checkins)):
+async def post_statistics_admin_instructors_checkins_detailed(req: Req_Statistics_InstructorCheckInsDetailed):
     
-    # Validate and correcr input if needed
-    page = max(1, req.page)
-    page_size = min(max(1, req.page_size), 200)
+    # Validate and correcr input if needed [pages are 0-based]
+    page = max(0, req.page or 0)
+    page_size = min(max(1, req.page_size or 50), 200)
+
+    # Make an query [served by ix_checkins_validator_date_time_id]
+    conditions = [CheckIn.validated_by_card_id == req.validated_by_card_id,
+                  CheckIn.date_time.between(req.date_from, req.date_to)]
+    seek = []
+    date_time: datetime = None
+    if req.cursor is not None:
+        # Lower bound of the index range moves to the cursor --> every page is a seek, not a scan from "date_from"
+        date_time, id = utils.decode_cursor(req.cursor, datetime, int)
+        seek = [CheckIn.validated_by_card_id == req.validated_by_card_id,
+                CheckIn.date_time >= date_time,
+                CheckIn.date_time <= req.date_to,
+                tuple_(CheckIn.date_time, CheckIn.id) > tuple_(date_time, id)]
 
-    # Make an query
     query = (
-        db.query(CheckIn.member_name,
-                 CheckIn.member_surname,
-                 CheckIn.date_time,
-                 CheckIn.is_successful,
-                 CheckIn.rejected_reason)
-        .filter(CheckIn.validated_by_card_id == req.validated_by_card_id,
-                CheckIn.date_time.between(req.date_from, req.date_to))
-        .order_by(CheckIn.date_time)
+        select(CheckIn.id,
+               CheckIn.member_name,
+               CheckIn.member_surname,
+               CheckIn.date_time,
+               CheckIn.is_successful,
+               CheckIn.rejected_reason)
+        .where(*(seek or conditions))
+        .order_by(CheckIn.date_time, CheckIn.id)
     )
+    count_query = select(func.count()).select_from(CheckIn).where(*conditions)
 
-    # Get total amount
-    total: int = query.count()
-    remaining: int = max(0, total - page * page_size)
+    # Counting is linear in the range --> only for the first page unless asked explicitly
+    count_total: bool = req.include_total or (req.include_total is None and req.cursor is None)
+    total: int = 0 if count_total else None
+    remaining: int = None
+    offset: int = 0 if req.cursor is not None else page * page_size
+
+    # Archived months first, live DB last: rows come out in (date_time, id) order across partitions.
+    # Get all items [one more --> tells whether there is a next page]
+    result = []
+    for partition, session_factory in checkin_archive.sessions_for_range_async(req.date_from, req.date_to):
+        page_full = len(result) > page_size
+        if page_full and not count_total:
+            break
+        if partition is not None and date_time is not None and partition.month_end <= date_time.date() and not count_total:
+            continue    # Whole month is before the cursor
+
+        async with session_factory() as db:
+            if count_total or offset:
+                count: int = (await db.execute(count_query)).scalar_one()
+                total = total + count if count_total else None
+                if offset >= count:
+                    offset -= count
+                    continue
+            if not page_full:
+                result += (await db.execute(query.offset(offset).limit(page_size + 1 - len(result)))).all()
+                offset = 0
+
+    if count_total and req.cursor is None:
+        remaining = max(0, total - (page + 1) * page_size)
+
+    next_cursor: str = None
+    if len(result) > page_size:
+        result = result[:page_size]
+        next_cursor = utils.encode_cursor(result[-1].date_time, result[-1].id)
 
-    # Get all items --> convert to proper form
-    result = (
-        query
-        .offset(req.page * req.page_size)
-        .limit(req.page_size)
-        .all()
-    )
     items = [Resp_Statistics_InstructorCheckInsDetailed(
         name=name,
         surname=surname,
         date_time=date_time,
         is_successful=is_successful,
         rejected_reason=rejected_reason,
-    ) for (name, surname, date_time, is_successful, rejected_reason) in result]
+    ) for (_, name, surname, date_time, is_successful, rejected_reason) in result]
 
     return Resp_Paginated_Statistics_InstructorCheckInsDetailed(
         total=total,
         page=page,
         page_size=page_size,
         remaining=remaining,
+        next_cursor=next_cursor,
         items=items
     )
 #===========================================================
 
+""" ATTENDANCE ANALYTICS
+    Read from the hourly rollup: one GROUP BY returns at most 7 x 24 x halls x passes counters,
+    whatever the amount of check-ins in the range. Python only reshapes them.
+"""
+@router.post("/statistics/attendance",
+             response_model=Resp_Statistics_Attendance)
+async def post_statistics_attendance(req: Req_Statistics_Attendance,
+                                     db: AsyncSession = Depends(utils.get_db_checkins_async)):
+    if req.date_to < req.date_from:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="date_to is earlier than date_from")
 
+    conditions = [CheckInHourlyRollup.hour >= req.date_from,
+                  CheckInHourlyRollup.hour < req.date_to + timedelta(days=1)]
+    if req.hall is not None:
+        conditions.append(CheckInHourlyRollup.hall == req.hall)
+
+    # SQLite "%w": 0 - Sunday
+    weekday = cast(func.strftime("%w", CheckInHourlyRollup.hour), Integer)
+    hour = cast(func.strftime("%H", CheckInHourlyRollup.hour), Integer)
+    entries = func.sum(CheckInHourlyRollup.successful)
+    if req.only_successful is False:
+        entries = entries + func.sum(CheckInHourlyRollup.rejected)
+
+    bins = (
+        await db.execute(
+            select(weekday, hour,
+                   CheckInHourlyRollup.hall,
+                   CheckInHourlyRollup.pass_name,
+                   CheckInHourlyRollup.external_provider_name,
+                   entries)
+            .where(*conditions)
+            .group_by(weekday, hour,
+                      CheckInHourlyRollup.hall,
+                      CheckInHourlyRollup.pass_name,
+                      CheckInHourlyRollup.external_provider_name)
+        )
+    ).all()
+
+    heatmap = [[0] * 24 for _ in range(7)]
+    halls: dict[str, list[int]] = {}
+    pass_types: dict[tuple[str, str], int] = {}
+    for day_of_week, hour_of_day, hall, pass_name, external_provider_name, count in bins:
+        heatmap[(day_of_week + 6) % 7][hour_of_day] += count
+        halls.setdefault(hall, [0] * 24)[hour_of_day] += count
+        pass_types[(pass_name, external_provider_name)] = pass_types.get((pass_name, external_provider_name), 0) + count
+
+    days = (req.date_to - req.date_from).days + 1
+    return Resp_Statistics_Attendance(
+        total=sum(pass_types.values()),
+        days=days,
+        heatmap=heatmap,
+        halls=[Resp_Statistics_HallOccupancy(hall=hall or None,
+                                             entries=counts,
+                                             average_per_day=[round(count / days, 2) for count in counts])
+               for hall, counts in sorted(halls.items())],
+        pass_types=[Resp_Statistics_PassTypeAttendance(pass_name=pass_name or None,
+                                                       external_provider_name=external_provider_name or None,
+                                                       entries=count)
+                    for (pass_name, external_provider_name), count
+                    in sorted(pass_types.items(), key=lambda item: item[1], reverse=True)],
+    )
+#===========================================================
+
+""" REVENUE
+    Money columns are Numeric in the model but SQLite keeps them as REAL --> summing them directly
+    accumulates float errors. Every amount is turned into integer cents first, summed exactly by SQLite
+    and converted to Decimal only at the end.
+    Price is taken from the PassType [MemberPass does not keep the price it was sold for].
+"""
+REVENUE_PERIODS = {
+    "day": lambda column: func.date(column),
+    "week": lambda column: func.date(column, "weekday 0", "-6 days"),     # Monday of the week
+    "month": lambda column: func.strftime("%Y-%m-01", column),
+}
+
+def to_cents(amount):
+    return cast(func.round(func.coalesce(amount, 0) * 100), Integer)
+
+def from_cents(cents: int | None) -> Decimal:
+    return Decimal(cents or 0).scaleb(-2)
+
+@router.post("/statistics/revenue",
+             response_model=Resp_Statistics_Revenue)
+async def post_statistics_revenue(req: Req_Statistics_Revenue,
+                                  db: AsyncSession = Depends(utils.get_db_members_async)):
+    if req.date_to < req.date_from:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="date_to is earlier than date_from")
+
+    period = REVENUE_PERIODS[req.group_by](MemberPass.purchase_date)
+    price = to_cents(PassType.price)
+    is_external = MemberPass.external_provider_id.is_not(None)
+    is_partial = ExternalProvider.is_partial_payment.is_(True)
+
+    # One pass over the passes of the range [ix_member_passes_purchase_date]
+    rows = (
+        await db.execute(
+            select(period,
+                   MemberPass.pass_type_id,
+                   func.max(MemberPass.pass_type_name),
+                   func.count(),
+                   func.sum(price),
+                   func.sum(case((is_external, 1), else_=0)),
+                   func.sum(case((is_external, price), else_=0)),
+                   func.sum(case((is_partial, to_cents(ExternalProvider.partial_payment)), else_=0)))
+            .select_from(MemberPass)
+            .outerjoin(PassType, MemberPass.pass_type_id == PassType.id)
+            .outerjoin(ExternalProvider, MemberPass.external_provider_id == ExternalProvider.id)
+            .where(MemberPass.purchase_date.between(req.date_from, req.date_to))
+            .group_by(period, MemberPass.pass_type_id)
+            .order_by(period, MemberPass.pass_type_id)
+        )
+    ).all()
+
+    items = [Resp_Statistics_RevenueRow(
+        period=date.fromisoformat(row_period),
+        pass_type_id=pass_type_id,
+        pass_type_name=pass_type_name,
+        passes_sold=passes_sold,
+        revenue=from_cents(revenue),
+        external_provider_passes=external_provider_passes,
+        external_provider_revenue=from_cents(external_provider_revenue),
+        partial_payments=from_cents(partial_payments),
+    ) for (row_period, pass_type_id, pass_type_name, passes_sold, revenue,
+           external_provider_passes, external_provider_revenue, partial_payments) in rows]
+
+    revenue = sum((item.revenue for item in items), Decimal(0))
+    external_provider_revenue = sum((item.external_provider_revenue for item in items), Decimal(0))
+    return Resp_Statistics_Revenue(
+        group_by=req.group_by,
+        passes_sold=sum(item.passes_sold for item in items),
+        revenue=revenue,
+        external_provider_revenue=external_provider_revenue,
+        external_provider_share=float(external_provider_revenue / revenue) if revenue else 0.0,
+        partial_payments=sum((item.partial_payments for item in items), Decimal(0)),
+        items=items,
+    )
+#===========================================================
+
+@router.get("/statistics/hashing",
+            response_model=Resp_Statistics_HashingPool)
+def get_statistics_hashing():
+    """ Load of the password hashing pool of this worker process """
+    return hashing_pool.stats()
+#===========================================================
@@ -1,19 +1,28 @@
 import secrets
 from pathlib import Path
-from datetime import datetime, timedelta
-from smtplib import SMTPServerDisconnected
-from fastapi.responses import FileResponse, HTMLResponse
+from datetime import date, datetime, timedelta
+from typing import Literal, Optional
+from fastapi.responses import HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from itsdangerous import URLSafeTimedSerializer
-from fastapi import APIRouter, Query, Depends, HTTPException, status
+from fastapi import APIRouter, Header, Query, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi_utils.tasks import repeat_every
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, select
+from sqlalchemy import and_, func, or_, select, tuple_
 from sqlalchemy.exc import IntegrityError
 
+from checkin_cache import cache as checkin_cache
+import members_search
+import qr_render
+import qr_store
+import session_tokens
+from password_hashing import pool as hashing_pool
+from post_commit import pipeline as post_commit_pipeline
 from database import SessionLocal_Members
 from models import Member
-from schemas import Req_LogIn_Username, Req_Members_Add, Req_SignUp, Resp_Members_Inst, Resp_Paginated_Members_Instances
+from schemas import Req_LogIn_Refresh, Req_LogIn_Username, Req_LogOut, Req_Members_Add, Req_SignUp, Resp_LogIn_Session, Resp_LogIn_Tokens, Resp_Members_Inst, Resp_Paginated_Members_Instances
 
 import project_utils as utils
 #===========================================================
@@ -42,30 +51,93 @@ def confirm_token(token: str, expiration: int = 6*60*60) -> dict:
              response_model_exclude_none=True,
              response_model_exclude_unset=True,
              status_code=status.HTTP_202_ACCEPTED)
-def post_login_by_username(login_data: Req_LogIn_Username,
-                           db: Session = Depends(utils.get_db_members)):
+async def post_login_by_username(login_data: Req_LogIn_Username,
+                                 db: AsyncSession = Depends(utils.get_db_members_async)):
     """ Validates if user with such login exists &&
         If the password provided was correct.
         Everything is OK --> responces with user data. 
     """
 
     # Validate username
-    member: Member | None = db.execute(select(Member)\
+    member: Member | None = (await db.execute(select(Member)\
         .where(and_(Member.username == login_data.username,
-                    Member.activated.is_(True))))\
+                    Member.activated.is_(True)))))\
         .scalar_one_or_none()
 
     if member is None:
         raise HTTPException(status_code=401,
                             detail="Wrong username")
     
-    is_password_correct = utils.verify_hash(login_data.password, member.password_hash)
+    # Argon2 is CPU-bound --> bounded process pool, off the event loop
+    is_password_correct, new_hash = await hashing_pool.verify_async(login_data.password, member.password_hash)
     if not is_password_correct:
         raise HTTPException(status_code=401,
                             detail="Wrong password")
+
+    # Hash made with old argon2 parameters --> upgrade it while the password is known
+    if new_hash is not None:
+        member.password_hash = new_hash
+        await db.commit()
     
     # Return user info
     return member
+
+@router.post("/login/token",
+             response_model=Resp_LogIn_Tokens,
+             status_code=status.HTTP_202_ACCEPTED)
+async def post_login_token(login_data: Req_LogIn_Username,
+                           db: AsyncSession = Depends(utils.get_db_members_async)):
+    """ Same checks as "/login/username", returns access + refresh tokens with the member.
+        Further requests send "Authorization: Bearer <access_token>" instead of the password.
+    """
+    member = await post_login_by_username(login_data, db)
+    return {**session_tokens.issue_tokens(member), "member": member}
+
+@router.post("/login/refresh",
+             response_model=Resp_LogIn_Tokens,
+             status_code=status.HTTP_200_OK)
+async def post_login_refresh(req: Req_LogIn_Refresh,
+                             db: AsyncSession = Depends(utils.get_db_members_async)):
+    """ Exchanges a refresh token for a new pair. Refresh token can be used only once [by any worker] """
+    session = await run_in_threadpool(session_tokens.verify_token, req.refresh_token, session_tokens.TOKEN_TYPE_REFRESH)
+
+    # Member could be deleted / deactivated / get other rights since the login
+    member: Member | None = (await db.execute(select(Member)\
+        .where(and_(Member.id == session.member_id,
+                    Member.activated.is_(True)))))\
+        .scalar_one_or_none()
+    if member is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Member does not exist anymore")
+
+    # Two requests with the same token --> only the first one revokes it
+    if not await run_in_threadpool(session_tokens.revoke_token, session):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Token revoked",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return {**session_tokens.issue_tokens(member), "member": member}
+
+@router.post("/logout",
+             status_code=status.HTTP_200_OK)
+def post_logout(req: Req_LogOut,
+                session: session_tokens.TokenData = Depends(session_tokens.get_current_session)):
+    session_tokens.revoke_token(session)
+    if req.refresh_token:
+        refresh = session_tokens.verify_token(req.refresh_token, session_tokens.TOKEN_TYPE_REFRESH)
+        if refresh.member_id == session.member_id:
+            session_tokens.revoke_token(refresh)
+    return {"details": "Logged out"}
+
+@router.get("/login/session",
+            response_model=Resp_LogIn_Session)
+def get_login_session(session: session_tokens.TokenData = Depends(session_tokens.get_current_session)):
+    """ Who is the bearer of the token [no database access] """
+    return {
+        "member_id": session.member_id,
+        "card_id": session.card_id,
+        "account_type": session.account_type,
+        "expires_at": datetime.fromtimestamp(session.expires_at),
+    }
 #===========================================================
 
 """ REGISTRATION
@@ -89,7 +161,7 @@ def post_signup(req: Req_SignUp,
                             detail="Member with provided email already registered and confirmed")
     
     # Hash the password
-    pwd_hash = utils.hash_string(req.password)
+    pwd_hash = hashing_pool.hash(req.password)
     token = generate_confirmation_token(req.email, pwd_hash)
     key = secrets.token_urlsafe(16)
 
@@ -123,6 +195,7 @@ def post_signup(req: Req_SignUp,
         db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Unexcpected error. Operation reverted")
+    checkin_cache.invalidate_member(member.card_id)
 
     # Send confirmation mail
     utils.SendGrid_send_confirmation_mail(req.email, key)
@@ -161,23 +234,16 @@ def get_confirm_email(key: str,
     if member.password_hash != pwd_hash:
         raise HTTPException(400, "Invalid or stale confirmation link.")
 
-    # mark confirmed --> update database
+    # mark confirmed --> update database [welcome mail is stored in the outbox by the same commit]
     member.activated = True
     member.token = None
+    outbox = utils.queue_welcome_email(db, member.card_id, reset_password=False)
+    db.commit()
+    checkin_cache.invalidate_member(member.card_id)
 
-    # Generate QR --> Send welcome mail
-    try:
-        qr_path = utils.generate_qr_code_member(member=member)
-        utils.SendGrid_send_welcome_email_member(member=member, 
-                                                 qr_path=qr_path, password="Confidential")
-        db.commit()
-        db.refresh(member)
-    except SMTPServerDisconnected:
-        # Delete generated qr_code --> raise corresponding exception
-        qr_path.unlink()
-        db.rollback()
-        raise HTTPException(status_code=400,
-                            detail="Could not send an email to user")
+    # Generate QR --> Send welcome mail [after the commit, retried on failures]
+    post_commit_pipeline.submit("welcome email {card_id}".format(card_id=member.card_id),
+                                utils.deliver_welcome_email, outbox.id)
 
     # Redirect to your real “account confirmed” page or show a message:
     return HTMLResponse("<h3>Your account has been confirmed. You may now log in.</h3>")
@@ -185,13 +251,13 @@ def get_confirm_email(key: str,
 @router.post("/api/signup",
             status_code=status.HTTP_200_OK)
 async def signup_static_html_page(req: Req_SignUp,
-                                  db: Session = Depends(utils.get_db_members)):
+                                  db: AsyncSession = Depends(utils.get_db_members_async)):
     
     # Get member with given email
-    member: Member | None = db.execute(select(Member)\
+    member: Member | None = (await db.execute(select(Member)\
         .where(or_(
             Member.email == req.email,
-            Member.username == req.username)))\
+            Member.username == req.username))))\
         .scalar_one_or_none()
     
     # Do not let register if email already exists
@@ -199,8 +265,8 @@ async def signup_static_html_page(req: Req_SignUp,
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Member with provided email already registered and confirmed")
 
-    # Hash the password
-    pwd_hash = utils.hash_string(req.password)
+    # Hash the password [off the event loop]
+    pwd_hash = await hashing_pool.hash_async(req.password)
 
     # Gather member data
     member_data = req.model_dump()
@@ -209,25 +275,24 @@ async def signup_static_html_page(req: Req_SignUp,
     member_data["activated"] = True # No confirmation email needed
     member_data["token"] = None
     member_data["key"] = None
-    member_data["card_id"] = utils.generate_qr_code_value(db)
+    member_data["card_id"] = await utils.generate_qr_code_value_async(db)
     member: Member = utils.get_member_from_dict(member_data)
 
     # Add new member to a DB || protect from unexpected errors
     try:
         db.add(member)
-        db.commit()
+        await db.commit()
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Unexcpected error. Operation reverted")
+    checkin_cache.invalidate_member(member.card_id)
     
-    # Generate QR code
-    qr_path = utils.generate_qr_code_member(member)
-
-    # Send welcome mail
-    # utils.SendGrid_send_welcome_email_member(member=member, 
-    #                                          qr_path=qr_path,
-    #                                          password=req.password)
+    # Generate QR code [after the commit; "/members/qr" renders it itself if asked earlier]
+    # Send welcome mail: not sent for self sign-ups at the moment --> send_email=False
+    # Off the event loop: submit() blocks on a full queue and runs the task itself if the pipeline is not started
+    await run_in_threadpool(post_commit_pipeline.submit, "new member card {card_id}".format(card_id=member.card_id),
+                            utils.deliver_member_card, member.card_id, None, False)
 
     # Return card id only - needed for QR code creation 
     return { "message": "registered", "card_id": member.card_id }
@@ -242,9 +307,20 @@ async def cleanup_unconfirmed_members() -> None:
                             .delete()
     db.commit()
     db.close()
+    checkin_cache.invalidate_members()
+
+def resend_pending_welcome_emails() -> int:
+    """ Welcome mails left in the outbox by a crash or by failed retries --> post-commit pipeline again """
+    with SessionLocal_Members() as db:
+        pending = utils.get_pending_welcome_emails(db)
+    for outbox_id, card_id in pending:
+        post_commit_pipeline.submit("welcome email {card_id}".format(card_id=card_id),
+                                    utils.deliver_welcome_email, outbox_id)
+    return len(pending)
 
 async def startup():
     await cleanup_unconfirmed_members()
+    resend_pending_welcome_emails()
 #===========================================================
 
 """ MEMBERS
@@ -267,9 +343,9 @@ def post_members_add(req: Req_Members_Add,
         raise HTTPException(status_code=400,
                             detail="Member with given email already registered")
     
-    # Construct member: generate new password --> write over default values
+    # Construct member: generate new password [welcome e-mail sets and sends a fresh one] --> write over default values
     password: str = utils.get_random_string(12)
-    pass_hash = utils.hash_string(password)
+    pass_hash = hashing_pool.hash(password)
     member_req = req.model_dump()
     member_req["password_hash"] = pass_hash
     member_req["activated"] = True  # If admin add the user -> no confirmation code is needed.
@@ -279,89 +355,140 @@ def post_members_add(req: Req_Members_Add,
     qr_value: str = utils.generate_qr_code_value(db)
     member.card_id = qr_value
 
-    # Generate QR Code
-    qr_path = utils.generate_qr_code_member(member=member)
-
-    # Send an email with the QR Code. 
-    if req.send_welcome_email:
-        try:
-            utils.SendGrid_send_welcome_email_member(member=member, 
-                                                     qr_path=qr_path, password=password)
-        except SMTPServerDisconnected:
-            # Delete generated qr_code --> raise corresponding exception
-            qr_path.unlink()
-            raise HTTPException(status_code=400,
-                                detail="Could not send an email to user")
-
-    # Add new member to a database --> Update the database.
+    # Add new member to a database [welcome mail is stored in the outbox by the same commit] --> Update the database.
     db.add(member)
+    outbox = utils.queue_welcome_email(db, member.card_id) if req.send_welcome_email else None
     db.commit()
     db.refresh(member)
+    checkin_cache.invalidate_member(member.card_id)
+
+    # Generate QR Code --> send an email with it [after the commit, retried on failures]
+    if outbox is not None:
+        post_commit_pipeline.submit("new member card {card_id}".format(card_id=member.card_id),
+                                    utils.deliver_welcome_email, outbox.id)
+    else:
+        post_commit_pipeline.submit("new member card {card_id}".format(card_id=member.card_id),
+                                    utils.deliver_member_card, member.card_id, None, False)
 
     # return from the function
     return member
 
+# Declared before "/members/{member_id}": otherwise "search" is taken as a member ID
+@router.get("/members/search",
+            response_model=list[Resp_Members_Inst],
+            response_model_exclude_none=True,
+            summary="Ranked prefix search over name, surname, email, phone and username")
+async def get_members_search(q: str = Query(..., min_length=2, max_length=100),
+                             limit: int = Query(20, ge=1, le=100),
+                             db: AsyncSession = Depends(utils.get_db_members_async)):
+    if members_search.is_available is False:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail="Full-text search is not supported by the SQLite build")
+    return await members_search.search_members(db, q, limit)
+
 @router.get("/members/{member_id}",
             response_model=Resp_Members_Inst,
             response_model_exclude_none=True,
             response_model_exclude_unset=True,
             status_code=status.HTTP_200_OK)
-def get_members_inst(member_id: str,
-                     db: Session = Depends(utils.get_db_members)):
+async def get_members_inst(member_id: str,
+                           db: AsyncSession = Depends(utils.get_db_members_async)):
     # Check of all who is adding is needed.
     # Check who is requesting [Instructor can not see info about another instructor]
     # ...
 
-    member: Member = utils.get_member_by_card_id_with_raise(db, member_id)
+    member: Member = await utils.get_member_by_card_id_with_raise_async(db, member_id)
     return member
 
 @router.get("/members",
             response_model=Resp_Paginated_Members_Instances,
             summary="List of members with pagination")
-def get_members_instances(page: int = Query(0, ge=0, le=1000),
-                          page_size: int = Query(100, ge=1, le=200),
-                          db: Session = Depends(utils.get_db_members)):
+async def get_members_instances(page: int = Query(0, ge=0, le=1000),
+                                page_size: int = Query(100, ge=1, le=200),
+                                cursor: Optional[str] = Query(None, description="\"next_cursor\" of the previous page [\"page\" is ignored]"),
+                                include_total: Optional[bool] = Query(None, description="[None - count only when no cursor is given]"),
+                                db: AsyncSession = Depends(utils.get_db_members_async)):
+    # Unique sort key --> (registration_date, id) of the last row is enough to continue
     query = (
-        db.query(Member)
-        .order_by(Member.registration_date)
+        select(Member)
+        .order_by(Member.registration_date, Member.id)
     )
+    if cursor is not None:
+        registration_date, id = utils.decode_cursor(cursor, date, int)
+        query = query.where(tuple_(Member.registration_date, Member.id) > tuple_(registration_date, id))
+    else:
+        query = query.offset(page * page_size)
 
-    total: int = query.count()
-    remaining: int = max(0, total - (page + 1) * page_size) # +1 to not multiply on 1
+    # Counting scans the whole table --> only for the first page unless asked explicitly
+    total: int = None
+    remaining: int = None
+    if include_total or (include_total is None and cursor is None):
+        total = (await db.execute(select(func.count()).select_from(Member))).scalar_one()
+        if cursor is None:
+            remaining = max(0, total - (page + 1) * page_size) # +1 to not multiply on 1
 
+    # One row more than needed --> tells whether there is a next page
     members: list[Member] = (
-        query
-        # .filter(Member.account_type != utils.AccountType.Root.value)
-        .offset(page * page_size)
-        .limit(page_size)
-        .all()
-    )
+        await db.execute(
+            query
+            # .where(Member.account_type != utils.AccountType.Root.value)
+            .limit(page_size + 1)
+        )
+    ).scalars().all()
+
+    next_cursor: str = None
+    if len(members) > page_size:
+        members = members[:page_size]
+        next_cursor = utils.encode_cursor(members[-1].registration_date, members[-1].id)
     
     return Resp_Paginated_Members_Instances(
         total=total,
         page=page,
         page_size=page_size,
         remaining=remaining,
+        next_cursor=next_cursor,
         items=members
     )
 
 @router.get("/members/qr/{member_id}")
 def get_members_qr_as_png(member_id: str,
+                          output: Literal["png", "svg", "compact"] = Query("png", alias="format"),
+                          if_none_match: Optional[str] = Header(default=None),
                           db: Session = Depends(utils.get_db_members)):
-    # Check member with given ID exists
-    member: Member = utils.get_member_by_card_id_with_raise(db, member_id)
+    """ Stored QR code of the member. Files exist only for members --> a stored file is answered
+        from memory / disk without the members DB, "If-None-Match" with the current ETag --> 304.
+        "format": png - full card [stored file], svg - vector, compact - 1-bit PNG without logo [see qr_render].
+    """
+    if output != "png":
+        return get_members_qr_variant(member_id, output, if_none_match, db)
 
-    # Check QR code is stored --> create if not
-    qr_path = Path(utils.PATH_QR_CODES, member_id).with_suffix(".png")
-    if qr_path.exists() is False:
-        # Create QR code
-        qr_path = utils.generate_qr_code_member(member)
+    stored = utils.qr_files.get(member_id)
+    if stored is None:
+        # Check member with given ID exists --> create QR code
+        member: Member = utils.get_member_by_card_id_with_raise(db, member_id)
+        utils.generate_qr_code_member(member)
+        stored = utils.qr_files.get(member_id)
+
+    headers = {"Cache-Control": "public, max-age=3600", # Cachisng
+               "ETag": stored.etag}
+    if qr_store.etag_matches(if_none_match, stored.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
     # return QR as an image
-    return FileResponse(
-        path=qr_path,
-        media_type="image/png",
-        filename=qr_path.name,
-        headers={"Cache-Control": "public, max-age=3600"} # Cachisng
-    )
+    headers["Content-Disposition"] = 'inline; filename="{name}"'.format(name=stored.path.name)
+    return Response(content=stored.png, media_type="image/png", headers=headers)
+
+def get_members_qr_variant(member_id: str, output: str, if_none_match: Optional[str], db: Session) -> Response:
+    """ SVG / compact PNG: rendered from the card ID [not stored], kept in the render cache """
+    member: Member = utils.get_member_by_card_id_with_raise(db, member_id)
+    image = qr_render.render(member_id, utils.get_qr_style_member(member), output)
+
+    headers = {"Cache-Control": "public, max-age=3600",
+               "ETag": qr_store.compute_etag(image)}
+    if qr_store.etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    extension = "svg" if output == "svg" else "png"
+    headers["Content-Disposition"] = 'inline; filename="{name}.{extension}"'.format(name=member_id, extension=extension)
+    return Response(content=image, media_type=qr_render.QR_MEDIA_TYPES[output], headers=headers)
 #===========================================================
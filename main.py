@@ -6,10 +6,16 @@ from fastapi.staticfiles import StaticFiles
 
 from contextlib import asynccontextmanager
 
-from endpoints_passes import router as router_passes
+from endpoints_passes import router as router_passes, explain_member_pass_active_internal
 from endpoints_userManagement import router as router_user_management, startup as startup_user_management
 from endpoints_logs import router as router_logging
 from endpoints_statistics import router as router_statistics
+from checkin_cache import cache as checkin_cache
+from checkin_writer import writer as checkin_writer
+from checkin_events import broadcaster as checkin_broadcaster
+from password_hashing import pool as hashing_pool
+from post_commit import pipeline as post_commit_pipeline
+import qr_render
 
 import project_utils as utils
 #===========================================================
@@ -18,12 +24,19 @@ import project_utils as utils
 async def lifespan(app: FastAPI):
     # Startup code
     print("StartUp")
+    hashing_pool.start()    # First: workers are forked before any background thread exists
+    checkin_writer.start()
+    post_commit_pipeline.start()
     await startup_user_management()
 
     # Program execution
     yield
 
     # Finilazing code
+    checkin_writer.stop()   # Flush CheckIn rows still waiting in the queue
+    post_commit_pipeline.stop()
+    checkin_broadcaster.close()
+    hashing_pool.stop()
     print("Finish")
 #===========================================================
 
@@ -35,7 +48,24 @@ dotenv.load_dotenv()
 utils.load_environment_variables()
 utils.check_create_paths()
 utils.databases_init_tables()
+with utils.SessionLocal_Members() as db:
+    try:
+        explain_member_pass_active_internal(db)
+    except RuntimeError as e:
+        print(f"WARNING: {e}")
 utils.check_create_root()
+checkin_cache.configure(ttl_seconds=float(utils.env["CHECKIN_CACHE_TTL"] or 60),
+                        max_entries=int(utils.env["CHECKIN_CACHE_MAX_ENTRIES"] or 50_000))
+checkin_writer.configure(batch_size=int(utils.env["CHECKIN_BATCH_SIZE"] or 200),
+                         flush_interval=float(utils.env["CHECKIN_FLUSH_INTERVAL_MS"] or 50) / 1000,
+                         max_queue=int(utils.env["CHECKIN_QUEUE_SIZE"] or 10_000))
+checkin_writer.add_listener(checkin_broadcaster.publish)
+qr_render.png_cache.configure(max_entries=int(utils.env["QR_PNG_CACHE_MAX_ENTRIES"] or 1000))
+utils.qr_files.configure(max_entries=int(utils.env["QR_PNG_CACHE_MAX_ENTRIES"] or 1000))
+post_commit_pipeline.configure(max_attempts=int(utils.env["POST_COMMIT_MAX_ATTEMPTS"] or 5),
+                               retry_delay=float(utils.env["POST_COMMIT_RETRY_DELAY"] or 2))
+hashing_pool.configure(workers=int(utils.env["HASH_POOL_WORKERS"] or 0),
+                       max_queue=int(utils.env["HASH_POOL_MAX_QUEUE"] or 64))
 
 # FastAPI application to run --> add all routers
 app = FastAPI(title="Dance School Backend",
@@ -0,0 +1,165 @@
+""" Maintenance commands, executed next to the running application.
+
+    Usage:
+        python manage.py backfill-rollup [--date-from 2024-01-01] [--date-to 2024-12-31]
+        python manage.py verify-rollup [--date-from 2024-01-01] [--date-to 2024-12-31]
+        python manage.py archive-checkins [--keep-months 3] [--vacuum]
+        python manage.py import-members add_members.xlsx [--report report.csv] [--workers 8] [--no-qr] [--send-welcome-email]
+        python manage.py regenerate-qr [--workers 8] [--batch-size 500] [--restart]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+# Application expects to be started from the project folder (relative database paths, ".env")
+os.chdir(Path(__file__).resolve().parent)
+
+import checkin_archive
+import checkin_rollup
+import members_import
+import project_utils as utils
+import qr_regenerate
+from database import SessionLocal_Checkins, SessionLocal_Members
+#===========================================================
+
+""" COMMANDS
+"""
+def command_backfill_rollup(args: argparse.Namespace) -> int:
+    utils.check_create_paths()
+    utils.databases_init_tables()
+
+    started = time.perf_counter()
+    with SessionLocal_Checkins() as db:
+        written = checkin_rollup.backfill(db, date_from=args.date_from, date_to=args.date_to)
+    print("Rollups: {rows} rows written in {s:.1f} s".format(rows=written, s=time.perf_counter() - started))
+    return 0
+
+def command_verify_rollup(args: argparse.Namespace) -> int:
+    utils.check_create_paths()
+    utils.databases_init_tables()
+
+    with SessionLocal_Checkins() as db:
+        mismatches = checkin_rollup.verify(db, date_from=args.date_from, date_to=args.date_to)
+    for day, logged, rolled_up in mismatches:
+        print("{day}: {logged} check-ins in the log, {rolled_up} in the rollup".format(
+            day=day, logged=logged, rolled_up=rolled_up))
+    if mismatches:
+        print("Rollups disagree with the log on {days} days [run backfill-rollup]".format(days=len(mismatches)))
+        return 1
+    print("Rollups match the log")
+    return 0
+
+def command_archive_checkins(args: argparse.Namespace) -> int:
+    utils.check_create_paths()
+    utils.databases_init_tables()
+
+    with SessionLocal_Checkins() as db:
+        months = checkin_archive.months_to_archive(db, keep_months=args.keep_months)
+    if not months:
+        print("Nothing to archive")
+
+    for month in months:
+        started = time.perf_counter()
+        moved = checkin_archive.archive_month(month)
+        print("{month:%Y-%m}: {rows} rows moved to {path} in {s:.1f} s".format(
+            month=month, rows=moved, path=checkin_archive.partition_path(month), s=time.perf_counter() - started))
+
+    if args.vacuum:
+        started = time.perf_counter()
+        checkin_archive.vacuum_live()
+        print("Live DB compacted in {s:.1f} s".format(s=time.perf_counter() - started))
+    return 0
+
+def command_import_members(args: argparse.Namespace) -> int:
+    utils.load_environment_variables()
+    utils.check_create_paths()
+    utils.databases_init_tables()
+
+    started = time.perf_counter()
+    def progress(report: members_import.ImportReport) -> None:
+        print("{rows} rows: {created} created, {skipped} skipped, {errors} errors [{rate:.1f} rows/s]".format(
+            rows=len(report.rows), created=report.count("created"), skipped=report.count("skipped"),
+            errors=report.count("error"), rate=len(report.rows) / (time.perf_counter() - started)))
+
+    with SessionLocal_Members() as db:
+        report = members_import.import_members(args.path, db, batch_size=args.batch_size, workers=args.workers,
+                                               render_qr=not args.no_qr, progress=progress)
+    print("Import finished in {s:.1f} s".format(s=time.perf_counter() - started))
+
+    if args.send_welcome_email:
+        sent = members_import.send_welcome_emails(report)
+        print("Welcome emails sent: {sent}".format(sent=sent))
+
+    if args.report:
+        report.write_csv(args.report)
+        print("Report: {path}".format(path=args.report))
+    else:
+        for row in report.rows:
+            if row.status != "created":
+                print("Row {row}: {status} - {detail}".format(row=row.row, status=row.status, detail=row.detail))
+    return 0 if report.count("error") == 0 else 1
+
+def command_regenerate_qr(args: argparse.Namespace) -> int:
+    utils.load_environment_variables()
+    utils.check_create_paths()
+    utils.databases_init_tables()
+
+    previous = qr_regenerate.load_progress()
+    if previous.cards and not args.restart:
+        print("Continuing after member ID {id} [{cards} cards done]".format(id=previous.last_member_id, cards=previous.cards))
+
+    def progress(progress: qr_regenerate.RegenerateProgress) -> None:
+        print("{cards} cards [{rate:.1f} cards/s]".format(cards=progress.cards, rate=progress.cards_per_second))
+
+    started = time.perf_counter()
+    with SessionLocal_Members() as db:
+        result = qr_regenerate.regenerate_all(db, workers=args.workers, batch_size=args.batch_size,
+                                              restart=args.restart, progress_callback=progress)
+    print("Regenerated {cards} cards [{mb:.1f} MB] in {s:.1f} s: {rate:.1f} cards/s".format(
+        cards=result.cards, mb=result.bytes_written / 1024 / 1024, s=time.perf_counter() - started,
+        rate=result.cards_per_second))
+    return 0
+#===========================================================
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill_rollup = commands.add_parser("backfill-rollup", help="Rebuild daily and hourly check-in rollups from the CheckIn log")
+    backfill_rollup.add_argument("--date-from", type=date.fromisoformat, default=None, help="First day [YYYY-MM-DD]")
+    backfill_rollup.add_argument("--date-to", type=date.fromisoformat, default=None, help="Last day [YYYY-MM-DD]")
+    backfill_rollup.set_defaults(handler=command_backfill_rollup)
+
+    verify_rollup = commands.add_parser("verify-rollup", help="Compare daily rollups with the CheckIn log [archives included]")
+    verify_rollup.add_argument("--date-from", type=date.fromisoformat, default=None, help="First day [YYYY-MM-DD]")
+    verify_rollup.add_argument("--date-to", type=date.fromisoformat, default=None, help="Last day [YYYY-MM-DD]")
+    verify_rollup.set_defaults(handler=command_verify_rollup)
+
+    archive_checkins = commands.add_parser("archive-checkins", help="Move old months of the CheckIn log into read-only monthly files")
+    archive_checkins.add_argument("--keep-months", type=int, default=3, help="Full months kept in the live DB besides the current one")
+    archive_checkins.add_argument("--vacuum", action="store_true", help="Compact the live DB afterwards")
+    archive_checkins.set_defaults(handler=command_archive_checkins)
+
+    import_members = commands.add_parser("import-members", help="Bulk import of members from xlsx / csv")
+    import_members.add_argument("path", type=Path, help="File with a header row: " + ", ".join(members_import.IMPORT_COLUMNS))
+    import_members.add_argument("--report", type=Path, default=None, help="Write per-row result as CSV")
+    import_members.add_argument("--batch-size", type=int, default=500, help="Rows per transaction")
+    import_members.add_argument("--workers", type=int, default=None, help="Processes for hashing and QR codes [CPU count]")
+    import_members.add_argument("--no-qr", action="store_true", help="Do not render QR codes [rendered on first request or before the welcome email]")
+    import_members.add_argument("--send-welcome-email", action="store_true", help="Send password and QR code to created members")
+    import_members.set_defaults(handler=command_import_members)
+
+    regenerate_qr = commands.add_parser("regenerate-qr", help="Render QR codes of all members again [after logo / colour changes]")
+    regenerate_qr.add_argument("--workers", type=int, default=None, help="Rendering processes [CPU count]")
+    regenerate_qr.add_argument("--batch-size", type=int, default=500, help="Members read from the DB at once")
+    regenerate_qr.add_argument("--restart", action="store_true", help="Ignore progress of an interrupted run")
+    regenerate_qr.set_defaults(handler=command_regenerate_qr)
+
+    args = parser.parse_args()
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Member
+import project_utils as utils
+#===========================================================
+
+""" BULK MEMBER IMPORT [xlsx / csv]
+    Rows are streamed from the file (openpyxl read-only mode --> the sheet is never loaded as a whole)
+    and processed in batches:
+        1. validation + duplicates inside the batch,
+        2. one query per column for values already taken in DB (email, username, card ID),
+           card IDs generated for the whole batch at once,
+        3. argon2 hashing and QR rendering on a process pool,
+        4. one INSERT transaction per batch.
+    Every row ends up in the report: created / skipped (already registered) / error.
+"""
+IMPORT_COLUMNS = ("card_id", "name", "surname", "email", "phone_number", "date_of_birth", "account_type", "username")
+IMPORT_ACCOUNT_TYPES = {account_type.name.lower(): account_type for account_type in utils.AccountType
+                        if account_type is not utils.AccountType.ROOT}
+
+@dataclass
+class ImportRow:
+    row: int                            # Row number in the file [header is row 1]
+    values: dict
+    status: str = "pending"             # created / skipped / error
+    detail: Optional[str] = None
+    card_id: Optional[str] = None
+    password: Optional[str] = None      # Generated password [only kept in memory, e.g. for welcome e-mails]
+    username: Optional[str] = None      # From the file or generated [same value in the DB and in the e-mail]
+    password_hash: Optional[str] = None
+    qr_path: Optional[str] = None
+
+@dataclass
+class ImportReport:
+    rows: list[ImportRow]
+
+    def count(self, status: str) -> int:
+        return sum(1 for row in self.rows if row.status == status)
+
+    def write_csv(self, path: Path) -> None:
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["row", "status", "card_id", "email", "detail"])
+            for row in self.rows:
+                writer.writerow([row.row, row.status, row.card_id, row.values.get("email"), row.detail])
+#===========================================================
+
+""" READING
+"""
+def read_rows(path: Path) -> Iterator[ImportRow]:
+    """ Streams rows of the first sheet (xlsx) or the CSV file. Header names are case-insensitive, empty rows are skipped """
+    if path.suffix.lower() in (".xlsx", ".xlsm"):
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(name or "").strip().lower() for name in next(rows, ())]
+            for number, values in enumerate(rows, start=2):
+                yield from _to_import_row(number, header, values)
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as file:
+            rows = csv.reader(file)
+            header = [name.strip().lower() for name in next(rows, [])]
+            for number, values in enumerate(rows, start=2):
+                yield from _to_import_row(number, header, values)
+
+def _to_import_row(number: int, header: list[str], values) -> Iterator[ImportRow]:
+    row = {name: value for name, value in zip(header, values) if name in IMPORT_COLUMNS}
+    row = {name: (value.strip() if isinstance(value, str) else value) for name, value in row.items()}
+    row = {name: value for name, value in row.items() if value not in (None, "")}
+    if row:
+        yield ImportRow(row=number, values=row)
+#===========================================================
+
+""" VALIDATION
+"""
+def validate(row: ImportRow) -> None:
+    """ Normalizes values in place, sets "error" status with the reason if row can not be imported """
+    values = row.values
+    for name in ("name", "surname", "email"):
+        if not values.get(name):
+            row.status, row.detail = "error", f"Missing {name}"
+            return
+
+    values["email"] = str(values["email"]).lower()
+    if "@" not in values["email"]:
+        row.status, row.detail = "error", "Invalid email"
+        return
+
+    account_type = values.get("account_type", utils.AccountType.MEMBER.name)
+    if isinstance(account_type, (int, float)) or str(account_type).isdigit():
+        account_type = utils.AccountType(int(account_type)) if int(account_type) in utils.AccountType._value2member_map_ else None
+    else:
+        account_type = IMPORT_ACCOUNT_TYPES.get(str(account_type).lower())
+    if account_type is None or account_type is utils.AccountType.ROOT:
+        row.status, row.detail = "error", "Unknown account type: {value}".format(value=values.get("account_type"))
+        return
+    values["account_type"] = account_type.value
+
+    date_of_birth = values.get("date_of_birth")
+    if isinstance(date_of_birth, datetime):
+        values["date_of_birth"] = date_of_birth.date()
+    elif isinstance(date_of_birth, str):
+        try:
+            values["date_of_birth"] = date.fromisoformat(date_of_birth)
+        except ValueError:
+            row.status, row.detail = "error", "Invalid date_of_birth [YYYY-MM-DD expected]"
+            return
+
+    for name in ("card_id", "name", "surname", "phone_number", "username"):
+        if name in values:
+            values[name] = str(values[name])
+
+def check_uniqueness(db: Session, rows: list[ImportRow]) -> None:
+    """ One query per unique column for the whole batch + duplicates inside the batch.
+        Rows whose email is registered already are "skipped" [re-running an import is safe].
+    """
+    taken = {
+        "email": _taken(db, Member.email, [row.values["email"] for row in rows]),
+        "username": _taken(db, Member.username, [row.values["username"] for row in rows if "username" in row.values]),
+        "card_id": _taken(db, Member.card_id, [row.values["card_id"] for row in rows if "card_id" in row.values]),
+    }
+    registered = set(taken["email"])
+    for row in rows:
+        if row.values["email"] in registered:
+            row.status, row.detail = "skipped", "Email already registered"
+            continue
+        for name in ("email", "username", "card_id"):
+            value = row.values.get(name)
+            if value is not None and value in taken[name]:
+                row.status, row.detail = "error", f"{name} already used"
+                break
+        else:
+            # Later rows of the same file see values of the earlier ones as taken
+            for name in ("email", "username", "card_id"):
+                if name in row.values:
+                    taken[name].add(row.values[name])
+
+def assign_card_ids(db: Session, rows: list[ImportRow]) -> None:
+    """ Generates card IDs for rows without one: every round checks all candidates with one query """
+    length = int(utils.env["QR_CODE_VALUE_LEN"])
+    missing = [row for row in rows if "card_id" not in row.values]
+    for row in rows:
+        row.card_id = row.values.get("card_id")
+
+    used = {row.card_id for row in rows if row.card_id}
+    while missing:
+        candidates = {}
+        for row in missing:
+            candidate = utils.get_random_string(length)
+            while candidate in used or candidate in candidates:
+                candidate = utils.get_random_string(length)
+            candidates[candidate] = row
+
+        taken = _taken(db, Member.card_id, list(candidates))
+        for candidate, row in candidates.items():
+            if candidate not in taken:
+                row.card_id = candidate
+                used.add(candidate)
+        missing = [row for row in missing if row.card_id is None]
+
+def _taken(db: Session, column, values: list) -> set:
+    taken = set()
+    for start in range(0, len(values), 500):    # SQLite bound parameters limit
+        chunk = values[start:start + 500]
+        taken.update(db.execute(select(column).where(column.in_(chunk))).scalars().all())
+    return taken
+#===========================================================
+
+""" CPU-BOUND PART [executed in worker processes]
+"""
+def prepare_member(card_id: str, password: str, account_type: int, render_qr: bool) -> tuple[str, Optional[str]]:
+    """ Returns (password hash, path of the rendered QR code [None if not rendered]) """
+    password_hash = utils.hash_string(password)
+    qr_path = None
+    if render_qr:
+        qr_path = str(utils.generate_qr_code_member(Member(card_id=card_id, account_type=account_type)))
+    return password_hash, qr_path
+#===========================================================
+
+def import_members(path: Path, db: Session, batch_size: int = 500, workers: int = None,
+                   render_qr: bool = True, progress=None) -> ImportReport:
+    """ Imports members from the file. "progress(report)" is called after every committed batch """
+    report = ImportReport(rows=[])
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch: list[ImportRow] = []
+        for row in read_rows(path):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                _import_batch(db, pool, batch, render_qr, workers)
+                report.rows.extend(batch)
+                batch = []
+                if progress:
+                    progress(report)
+        if batch:
+            _import_batch(db, pool, batch, render_qr, workers)
+            report.rows.extend(batch)
+            if progress:
+                progress(report)
+    return report
+
+def _import_batch(db: Session, pool: ProcessPoolExecutor, batch: list[ImportRow], render_qr: bool, workers: int) -> None:
+    for row in batch:
+        validate(row)
+    rows = [row for row in batch if row.status == "pending"]
+    if not rows:
+        return
+
+    check_uniqueness(db, rows)
+    rows = [row for row in rows if row.status == "pending"]
+    assign_card_ids(db, rows)
+
+    # Hashing and QR rendering: the slow part --> all cores
+    for row in rows:
+        row.password = utils.get_random_string(12)
+        row.username = row.values.get("username") or utils.get_random_string(12)
+    results = pool.map(prepare_member,
+                       [row.card_id for row in rows],
+                       [row.password for row in rows],
+                       [row.values["account_type"] for row in rows],
+                       [render_qr] * len(rows),
+                       chunksize=max(1, len(rows) // (workers * 4)))
+    for row, (password_hash, qr_path) in zip(rows, results):
+        row.password_hash, row.qr_path = password_hash, qr_path
+
+    members = [_to_member_row(row) for row in rows]
+    try:
+        db.execute(insert(Member), members)
+        db.commit()
+    except IntegrityError:
+        # Someone registered the same email / card ID meanwhile --> find the rows one by one
+        db.rollback()
+        for row, member in zip(rows, members):
+            try:
+                db.execute(insert(Member), [member])
+                db.commit()
+            except IntegrityError as e:
+                db.rollback()
+                row.status, row.detail = "error", "Already registered: {error}".format(error=e.orig)
+                _remove_qr(row)
+                continue
+            row.status = "created"
+        return
+
+    for row in rows:
+        row.status = "created"
+
+def _to_member_row(row: ImportRow) -> dict:
+    values = row.values
+    return {
+        "card_id": row.card_id,
+        "name": values["name"],
+        "surname": values["surname"],
+        "email": values["email"],
+        "phone_number": values.get("phone_number"),
+        "date_of_birth": values.get("date_of_birth"),
+        "registration_date": date.today(),
+        "account_type": values["account_type"],
+        "privileges": "",
+        "username": row.username,
+        "password_hash": row.password_hash,
+        "activated": True,  # Added by an admin --> no confirmation is needed
+    }
+
+def send_welcome_emails(report: ImportReport) -> int:
+    """ Sends welcome e-mails [password + QR code] to the created members one by one. Returns amount sent.
+        QR codes not rendered by the import ("render_qr" off) are rendered here.
+    """
+    sent = 0
+    for row in report.rows:
+        if row.status != "created" or row.password is None:
+            continue
+        member = Member(**_to_member_row(row))
+        try:
+            qr_path = Path(row.qr_path) if row.qr_path else utils.generate_qr_code_member(member)
+            accepted = utils.SendGrid_send_welcome_email_member(member=member, qr_path=qr_path, password=row.password)
+        except Exception as e:
+            row.detail = "Welcome email was not sent: {error}".format(error=e)
+            continue
+        if accepted is True:
+            sent += 1
+        elif accepted is False:
+            row.detail = "Welcome email was not accepted by SendGrid"
+        else:
+            row.detail = "Welcome email was not sent: SEND_WELCOME_EMAIL is not \"Sendgrid\""
+    return sent
+
+def _remove_qr(row: ImportRow) -> None:
+    if row.qr_path:
+        Path(row.qr_path).unlink(missing_ok=True)
+#===========================================================
@@ -0,0 +1,91 @@
+import re
+
+from sqlalchemy import select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Member
+#===========================================================
+
+""" FULL-TEXT MEMBER SEARCH [SQLite FTS5]
+    "members_fts" is an external content table: it keeps only the index, rows are read from "members".
+    Triggers keep it in sync on every INSERT / DELETE / UPDATE of the searched columns,
+    whoever writes the table (endpoints, CLI, imports).
+    Prefix indexes for 2 and 3 characters --> autocomplete prefixes are index lookups, not scans.
+"""
+SEARCH_COLUMNS = ("name", "surname", "email", "phone_number", "username")
+
+# bm25() weights in the order of SEARCH_COLUMNS: name matches rank above e-mail matches
+SEARCH_WEIGHTS = (10.0, 10.0, 4.0, 4.0, 2.0)
+
+_columns = ", ".join(SEARCH_COLUMNS)
+_new_values = ", ".join("new." + column for column in SEARCH_COLUMNS)
+_old_values = ", ".join("old." + column for column in SEARCH_COLUMNS)
+
+SEARCH_INDEX_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS members_fts USING fts5("
+    f"{_columns}, content='members', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+
+    f"CREATE TRIGGER IF NOT EXISTS members_fts_insert AFTER INSERT ON members BEGIN "
+    f"INSERT INTO members_fts(rowid, {_columns}) VALUES (new.id, {_new_values}); END",
+
+    f"CREATE TRIGGER IF NOT EXISTS members_fts_delete AFTER DELETE ON members BEGIN "
+    f"INSERT INTO members_fts(members_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); END",
+
+    # Only searched columns: token / password updates do not touch the index
+    f"CREATE TRIGGER IF NOT EXISTS members_fts_update AFTER UPDATE OF {_columns} ON members BEGIN "
+    f"INSERT INTO members_fts(members_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO members_fts(rowid, {_columns}) VALUES (new.id, {_new_values}); END",
+]
+
+is_available: bool = False
+#===========================================================
+
+def create_search_index(engine: Engine) -> bool:
+    """ Creates the index and triggers if missing. New index is filled from existing members.
+        Returns False if SQLite was built without FTS5 [search is then unavailable].
+    """
+    global is_available
+    try:
+        with engine.begin() as connection:
+            exists = connection.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'members_fts'").first()
+            for statement in SEARCH_INDEX_DDL:
+                connection.exec_driver_sql(statement)
+            if not exists:
+                connection.exec_driver_sql("INSERT INTO members_fts(members_fts) VALUES ('rebuild')")
+    except OperationalError as e:
+        print(f"WARNING: members full-text search is unavailable: {e}")
+        is_available = False
+        return False
+
+    is_available = True
+    return True
+
+def build_match_query(search: str) -> str | None:
+    """ User input --> FTS5 query: every word must match as a prefix, e.g. 'ann kow' --> '"ann"* "kow"*'.
+        Words are quoted, so FTS5 operators and special characters typed by the user are taken literally.
+        Returns None if nothing searchable is left.
+    """
+    words = [word for word in re.split(r"\s+", search.strip()) if re.search(r"\w", word)]
+    if not words:
+        return None
+    return " ".join('"{word}"*'.format(word=word.replace('"', '""')) for word in words)
+
+async def search_members(db: AsyncSession, search: str, limit: int) -> list[Member]:
+    """ Members ranked by bm25 [best first] """
+    match = build_match_query(search)
+    if match is None:
+        return []
+
+    weights = ", ".join(str(weight) for weight in SEARCH_WEIGHTS)
+    statement = text(
+        "SELECT members.* FROM members_fts JOIN members ON members.id = members_fts.rowid "
+        "WHERE members_fts MATCH :match "
+        f"ORDER BY bm25(members_fts, {weights}) "
+        "LIMIT :limit")
+    result = await db.execute(select(Member).from_statement(statement), {"match": match, "limit": limit})
+    return list(result.scalars().all())
+#===========================================================
@@ -1,6 +1,6 @@
 from datetime import datetime, timezone
 
-from sqlalchemy import Column, ForeignKey, Integer, Boolean, Numeric, String, Date, DateTime
+from sqlalchemy import Column, ForeignKey, Index, Integer, Boolean, Numeric, String, Date, DateTime, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base_Members, Base_Checkins
 
@@ -17,6 +17,10 @@ class Member(Base_Members):
 
     # The file name it will be created
     __tablename__ = "members"
+    __table_args__ = (
+        # Keyset pagination of GET /members: ORDER BY registration_date, id --> seek instead of OFFSET
+        Index("ix_members_registration_date_id", "registration_date", "id"),
+    )
 
     # ID of the row
     id = Column(Integer, primary_key=True, unique=True)
@@ -38,6 +42,7 @@ class Member(Base_Members):
     privileges              = Column(String, nullable=True)
     
     # Store last checkIn time separetly --> will be needed for some operations
+    # [Not updated anymore: anti-double-scan window is kept by checkin_cache.CheckInDebounce on top of the CheckIn log]
     last_checkin_success    = Column(Boolean, nullable=True)
     last_checkin_datetime   = Column(DateTime, nullable=True)
 
@@ -136,6 +141,14 @@ class MemberPass(Base_Members):
     """
 
     __tablename__ = "member_passes"
+    __table_args__ = (
+        # Active pass lookup on every scan: equality on first three columns --> range on expiration_date.
+        # Keeps it an index seek regardless of pass history size [see endpoints_passes.explain_member_pass_active_internal]
+        Index("ix_member_passes_active_lookup",
+              "member_card_id", "is_closed", "is_ext_event_pass", "expiration_date"),
+        # Revenue report: range on purchase_date
+        Index("ix_member_passes_purchase_date", "purchase_date"),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -175,6 +188,38 @@ class MemberSurvey_Test(Base_Members):
 
     id = Column(Integer, primary_key=True)
 
+class RevokedToken(Base_Members):
+    """ Session tokens revoked before they expire [logout, used refresh tokens], see session_tokens.
+        Shared by all worker processes. Rows are dropped once the token would expire anyway.
+    """
+
+    __tablename__ = "revoked_tokens"
+
+    jti         = Column(String, primary_key=True)      # Unique ID of the token
+    expires_at  = Column(DateTime, nullable=False, index=True)
+
+class WelcomeEmailOutbox(Base_Members):
+    """ Welcome e-mail waiting for delivery [password + QR code, see project_utils.deliver_welcome_email].
+
+        Added in the same transaction as the member (or its activation) --> neither a crash nor a failing
+        mail API loses the mail. Row is deleted as soon as SendGrid accepts the mail.
+        Rows left after all retries are sent again on the next start of the app.
+        No credentials are stored: if "reset_password" --> a fresh password is set right before sending.
+        Every gunicorn worker submits pending rows at start: a row is claimed atomically before sending
+        [claimed_at / claimed_by], so one mail is sent by one process at a time.
+    """
+
+    __tablename__ = "welcome_email_outbox"
+
+    id          = Column(Integer, primary_key=True)
+    card_id     = Column(String, nullable=False, index=True)
+    reset_password = Column(Boolean, nullable=False, default=True)    # False --> mail without a password [self sign-up]
+    created_at  = Column(DateTime, nullable=False)
+    attempts    = Column(Integer, nullable=False, default=0)
+    last_error  = Column(String, nullable=True)     # Reason of the last failed attempt
+    claimed_at  = Column(DateTime, nullable=True)   # Delivery in progress since [None - free]
+    claimed_by  = Column(String, nullable=True)     # "<host>:<pid>" of the delivering process
+
 """ LOG TABLES:
     Entry history, Login logs, etc.
 """
@@ -210,6 +255,10 @@ class CheckIn(Base_Checkins):
     """
 
     __tablename__ = "checkins"
+    __table_args__ = (
+        # Keyset pagination of the detailed instructor statistics: validator equality --> seek on (date_time, id)
+        Index("ix_checkins_validator_date_time_id", "validated_by_card_id", "date_time", "id"),
+    )
 
     id = Column(Integer, primary_key=True, unique=True)
 
@@ -248,6 +297,84 @@ class CheckIn(Base_Checkins):
             time=self.checkin_time, is_success="successful" if self.is_successful == True else "unsuccessful",
         )
 
+class CheckInDailyRollup(Base_Checkins):
+    """ Per-day, per-validator counters of the CheckIn log.
+        Upserted by the check-in writer in the same transaction as the CheckIn rows [see checkin_rollup],
+        rebuilt from the log by "python manage.py backfill-rollup".
+
+    Columns:
+        day: date -> Day of CheckIn.date_time
+        validated_by_card_id: str -> Card ID of a validator. [""] for self scans (NULL would break the unique key)
+        validated_by_name: str -> Last known name of the validator
+        validated_by_surnamename: str -> Last known surname of the validator
+        successful: int -> Amount of accepted entries
+        rejected: int -> Amount of rejected entries
+    """
+
+    __tablename__ = "checkins_daily_rollup"
+    __table_args__ = (
+        UniqueConstraint("day", "validated_by_card_id", name="uq_checkins_daily_rollup_day_validator"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    day                         = Column(Date, nullable=False)
+    validated_by_card_id        = Column(String, nullable=False, default="")
+    validated_by_name           = Column(String, nullable=True)
+    validated_by_surnamename    = Column(String, nullable=True)
+
+    successful                  = Column(Integer, nullable=False, default=0)
+    rejected                    = Column(Integer, nullable=False, default=0)
+
+class CheckInHourlyRollup(Base_Checkins):
+    """ Per-hour counters of the CheckIn log by hall and pass, source of the attendance analytics.
+        Maintained and rebuilt together with CheckInDailyRollup [see checkin_rollup].
+
+    Columns:
+        hour: datetime -> CheckIn.date_time truncated to the hour
+        hall: str -> [""] if hall was not given
+        pass_name: str -> Name of the MemberPass used [""] if none
+        external_provider_name: str -> [""] if none
+        successful: int -> Amount of accepted entries
+        rejected: int -> Amount of rejected entries
+    """
+
+    __tablename__ = "checkins_hourly_rollup"
+    __table_args__ = (
+        UniqueConstraint("hour", "hall", "pass_name", "external_provider_name",
+                         name="uq_checkins_hourly_rollup_key"),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    hour                        = Column(DateTime, nullable=False)
+    hall                        = Column(String, nullable=False, default="")
+    pass_name                   = Column(String, nullable=False, default="")
+    external_provider_name      = Column(String, nullable=False, default="")
+
+    successful                  = Column(Integer, nullable=False, default=0)
+    rejected                    = Column(Integer, nullable=False, default=0)
+
+class CheckInSyncScan(Base_Checkins):
+    """ Outcome of every scan replayed through "/logging/checkin/sync", by the ID the scanner gave it.
+        Scanner re-sending a batch (lost response) gets the stored outcomes back instead of
+        a second validation [debounce rejections, pass entries consumed twice].
+        Written in the same transaction as the CheckIn rows of the batch.
+
+    Columns:
+        client_scan_id: str -> ID given by the scanner
+        processed_at: datetime -> When the scan was replayed
+        status_code: int -> 202 - logged, other - not logged
+        response: str -> Resp_CheckIn_Sync as JSON
+    """
+
+    __tablename__ = "checkins_sync_scans"
+
+    client_scan_id              = Column(String, primary_key=True)
+    processed_at                = Column(DateTime, nullable=False, index=True)
+    status_code                 = Column(Integer, nullable=False)
+    response                    = Column(String, nullable=False)
+
 # class Survey():
 #     """ For future use [Collect data from members through application / site]. 
 #     """
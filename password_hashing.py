@@ -0,0 +1,179 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import argon2
+import dotenv
+from argon2 import PasswordHasher
+from fastapi import HTTPException, status
+
+# Parameters are read on import [worker processes and CLI included]
+dotenv.load_dotenv()
+#===========================================================
+
+""" ARGON2 PARAMETERS [".env", empty --> default in brackets]
+    One PasswordHasher per process, built once. Changing the parameters does not lock anybody out:
+    old hashes still verify (parameters are stored in the hash) and are upgraded on the next login.
+"""
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+ARGON2_PARAMETERS = {
+    "time_cost": _env_int("ARGON2_TIME_COST", argon2.DEFAULT_TIME_COST),                # [3]
+    "memory_cost": _env_int("ARGON2_MEMORY_COST_KIB", argon2.DEFAULT_MEMORY_COST),      # [65536]
+    "parallelism": _env_int("ARGON2_PARALLELISM", argon2.DEFAULT_PARALLELISM),          # [4]
+}
+
+_password_hasher: PasswordHasher | None = None
+
+def get_password_hasher() -> PasswordHasher:
+    global _password_hasher
+    if _password_hasher is None:
+        _password_hasher = PasswordHasher(**ARGON2_PARAMETERS)
+    return _password_hasher
+#===========================================================
+
+""" CPU-BOUND PART [executed in worker processes, or inline if the pool is not started]
+"""
+def hash_password(password: str) -> str:
+    return get_password_hasher().hash(password)
+
+def verify_password(password: str, password_hash: str) -> tuple[bool, str | None]:
+    """ Returns (is password correct, new hash if the stored one was made with other parameters) """
+    hasher = get_password_hasher()
+    try:
+        hasher.verify(password_hash, password)
+    except (argon2.exceptions.VerifyMismatchError, argon2.exceptions.InvalidHashError):
+        return False, None
+
+    if hasher.check_needs_rehash(password_hash):
+        return True, hasher.hash(password)
+    return True, None
+
+def _warm_up() -> None:
+    get_password_hasher()
+#===========================================================
+
+def default_workers() -> int:
+    """ CPU count - 1 shared by all web workers, at least 1 per web worker """
+    web_workers = max(1, _env_int("WEB_CONCURRENCY", 1))
+    return max(1, ((os.cpu_count() or 1) - 1) // web_workers)
+
+class HashingPool:
+    """ Bounded process pool for argon2.
+
+        Argon2 is slow and memory-hard on purpose: run on the event loop it freezes every request of the worker,
+        run on the thread pool it still takes every core under a login burst. Here at most "workers" hashes
+        run at the same time [keep it below the CPU count --> check-ins always have a core left],
+        up to "max_queue" more wait for a free worker, anything above is refused with 503 right away
+        instead of piling up.
+
+        If the pool is not started (scripts, CLI) --> hashing runs inline in the calling thread.
+
+        Every web worker process has its own pool: the machine runs up to (web workers x "workers") hashes.
+        Default "workers" splits CPU count - 1 between the web workers ["WEB_CONCURRENCY", the variable
+        gunicorn reads its worker count from], so the total stays below the CPU count.
+
+    Args:
+        workers: int -> Worker processes = maximum concurrent hashes of this web worker.
+        max_queue: int -> Maximum hashes waiting for a free worker.
+    """
+
+    def __init__(self, workers: int = None, max_queue: int = 64):
+        self.workers = workers or default_workers()
+        self.max_queue = max_queue
+
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0           # Submitted and not finished yet [running + waiting]
+        self._rejected = 0
+        self._completed = 0
+
+    def configure(self, workers: int = None, max_queue: int = None) -> None:
+        """ Must be called before start() """
+        if workers:
+            self.workers = workers
+        if max_queue is not None:
+            self.max_queue = max_queue
+
+    @property
+    def is_running(self) -> bool:
+        return self._executor is not None
+
+    def start(self) -> None:
+        """ Start before other threads [check-in writer] --> workers are forked from a quiet process """
+        if self.is_running:
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        for future in [self._executor.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    def stop(self) -> None:
+        if not self.is_running:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+
+    @property
+    def queue_depth(self) -> int:
+        """ Hashes waiting for a free worker """
+        return max(0, self._pending - self.workers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": min(self._pending, self.workers),
+                "queue_depth": self.queue_depth,
+                "max_queue": self.max_queue,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    """ Blocking API [sync endpoints, executed on the thread pool]
+    """
+    def hash(self, password: str) -> str:
+        if not self.is_running:
+            return hash_password(password)
+        return self._submit(hash_password, password).result()
+
+    def verify(self, password: str, password_hash: str) -> tuple[bool, str | None]:
+        if not self.is_running:
+            return verify_password(password, password_hash)
+        return self._submit(verify_password, password, password_hash).result()
+
+    """ Async API [async endpoints, event loop is never blocked]
+    """
+    async def hash_async(self, password: str) -> str:
+        if not self.is_running:
+            return await asyncio.to_thread(hash_password, password)
+        return await asyncio.wrap_future(self._submit(hash_password, password))
+
+    async def verify_async(self, password: str, password_hash: str) -> tuple[bool, str | None]:
+        if not self.is_running:
+            return await asyncio.to_thread(verify_password, password, password_hash)
+        return await asyncio.wrap_future(self._submit(verify_password, password, password_hash))
+
+    def _submit(self, function, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Too many logins at the moment, try again in a few seconds",
+                                    headers={"Retry-After": "1"})
+            self._pending += 1
+        future = self._executor.submit(function, *args)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+#===========================================================
+
+# One pool per worker process
+pool = HashingPool()
+#===========================================================
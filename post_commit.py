@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+#===========================================================
+
+@dataclass(order=True)
+class PostCommitTask:
+    run_at: float                                   # time.monotonic() of the next attempt
+    sequence: int                                   # Keeps submission order among tasks due at the same time
+    name: str = field(compare=False)
+    function: Callable = field(compare=False)
+    args: tuple = field(compare=False, default=())
+    attempt: int = field(compare=False, default=0)
+#===========================================================
+
+class PostCommitPipeline:
+    """ Side effects executed after the DB transaction is committed [QR rendering, welcome e-mails].
+
+        Endpoint commits the row, submits the task and returns: the user waits for the DB only,
+        not for PIL or an external mail API. Tasks run one by one on a background thread.
+        A task that raises is retried with exponential backoff ("retry_delay", 2x, 4x, ...)
+        up to "max_attempts" times, then it is dropped with a log line. A failure never touches
+        the already committed row. Tasks that must not be lost keep a durable record committed with
+        the row and are submitted again at start-up [welcome e-mails: models.WelcomeEmailOutbox].
+
+        Tasks must be idempotent [they can run again after a partial failure] and read what they
+        need from the DB themselves (the request session is closed by then).
+        If the pipeline is not started (scripts, CLI) --> submit() runs the task synchronously, once.
+        Graceful shutdown (stop()) runs every queued task once more, retries still waiting are logged and dropped.
+
+    Args:
+        max_attempts: int -> Attempts per task, the first one included.
+        retry_delay: float -> Delay [s] before the first retry.
+        max_queue: int -> Queue bound. When full --> submit() blocks.
+    """
+
+    def __init__(self, max_attempts: int = 5, retry_delay: float = 2.0, max_queue: int = 1000):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._retries: list[PostCommitTask] = []    # Heap by run_at [worker thread only]
+        self._sequence = itertools.count()
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._failed = 0
+
+    def configure(self, max_attempts: int = None, retry_delay: float = None, max_queue: int = None) -> None:
+        """ Must be called before start() """
+        if max_attempts is not None:
+            self.max_attempts = max_attempts
+        if retry_delay is not None:
+            self.retry_delay = retry_delay
+        if max_queue is not None:
+            self._queue = queue.Queue(maxsize=max_queue)
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="post-commit", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if not self.is_running:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, name: str, function: Callable, *args) -> None:
+        task = PostCommitTask(run_at=time.monotonic(), sequence=next(self._sequence),
+                              name=name, function=function, args=args)
+        if not self.is_running:
+            self._execute(task)
+            return
+        self._queue.put(task)
+
+    def flush(self) -> None:
+        """ Blocks until all tasks submitted so far were attempted once """
+        if not self.is_running:
+            return
+        self._queue.join()
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "retrying": len(self._retries), "failed": self._failed}
+
+    """ INTERNAL
+    """
+    def _run(self) -> None:
+        while not (self._stopping.is_set() and self._queue.empty()):
+            # Sleep until a new task arrives or the first retry is due
+            timeout = 0.1
+            if self._retries:
+                timeout = min(timeout, max(0.0, self._retries[0].run_at - time.monotonic()))
+            try:
+                task = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                task = None
+
+            if task is not None:
+                try:
+                    self._execute(task)
+                finally:
+                    self._queue.task_done()
+
+            while self._retries and self._retries[0].run_at <= time.monotonic():
+                self._execute(heapq.heappop(self._retries))
+
+        for task in self._retries:
+            print(f"Post-commit: '{task.name}' dropped on shutdown [{task.attempt}/{self.max_attempts} attempts done]")
+        self._retries = []
+
+    def _execute(self, task: PostCommitTask) -> None:
+        task.attempt += 1
+        try:
+            task.function(*task.args)
+            return
+        except Exception as e:
+            print(f"Post-commit: '{task.name}' failed [attempt {task.attempt}/{self.max_attempts}]: {e}")
+
+        if task.attempt >= self.max_attempts or not self.is_running:
+            self._failed += 1
+            print(f"Post-commit: '{task.name}' was dropped")
+            return
+        task.run_at = time.monotonic() + self.retry_delay * 2 ** (task.attempt - 1)
+        heapq.heappush(self._retries, task)
+#===========================================================
+
+pipeline = PostCommitPipeline()
+#===========================================================
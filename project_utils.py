@@ -1,33 +1,38 @@
 # Generic packages
 import base64
+import binascii
+import json
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import (Mail, Attachment, FileContent, FileName, FileType, Disposition)
 import os
+import socket
 import dotenv
 import random
 import string
 from pathlib import Path
-from datetime import date
+from datetime import date, datetime, timedelta
 from enum import Enum
 
 # Poject-specific / Specialized packages
-from PIL import Image, ImageDraw
 import PIL
 import PIL.ImageFont
-from argon2 import PasswordHasher
-import argon2
-import qrcode
-import qrcode.constants
 import smtplib
 from email.message import EmailMessage
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Query, Session
 from fastapi import HTTPException, Depends 
 
 # User
-from models import ExternalProvider, Member, MemberPass
+import members_search
+import password_hashing
+import qr_render
+import qr_store
+from models import ExternalProvider, Member, MemberPass, WelcomeEmailOutbox
 from database import engine_members, engine_checkins, Base_Checkins, Base_Members, SessionLocal_Members, SessionLocal_Checkins
+from database import SessionLocal_Members_Async, SessionLocal_Checkins_Async
 #===========================================================
 
 PATH_BASE = Path.cwd().resolve()
@@ -35,6 +40,9 @@ PATH_DATABASES = Path(PATH_BASE, "databases")
 PATH_TEMPLATES = Path(PATH_BASE, "templates")
 PATH_QR_CODES = Path(PATH_BASE, "qr_codes")
 
+# Stored QR images + their ETags [see qr_store]
+qr_files = qr_store.QRStore(PATH_QR_CODES)
+
 env = {}
 #===========================================================
 
@@ -84,8 +92,7 @@ def check_create_root(db: Session = SessionLocal_Members()) -> bool:
         db.commit()
 
         # Generate qr code
-        qr_code: Path = generate_qr_code(qr_value, 
-                                         root.name, root.surname)
+        qr_code: Path = generate_qr_code_member(root)
 
         # Send QR Code via email on self email address
         if env["SEND_WELCOME_EMAIL"] == "True":
@@ -107,6 +114,15 @@ def check_create_paths() -> None:
 def databases_init_tables() -> None:
     Base_Members.metadata.create_all(bind=engine_members)
     Base_Checkins.metadata.create_all(bind=engine_checkins)
+
+    # "create_all" skips existing tables together with their indexes --> add indexes declared later
+    for base, engine in ((Base_Members, engine_members), (Base_Checkins, engine_checkins)):
+        for table in base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+
+    # Full-text index of members [virtual table + triggers, not part of the ORM metadata]
+    members_search.create_search_index(engine_members)
     return
 
 def load_environment_variables() -> None:
@@ -135,6 +151,7 @@ def load_environment_variables() -> None:
     env["QR_ADD_FULL_NAME"] = os.getenv("QR_ADD_FULL_NAME")
     env["QR_ADD_LOGO"] = os.getenv("QR_ADD_LOGO")
     env["QR_ADD_TITLE"] = os.getenv("QR_ADD_TITLE")
+    env["QR_PNG_CACHE_MAX_ENTRIES"] = os.getenv("QR_PNG_CACHE_MAX_ENTRIES")
 
     env["QR_CODE_VALUE_LEN"] = os.getenv("QR_CODE_VALUE_LEN")
     env["LOGIN_DEFAULT_LEN"] = os.getenv("LOGIN_DEFAULT_LEN")
@@ -144,6 +161,21 @@ def load_environment_variables() -> None:
     env["SECRET_SALT"] = os.getenv("SECRET_SALT")
 
     env["BACKEND_ADDRESS"] = os.getenv("BACKEND_ADDRESS")
+
+    env["CHECKIN_CACHE_TTL"] = os.getenv("CHECKIN_CACHE_TTL")
+    env["CHECKIN_CACHE_MAX_ENTRIES"] = os.getenv("CHECKIN_CACHE_MAX_ENTRIES")
+    env["CHECKIN_BATCH_SIZE"] = os.getenv("CHECKIN_BATCH_SIZE")
+    env["CHECKIN_FLUSH_INTERVAL_MS"] = os.getenv("CHECKIN_FLUSH_INTERVAL_MS")
+    env["CHECKIN_QUEUE_SIZE"] = os.getenv("CHECKIN_QUEUE_SIZE")
+
+    env["HASH_POOL_WORKERS"] = os.getenv("HASH_POOL_WORKERS")
+    env["HASH_POOL_MAX_QUEUE"] = os.getenv("HASH_POOL_MAX_QUEUE")
+
+    env["POST_COMMIT_MAX_ATTEMPTS"] = os.getenv("POST_COMMIT_MAX_ATTEMPTS")
+    env["POST_COMMIT_RETRY_DELAY"] = os.getenv("POST_COMMIT_RETRY_DELAY")
+
+    env["ACCESS_TOKEN_TTL_MINUTES"] = os.getenv("ACCESS_TOKEN_TTL_MINUTES")
+    env["REFRESH_TOKEN_TTL_DAYS"] = os.getenv("REFRESH_TOKEN_TTL_DAYS")
 #===========================================================
 
 """ DATABASE RELATED ACTIONS """
@@ -205,6 +237,13 @@ def get_member_by_card_id_with_raise(db: Session, card_id: str) -> Member:
                             detail="No mmeber with such id was found in DB")
     return member
 
+async def get_member_by_card_id_with_raise_async(db: AsyncSession, card_id: str) -> Member:
+    member: Member = (await db.execute(select(Member).where(Member.card_id == card_id))).scalars().first()
+    if not member:
+        raise HTTPException(status_code=400,
+                            detail="No mmeber with such id was found in DB")
+    return member
+
 def get_member_by_username(db: Session, username: str) -> Member:
     return db.query(Member).filter(Member.username == username).first()
 
@@ -214,6 +253,15 @@ def get_external_provider_by_id(db: Session, id: int) -> ExternalProvider:
 def get_member_pass_by_id(db: Session, id: int) -> MemberPass:
     return db.query(MemberPass).filter(MemberPass.id == id).first()
 
+def explain_query_plan(db: Session, query: Query) -> list[str]:
+    """ Returns SQLite "EXPLAIN QUERY PLAN" details for the query, e.g. 
+        ["SEARCH member_passes USING INDEX ix_... (member_card_id=? AND ...)"]
+    """
+    compiled = query.statement.compile(bind=db.get_bind())
+    params = tuple(compiled.params[key] for key in compiled.positiontup)
+    rows = db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).all()
+    return [row[-1] for row in rows]
+
 """ Functions to use databases inside FastAPI through "Depends". """
 def get_db_members():
     db = SessionLocal_Members()
@@ -228,20 +276,25 @@ def get_db_checkins():
         yield db
     finally:
         db.close()
+
+""" Same for "async def" endpoints [AsyncSession] """
+async def get_db_members_async():
+    async with SessionLocal_Members_Async() as db:
+        yield db
+
+async def get_db_checkins_async():
+    async with SessionLocal_Checkins_Async() as db:
+        yield db
 #===========================================================
 
 """ UTILS """
 def hash_string(string: str) -> str:
-    ph = PasswordHasher()
-    return ph.hash(string)
+    """ Hashes in the calling thread. Endpoints use "password_hashing.pool" instead """
+    return password_hashing.hash_password(string)
 
 def verify_hash(string: str, hash: str) -> bool:
-    ph = PasswordHasher()
-    try:
-        ph.verify(hash, string)
-        return True
-    except argon2.exceptions.VerifyMismatchError:
-        return False
+    is_correct, _ = password_hashing.verify_password(string, hash)
+    return is_correct
 
 def get_random_string(len: int) -> str:
     return ''.join(random.choice(string.ascii_lowercase + string.ascii_uppercase + string.digits) for _ in range(len))
@@ -252,6 +305,25 @@ def filter_kwargs_for_class(cls, data: dict):
     valid_keys = cls.__table__.columns.keys()
     return {k: v for k, v in data.items() if k in valid_keys and k != 'self'}
 
+""" Keyset pagination: cursor is an opaque token with the sort key of the last row returned,
+    next page seeks past it through the index instead of skipping OFFSET rows.
+"""
+def encode_cursor(*values) -> str:
+    payload = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    token = base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode())
+    return token.decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types: type) -> tuple:
+    """ Reverse of encode_cursor(): "types" of the values in the same order [date, datetime, int, str] """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError("Wrong amount of values")
+        return tuple(value_type.fromisoformat(value) if value_type in (date, datetime) else value_type(value)
+                     for value_type, value in zip(types, payload))
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 """ QR Codes """
 def generate_qr_code_value(db: Session = Depends(get_db_members)) -> str:
     """ Generate unique value for QR code.
@@ -263,76 +335,39 @@ def generate_qr_code_value(db: Session = Depends(get_db_members)) -> str:
         if not exists:
             return code_value
         
+async def generate_qr_code_value_async(db: AsyncSession) -> str:
+    """ Same as generate_qr_code_value() for AsyncSession """
+    while True:
+        code_value: str = get_random_string(int(env["QR_CODE_VALUE_LEN"]))
+        exists = (await db.execute(select(Member.id).where(Member.card_id == code_value))).first()
+        if not exists:
+            return code_value
+
 def generate_qr_code(code: str,
                      fill_color: str = "black",
                      back_color: str = "white") -> Path:
-    """ Generates QR code image based on provided data
+    """ Generates QR code image based on provided data --> stores it in "qr_codes" [see qr_render]
     """
-    # Parameters
-    box_size: int = 12
-    border: int = 2
-    logo_scale: float = 0.22
-    add_label: bool = False
-    label_text: str = "IMPACT"
-    logo_path = r"assets/logo.jpg"
-    
-    qr = qrcode.QRCode(
-        version=3,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=box_size,
-        border=border,
-    )
-    qr.add_data(code)
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
-
-    # 2) Centered logo with white padding ring
-    logo = Image.open(logo_path).convert("RGBA")
-    qr_w, qr_h = qr_img.size
-    target_logo_w = int(qr_w * logo_scale)
-    ratio = target_logo_w / logo.width
-    logo = logo.resize((target_logo_w, int(logo.height * ratio)), Image.LANCZOS)
-
-    pad = int(target_logo_w * 0.18)
-    bg_w, bg_h = logo.width + pad*2, logo.height + pad*2
-    bg = Image.new("RGBA", (bg_w, bg_h), (255, 255, 255, 255))
-    mask = Image.new("L", (bg_w, bg_h), 0)
-    draw = ImageDraw.Draw(mask)
-    draw.rounded_rectangle((0, 0, bg_w, bg_h), radius=int(min(bg_w,bg_h)*0.12), fill=255)
-    padded = Image.new("RGBA", (bg_w, bg_h))
-    padded.paste(bg, (0, 0), mask)
-    padded.paste(logo, (pad, pad), logo)
-
-    x = (qr_w - padded.width)//2
-    y = (qr_h - padded.height)//2
-    qr_img.paste(padded, (x, y), padded)
-
-    # 3) Add thick black border frame
-    frame_thickness = int(qr_w * 0.04)
-    framed_size = qr_w + 2 * frame_thickness
-    framed = Image.new("RGB", (framed_size, framed_size), "black")
-    framed.paste(qr_img, (frame_thickness, frame_thickness))
-    qr_img = framed
-    qr_w, qr_h = qr_img.size
-
-    # Save QR code on the disc --> return Path to it
-    qr_name = "{code}.png".format(code=code)
-    qr_path = Path(Path.resolve(Path.cwd()), "qr_codes", qr_name)
-    qr_img.save(qr_path)
-    return qr_path
+    return save_qr_code(code, qr_render.QRStyle(fill_color=fill_color, back_color=back_color))
 
-def generate_qr_code_member(member: Member) -> Path:
+def save_qr_code(code: str, style: qr_render.QRStyle) -> Path:
+    return write_qr_code_file(code, qr_render.render_png(code, style))
+
+def write_qr_code_file(code: str, png: bytes) -> Path:
+    # Save QR code on the disc [atomic replace] --> return Path to it
+    return qr_files.write(code, png).path
+
+def get_qr_style_member(member: Member) -> qr_render.QRStyle:
     # Define what color of QR code will be.
-    fill_color: str = "black"
-    back_color: str = "white"
     match member.account_type:
-        case AccountType.ADMIN:
-            fill_color = "blue"
-        case AccountType.INSTRUCTOR:
-            fill_color = "green"
+        case AccountType.ADMIN.value:
+            return qr_render.QRStyle(fill_color="blue")
+        case AccountType.INSTRUCTOR.value:
+            return qr_render.QRStyle(fill_color="green")
+    return qr_render.QRStyle()
 
-    return generate_qr_code(member.card_id,
-                            fill_color=fill_color, back_color=back_color)
+def generate_qr_code_member(member: Member) -> Path:
+    return save_qr_code(member.card_id, get_qr_style_member(member))
 
 
 """ EMAIL
@@ -484,7 +519,7 @@ def SendGrid_send_welcome_email(email_to: str,
         return False
 
 def SendGrid_send_welcome_email_member(member: Member, 
-                              qr_path: Path, password: str) -> None:
+                              qr_path: Path, password: str) -> bool | None:
     
     # Choose appropriate template based on member role
     match AccountType(member.account_type):
@@ -498,10 +533,84 @@ def SendGrid_send_welcome_email_member(member: Member,
             template = Path(PATH_TEMPLATES, "welcome_email_template_Member.txt")
          
     # Member contain only hass password --> raw pass should be provided explicetely
-    SendGrid_send_welcome_email(member.email,
-                                member.name, member.surname,
-                                member.username, password, 
-                                qr_path, template)
+    return SendGrid_send_welcome_email(member.email,
+                                       member.name, member.surname,
+                                       member.username, password, 
+                                       qr_path, template)
+
+def deliver_member_card(card_id: str, password: str | None, send_email: bool = True) -> None:
+    """ Post-commit task [see post_commit]: renders QR code of the member if missing --> sends the welcome mail.
+        Raises if the mail was not accepted --> the task is retried.
+    """
+    with SessionLocal_Members() as db:
+        member = get_member_by_card_id(db, card_id)
+    if member is None:
+        return
+
+    stored = qr_files.get(card_id)
+    qr_path = stored.path if stored is not None else generate_qr_code_member(member)
+    if send_email and SendGrid_send_welcome_email_member(member=member, qr_path=qr_path, password=password) is False:
+        raise RuntimeError("Welcome email to {email} was not accepted by SendGrid".format(email=member.email))
+
+def queue_welcome_email(db: Session, card_id: str, reset_password: bool = True) -> WelcomeEmailOutbox:
+    """ Adds the welcome e-mail to the outbox [committed by the caller, together with the member] """
+    entry = WelcomeEmailOutbox(card_id=card_id, reset_password=reset_password, created_at=datetime.now(), attempts=0)
+    db.add(entry)
+    return entry
+
+# Claim of a process that died while sending is taken over after this time
+WELCOME_EMAIL_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+def welcome_email_claimable(now: datetime):
+    return or_(WelcomeEmailOutbox.claimed_at.is_(None),
+               WelcomeEmailOutbox.claimed_at < now - WELCOME_EMAIL_CLAIM_TIMEOUT)
+
+def deliver_welcome_email(outbox_id: int) -> None:
+    """ Post-commit task: claims the outbox entry --> delivers it --> deletes it.
+        Entry delivered already or claimed by another process --> nothing to do.
+        Password in the mail is set right before sending [a mail that failed carries a password nobody knows].
+        Failure is recorded on the entry, the claim released and the error raised --> the task is retried,
+        the entry is kept for the next start.
+    """
+    claimed_by = "{host}:{pid}".format(host=socket.gethostname(), pid=os.getpid())
+    with SessionLocal_Members() as db:
+        now = datetime.now()
+        claimed = db.execute(
+            update(WelcomeEmailOutbox)
+            .where(WelcomeEmailOutbox.id == outbox_id, welcome_email_claimable(now))
+            .values(claimed_at=now, claimed_by=claimed_by)
+            .returning(WelcomeEmailOutbox.card_id, WelcomeEmailOutbox.reset_password)).first()
+        db.commit()
+        if claimed is None:
+            return
+        card_id, reset_password = claimed
+        is_own_claim = and_(WelcomeEmailOutbox.id == outbox_id, WelcomeEmailOutbox.claimed_by == claimed_by)
+
+        try:
+            password = "Confidential"
+            if reset_password:
+                member = get_member_by_card_id(db, card_id)
+                if member is not None:
+                    password = get_random_string(12)
+                    member.password_hash = password_hashing.pool.hash(password)
+                    db.commit()
+            deliver_member_card(card_id, password)
+        except Exception as e:
+            db.rollback()
+            db.execute(update(WelcomeEmailOutbox)
+                       .where(is_own_claim)
+                       .values(attempts=WelcomeEmailOutbox.attempts + 1, last_error=str(e)[:500],
+                               claimed_at=None, claimed_by=None))
+            db.commit()
+            raise
+        db.execute(delete(WelcomeEmailOutbox).where(is_own_claim))
+        db.commit()
+
+def get_pending_welcome_emails(db: Session) -> list[tuple[int, str]]:
+    """ (outbox ID, card ID) of welcome e-mails not delivered yet and not being delivered right now """
+    return db.execute(select(WelcomeEmailOutbox.id, WelcomeEmailOutbox.card_id)
+                      .where(welcome_email_claimable(datetime.now()))
+                      .order_by(WelcomeEmailOutbox.id)).tuples().all()
 
 def SendGrid_send_confirmation_mail(to_email, key: str):
     if env["SEND_WELCOME_EMAIL"] != "Sendgrid":
@@ -0,0 +1,96 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import Member
+import project_utils as utils
+import qr_render
+#===========================================================
+
+""" BATCH QR REGENERATION [manage.py]
+    After the logo / colours change every stored card is stale. Members are read from the DB in
+    batches of "batch_size" (keyset on "id", never the whole table), each batch is rendered on a process pool
+    and every file is replaced atomically (temporary file + os.replace) --> the app keeps serving the old
+    or the new image, never a broken one.
+
+    After every batch the last finished member ID is written to the progress file, so an interrupted run
+    continues where it stopped. The file is removed when the run completes.
+"""
+PATH_PROGRESS = Path(utils.PATH_QR_CODES, ".regenerate_progress.json")
+
+@dataclass
+class RegenerateProgress:
+    last_member_id: int = 0
+    cards: int = 0
+    bytes_written: int = 0
+    seconds: float = 0.0        # Rendering time of all runs together
+
+    @property
+    def cards_per_second(self) -> float:
+        return self.cards / self.seconds if self.seconds else 0.0
+
+def load_progress(path: Path = PATH_PROGRESS) -> RegenerateProgress:
+    if not path.exists():
+        return RegenerateProgress()
+    return RegenerateProgress(**json.loads(path.read_text(encoding="utf-8")))
+
+def save_progress(progress: RegenerateProgress, path: Path = PATH_PROGRESS) -> None:
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps(asdict(progress)), encoding="utf-8")
+    os.replace(temporary, path)
+#===========================================================
+
+def iterate_member_batches(db: Session, after_id: int, batch_size: int) -> Iterator[list[tuple[int, str, int]]]:
+    """ (id, card_id, account_type) of members with ID above "after_id", "batch_size" at a time """
+    while True:
+        rows = db.execute(
+            select(Member.id, Member.card_id, Member.account_type)
+            .where(Member.id > after_id,
+                   Member.card_id.is_not(None))
+            .order_by(Member.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        yield [tuple(row) for row in rows]
+        after_id = rows[-1][0]
+
+def render_card(card_id: str, account_type: int) -> int:
+    """ Executed in worker processes. Returns size of the written PNG """
+    style = utils.get_qr_style_member(Member(card_id=card_id, account_type=account_type))
+    # Not through qr_render.render_png(): worker processes do not need the LRU
+    png = qr_render.encode_png(qr_render.render_image(card_id, style))
+    utils.write_qr_code_file(card_id, png)
+    return len(png)
+
+def regenerate_all(db: Session, workers: int = None, batch_size: int = 500, restart: bool = False,
+                   progress_callback: Optional[Callable[[RegenerateProgress], None]] = None) -> RegenerateProgress:
+    """ Renders the QR code of every member again. Continues an interrupted run unless "restart" """
+    progress = RegenerateProgress() if restart else load_progress()
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in iterate_member_batches(db, progress.last_member_id, batch_size):
+            started = time.perf_counter()
+            sizes = pool.map(render_card,
+                             [card_id for _, card_id, _ in batch],
+                             [account_type for _, _, account_type in batch],
+                             chunksize=max(1, len(batch) // (workers * 4)))
+            progress.bytes_written += sum(sizes)
+            progress.cards += len(batch)
+            progress.seconds += time.perf_counter() - started
+            progress.last_member_id = batch[-1][0]
+            save_progress(progress)
+            if progress_callback:
+                progress_callback(progress)
+
+    PATH_PROGRESS.unlink(missing_ok=True)
+    return progress
+#===========================================================
@@ -0,0 +1,205 @@
+import io
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+import qrcode
+import qrcode.constants
+from PIL import Image, ImageColor, ImageDraw
+#===========================================================
+
+""" QR RENDERING ENGINE
+    Everything that does not depend on the card ID is prepared once and cached:
+        logo       - read and decoded once per process,
+        overlay    - logo resized (LANCZOS) on its rounded padding, once per QR size and background colour.
+    Per member only the QR matrix is computed and scaled up (NEAREST on a 2-colour image),
+    then the overlay is pasted and the frame added.
+
+    Encoded images are kept in a bounded LRU keyed by (card ID, style, output) --> repeated requests
+    for the same card do not render at all.
+
+    Outputs:
+        png     - full card: coloured modules, logo, frame [~13 kB],
+        svg     - vector modules in the style colours, no logo / frame [scales to any size, ~3 kB],
+        compact - 1-bit PNG, black on white, no logo / frame [scanners, thermal printers, <1 kB].
+"""
+LOGO_PATH = Path("assets", "logo.jpg")
+QR_OUTPUTS = ("png", "svg", "compact")
+QR_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml", "compact": "image/png"}
+COMPACT_BOX_SIZE = 4            # Pixels per module of the compact PNG
+
+@dataclass(frozen=True)
+class QRStyle:
+    fill_color: str = "black"
+    back_color: str = "white"
+    frame_color: str = "black"
+    box_size: int = 12              # Pixels per module
+    border: int = 2                 # Modules of quiet zone
+    logo_scale: float = 0.22        # Logo width / QR width
+    frame_scale: float = 0.04       # Frame thickness / QR width
+#===========================================================
+
+""" CACHED PARTS [card ID independent]
+"""
+@lru_cache(maxsize=1)
+def load_logo() -> Image.Image:
+    logo = Image.open(LOGO_PATH).convert("RGBA")
+    logo.load()
+    return logo
+
+@lru_cache(maxsize=32)
+def logo_overlay(qr_width: int, logo_scale: float, back_color: str) -> Image.Image:
+    """ Logo on a rounded padding of the background colour, sized for a QR of "qr_width" pixels """
+    logo = load_logo()
+    target_logo_w = int(qr_width * logo_scale)
+    ratio = target_logo_w / logo.width
+    logo = logo.resize((target_logo_w, int(logo.height * ratio)), Image.LANCZOS)
+
+    pad = int(target_logo_w * 0.18)
+    bg_w, bg_h = logo.width + pad*2, logo.height + pad*2
+    bg = Image.new("RGBA", (bg_w, bg_h), ImageColor.getrgb(back_color) + (255,))
+    mask = Image.new("L", (bg_w, bg_h), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.rounded_rectangle((0, 0, bg_w, bg_h), radius=int(min(bg_w, bg_h)*0.12), fill=255)
+    padded = Image.new("RGBA", (bg_w, bg_h))
+    padded.paste(bg, (0, 0), mask)
+    padded.paste(logo, (pad, pad), logo)
+    return padded
+#===========================================================
+
+""" RENDERING
+"""
+def qr_matrix(code: str, border: int) -> list[list[bool]]:
+    """ Modules of the QR code [True - dark], quiet zone included """
+    qr = qrcode.QRCode(
+        version=3,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        border=border,
+    )
+    qr.add_data(code)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+def render_matrix(matrix: list[list[bool]], style: QRStyle) -> Image.Image:
+    """ One pixel per module on a 2-colour palette, scaled up --> RGB image """
+    size = len(matrix)
+    image = Image.frombytes("P", (size, size), bytes(1 if module else 0 for row in matrix for module in row))
+    image.putpalette(ImageColor.getrgb(style.back_color) + ImageColor.getrgb(style.fill_color))
+    image = image.resize((size * style.box_size, size * style.box_size), Image.NEAREST)
+    return image.convert("RGB")
+
+def render_image(code: str, style: QRStyle = QRStyle()) -> Image.Image:
+    qr_img = render_matrix(qr_matrix(code, style.border), style)
+    qr_w, qr_h = qr_img.size
+
+    # Centered logo with padding ring
+    overlay = logo_overlay(qr_w, style.logo_scale, style.back_color)
+    qr_img.paste(overlay, ((qr_w - overlay.width)//2, (qr_h - overlay.height)//2), overlay)
+
+    # Thick frame
+    frame_thickness = int(qr_w * style.frame_scale)
+    framed = Image.new("RGB", (qr_w + 2*frame_thickness, qr_h + 2*frame_thickness), style.frame_color)
+    framed.paste(qr_img, (frame_thickness, frame_thickness))
+    return framed
+
+def encode_png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def render_compact_png(code: str, style: QRStyle = QRStyle()) -> bytes:
+    """ 1 bit per pixel, quiet zone only [colours, logo and frame of the style are ignored] """
+    matrix = qr_matrix(code, style.border)
+    size = len(matrix)
+    image = Image.frombytes("L", (size, size), bytes(0 if module else 255 for row in matrix for module in row))
+    image = image.resize((size * COMPACT_BOX_SIZE, size * COMPACT_BOX_SIZE), Image.NEAREST).convert("1")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+def render_svg(code: str, style: QRStyle = QRStyle()) -> bytes:
+    """ One <path> for all dark modules [horizontal runs merged], 1 unit = 1 module """
+    matrix = qr_matrix(code, style.border)
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                runs.append("M{x} {y}h{length}v1h-{length}z".format(x=start, y=y, length=x - start))
+            else:
+                x += 1
+
+    return ('<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+            '<rect width="{size}" height="{size}" fill="{back}"/>'
+            '<path fill="{fill}" d="{path}"/></svg>').format(
+                size=size, back=style.back_color, fill=style.fill_color, path="".join(runs)).encode("utf-8")
+
+_RENDERERS = {
+    "png": lambda code, style: encode_png(render_image(code, style)),
+    "svg": render_svg,
+    "compact": render_compact_png,
+}
+#===========================================================
+
+class PngCache:
+    """ Bounded LRU of encoded QR images: (card ID, style, output) --> bytes.
+
+    Args:
+        max_entries: int -> Images kept; least recently used are dropped first.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._images: OrderedDict[tuple[str, QRStyle, str], bytes] = OrderedDict()
+
+    def configure(self, max_entries: int = None) -> None:
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self.clear()
+
+    def get(self, card_id: str, style: QRStyle, output: str = "png") -> bytes | None:
+        with self._lock:
+            image = self._images.get((card_id, style, output))
+            if image is not None:
+                self._images.move_to_end((card_id, style, output))
+            return image
+
+    def put(self, card_id: str, style: QRStyle, image: bytes, output: str = "png") -> None:
+        with self._lock:
+            self._images[(card_id, style, output)] = image
+            self._images.move_to_end((card_id, style, output))
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+
+    def invalidate(self, card_id: str) -> None:
+        """ Drops every style and output of the card """
+        with self._lock:
+            for key in [key for key in self._images if key[0] == card_id]:
+                del self._images[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+
+png_cache = PngCache()
+#===========================================================
+
+def render(card_id: str, style: QRStyle = QRStyle(), output: str = "png") -> bytes:
+    """ Encoded image of the card ["output" from QR_OUTPUTS], rendered only on a cache miss """
+    image = png_cache.get(card_id, style, output)
+    if image is None:
+        image = _RENDERERS[output](card_id, style)
+        png_cache.put(card_id, style, image, output)
+    return image
+
+def render_png(card_id: str, style: QRStyle = QRStyle()) -> bytes:
+    """ Full PNG card, rendered only on a cache miss """
+    return render(card_id, style, "png")
+#===========================================================
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import random
+import string
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+#===========================================================
+
+""" QR CODE FILES
+    "<folder>/<card_id>.png" stays the stored file [emails, other processes], its ETag is the SHA-256
+    of the content --> same image, same ETag in every worker and after restarts, and a regenerated
+    image (manage.py regenerate-qr) gets a new one.
+
+    Index card ID --> (file identity, ETag, bytes) is kept in memory. Entry is valid while the file is
+    the same (inode, size, mtime); a file replaced by another process is noticed by one stat() call.
+    Missing / stale entries are filled from the file itself [hashing ~13 kB is a few microseconds].
+"""
+@dataclass(frozen=True)
+class StoredQR:
+    path: Path
+    identity: tuple     # (inode, size, mtime_ns) of the file the entry was read from
+    etag: str           # Strong ETag, quoted
+    png: bytes
+
+def compute_etag(png: bytes) -> str:
+    return '"{digest}"'.format(digest=hashlib.sha256(png).hexdigest())
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """ "If-None-Match" header check [list of ETags or "*", weak comparison as RFC 9110 requires] """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def _file_identity(stat: os.stat_result) -> tuple:
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+#===========================================================
+
+class QRStore:
+    """ Stored QR images with their ETags.
+
+    Args:
+        directory: Path -> Folder of the "<card_id>.png" files.
+        max_entries: int -> Images kept in memory; least recently used are dropped first.
+    """
+
+    def __init__(self, directory: Path, max_entries: int = 1000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, StoredQR] = OrderedDict()
+
+    def configure(self, max_entries: int = None) -> None:
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self.clear()
+
+    def path(self, card_id: str) -> Path:
+        return Path(self.directory, "{card_id}.png".format(card_id=card_id))
+
+    def get(self, card_id: str) -> StoredQR | None:
+        """ Stored image of the card [None if there is no file] """
+        path = self.path(card_id)
+        try:
+            identity = _file_identity(path.stat())
+        except FileNotFoundError:
+            self.forget(card_id)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(card_id)
+            if entry is not None and entry.identity == identity:
+                self._entries.move_to_end(card_id)
+                return entry
+
+        # Not known yet or replaced meanwhile --> read it again
+        try:
+            with open(path, "rb") as file:
+                identity = _file_identity(os.fstat(file.fileno()))
+                png = file.read()
+        except FileNotFoundError:
+            self.forget(card_id)
+            return None
+        return self._put(card_id, StoredQR(path=path, identity=identity, etag=compute_etag(png), png=png))
+
+    def write(self, card_id: str, png: bytes) -> StoredQR:
+        """ Temporary file + rename --> readers never see a half-written file """
+        path = self.path(card_id)
+        suffix = "".join(random.choice(string.ascii_letters + string.digits) for _ in range(8))
+        temporary = path.with_name("{name}.{suffix}.tmp".format(name=path.name, suffix=suffix))
+        temporary.write_bytes(png)
+        os.replace(temporary, path)
+        identity = _file_identity(path.stat())
+        return self._put(card_id, StoredQR(path=path, identity=identity, etag=compute_etag(png), png=png))
+
+    def forget(self, card_id: str) -> None:
+        with self._lock:
+            self._entries.pop(card_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _put(self, card_id: str, entry: StoredQR) -> StoredQR:
+        with self._lock:
+            self._entries[card_id] = entry
+            self._entries.move_to_end(card_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+#===========================================================
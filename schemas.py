@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import date, datetime
-from typing import List, Optional
+from typing import List, Literal, Optional
 from decimal import Decimal
 #===========================================================
 
@@ -52,13 +52,37 @@ class Resp_Members_Inst(BaseModel):
         from_attributes = True
 
 class Resp_Paginated_Members_Instances(BaseModel):
-    total: int          # Total items in DB
-    page: int           # Current page
-    page_size: int      # Items per page
-    remaining: int      # How many are left
+    total: Optional[int]        # Total items in DB [None - not counted for cursor pages]
+    page: int                   # Current page
+    page_size: int              # Items per page
+    remaining: Optional[int]    # How many are left [None - not counted for cursor pages]
+    next_cursor: Optional[str] = None   # Pass as "cursor" to get the next page [None - last page]
     items: List[Resp_Members_Inst]
 #===========================================================
 
+""" USER MANAGEMENT:
+    Session tokens
+"""
+class Req_LogIn_Refresh(BaseModel):
+    refresh_token: str
+
+class Req_LogOut(BaseModel):
+    refresh_token: Optional[str] = None   # Revoked together with the access token if provided
+
+class Resp_LogIn_Tokens(BaseModel):
+    access_token: str
+    refresh_token: str
+    token_type: str                         # "bearer"
+    expires_in: int                         # Seconds the access token is valid for
+    member: Resp_Members_Inst
+
+class Resp_LogIn_Session(BaseModel):
+    member_id: int
+    card_id: str
+    account_type: int
+    expires_at: datetime
+#===========================================================
+
 """ EXTERNAL PROVIDERS
     (External payment methods)
 """
@@ -164,9 +188,10 @@ class Req_CheckIn_Add(BaseModel):
     validated_by_card_id: Optional[str]
     external_provider_id: Optional[int]
     member_card_id: str
+    hall: Optional[str] = None
 
 class Resp_ChecIn_Inst(BaseModel):
-    id: int
+    id: Optional[int] = None    # None while row waits in the write-behind queue
     validated_by_card_id: Optional[str]
     validated_by_name: Optional[str]
     validated_by_surnamename: Optional[str]
@@ -187,6 +212,22 @@ class Resp_ChecIn_Inst(BaseModel):
 
     class Config:
         from_attributes = True
+
+class Req_CheckIn_Sync(Req_CheckIn_Add):
+    client_scan_id: str     # Unique ID given by the scanner --> to match results with its buffer
+    date_time: datetime     # Original time of the scan
+
+class Req_CheckIn_Sync_Batch(BaseModel):
+    scans: List[Req_CheckIn_Sync]
+
+class Resp_CheckIn_Sync(BaseModel):
+    client_scan_id: str
+    status_code: int                        # 202 - logged [successful or not], other - not logged
+    detail: Optional[str] = None            # Reason why scan was not logged
+    check_in: Optional[Resp_ChecIn_Inst] = None
+
+class Resp_CheckIn_Sync_Batch(BaseModel):
+    items: List[Resp_CheckIn_Sync]
 #===========================================================
 
 """ STATISTICS
@@ -205,8 +246,10 @@ class Req_Statistics_InstructorCheckInsDetailed(BaseModel):
     validated_by_card_id: str
     date_from: date
     date_to: date
-    page: Optional[int]
+    page: Optional[int] = 0
     page_size: Optional[int] = 50
+    cursor: Optional[str] = None            # "next_cursor" of the previous page --> "page" is ignored
+    include_total: Optional[bool] = None    # [None - count only when no cursor is given]
 
 class Resp_Statistics_InstructorCheckInsDetailed(BaseModel):
     name: str
@@ -216,9 +259,66 @@ class Resp_Statistics_InstructorCheckInsDetailed(BaseModel):
     rejected_reason: Optional[str]
 
 class Resp_Paginated_Statistics_InstructorCheckInsDetailed(BaseModel):
-    total: int          # Total items in DB
-    page: int           # Current page
-    page_size: int      # Items per page
-    remaining: int      # How many are left
+    total: Optional[int]        # Total items in DB [None - not counted]
+    page: int                   # Current page
+    page_size: int              # Items per page
+    remaining: Optional[int]    # How many are left [None - not counted]
+    next_cursor: Optional[str] = None   # Pass as "cursor" to get the next page [None - last page]
     items: List[Resp_Statistics_InstructorCheckInsDetailed]
+
+class Req_Statistics_Attendance(BaseModel):
+    date_from: date
+    date_to: date                           # Inclusive
+    hall: Optional[str] = None              # [None - all halls]
+    only_successful: bool = True
+
+class Resp_Statistics_HallOccupancy(BaseModel):
+    hall: Optional[str]                     # [None - scans without a hall]
+    entries: List[int]                      # Per hour of the day [0..23]
+    average_per_day: List[float]            # entries / days in the range
+
+class Resp_Statistics_PassTypeAttendance(BaseModel):
+    pass_name: Optional[str]
+    external_provider_name: Optional[str]
+    entries: int
+
+class Resp_Statistics_Attendance(BaseModel):
+    total: int
+    days: int
+    heatmap: List[List[int]]                # [weekday: 0 - Monday][hour: 0..23]
+    halls: List[Resp_Statistics_HallOccupancy]
+    pass_types: List[Resp_Statistics_PassTypeAttendance]
+
+class Req_Statistics_Revenue(BaseModel):
+    date_from: date
+    date_to: date                           # Inclusive
+    group_by: Literal["day", "week", "month"] = "month"
+
+class Resp_Statistics_RevenueRow(BaseModel):
+    period: date                            # First day of the day / week (Monday) / month
+    pass_type_id: Optional[int]
+    pass_type_name: str
+    passes_sold: int
+    revenue: Decimal                        # Price of every pass sold
+    external_provider_passes: int           # Passes bound to an ExternalProvider
+    external_provider_revenue: Decimal      # Part of "revenue" covered by ExternalProviders
+    partial_payments: Decimal               # ExternalProvider.partial_payment paid by members on top
+
+class Resp_Statistics_Revenue(BaseModel):
+    group_by: str
+    passes_sold: int
+    revenue: Decimal
+    external_provider_revenue: Decimal
+    external_provider_share: float          # external_provider_revenue / revenue [0 - no revenue]
+    partial_payments: Decimal
+    items: List[Resp_Statistics_RevenueRow]
+#===========================================================
+
+class Resp_Statistics_HashingPool(BaseModel):
+    workers: int                            # Maximum hashes running at the same time
+    running: int
+    queue_depth: int                        # Hashes waiting for a free worker
+    max_queue: int
+    completed: int
+    rejected: int                           # Refused with 503 [queue was full]
 #===========================================================
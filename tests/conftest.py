@@ -0,0 +1,106 @@
+""" Shared setup of the test suite.
+
+    The application reads its configuration and opens its databases on import --> environment and working
+    folder are prepared here, before any project module is imported. Every test session gets a fresh
+    temporary folder: databases, archives, journals and QR codes never touch the project folder.
+
+    Usage [from the project folder]:
+        python -m pytest -q
+"""
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+PATH_PROJECT = Path(__file__).resolve().parent.parent
+PATH_SESSION = Path(tempfile.mkdtemp(prefix="impact_tests_"))
+ROOT_PASSWORD = "rootpass"
+member_numbers = itertools.count()
+#===========================================================
+
+""" ENVIRONMENT [before the project is imported]
+"""
+os.environ["DB_MEMBERS_URL"] = "sqlite:///{path}".format(path=Path(PATH_SESSION, "databases", "members.db").as_posix())
+os.environ["DB_CHECKINS_URL"] = "sqlite:///{path}".format(path=Path(PATH_SESSION, "databases", "checkins.db").as_posix())
+for key, value in {
+    "ROOT_NAME": "Root", "ROOT_SURNAME": "Tests", "ROOT_LOGIN": "root",
+    "ROOT_PASS": ROOT_PASSWORD, "ROOT_EMAIL": "root@tests.local",
+    "SEND_WELCOME_EMAIL": "False", "QR_CODE_VALUE_LEN": "12",
+    "SECRET_KEY": "tests", "SECRET_SALT": "tests", "BACKEND_ADDRESS": "http://testserver",
+}.items():
+    os.environ[key] = value
+
+# Application expects to be started from the project folder ("static", "templates", "assets")
+Path(PATH_SESSION, "databases").mkdir()
+for folder in ("assets", "static", "templates"):
+    os.symlink(Path(PATH_PROJECT, folder), Path(PATH_SESSION, folder), target_is_directory=True)
+os.chdir(PATH_SESSION)
+sys.path.insert(0, str(PATH_PROJECT))
+
+def pytest_unconfigure(config):
+    os.chdir(PATH_PROJECT)
+    shutil.rmtree(PATH_SESSION, ignore_errors=True)
+#===========================================================
+
+""" FIXTURES
+"""
+@pytest.fixture(scope="session")
+def client():
+    """ Application with its background workers running [lifespan] """
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture(scope="session")
+def root_card_id(client) -> str:
+    response = client.post("/login/username", json={"username": "root", "password": ROOT_PASSWORD})
+    assert response.status_code == 202, response.text
+    return response.json()["card_id"]
+
+@pytest.fixture
+def db_members():
+    from database import SessionLocal_Members
+    with SessionLocal_Members() as db:
+        yield db
+
+@pytest.fixture
+def db_checkins():
+    from database import SessionLocal_Checkins
+    with SessionLocal_Checkins() as db:
+        yield db
+
+@pytest.fixture
+def add_member(client):
+    """ Adds a member through the API --> returns its card ID """
+    def add(send_welcome_email: bool = False) -> str:
+        response = client.post("/members/add", json={
+            "name": "Name", "surname": "Surname",
+            "email": "member{n}@tests.local".format(n=next(member_numbers)),
+            "phone_number": None, "date_of_birth": None, "account_type": 3,
+            "send_welcome_email": send_welcome_email, "send_welcome_mms": None})
+        assert response.status_code == 201, response.text
+        return response.json()["card_id"]
+    return add
+
+@pytest.fixture
+def add_member_pass(client):
+    """ Gives the member a new pass type with "maximum_entries" --> returns MemberPass ID """
+    def add(member_card_id: str, maximum_entries: int = None, validity_days: int = 30) -> int:
+        response = client.post("/pass_types", json={
+            "name": "Pass {card_id}".format(card_id=member_card_id), "description": None, "price": "10.00",
+            "validity_days": validity_days, "maximum_entries": maximum_entries,
+            "requires_external_auth": False, "external_provider_name": None, "external_provider_id": None,
+            "is_ext_event_pass": False, "ext_event_code": None})
+        assert response.status_code == 201, response.text
+        response = client.post("/member_pass", json={"member_card_id": member_card_id,
+                                                     "pass_type_id": response.json()["id"]})
+        assert response.status_code == 201, response.text
+        return response.json()["id"]
+    return add
+#===========================================================
@@ -0,0 +1,169 @@
+""" Check-in validation: "/logging/checkin" and the offline replay "/logging/checkin/sync" [client_scan_id idempotency] """
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+import endpoints_logs
+from models import CheckIn, CheckInSyncScan
+
+scan_numbers = itertools.count()
+#===========================================================
+
+""" HELPERS
+"""
+def scan(member_card_id: str, validated_by_card_id: str, date_time: datetime, client_scan_id: str = None) -> dict:
+    return {"client_scan_id": client_scan_id or "scan-{n}".format(n=next(scan_numbers)),
+            "date_time": date_time.isoformat(),
+            "validated_by_card_id": validated_by_card_id,
+            "external_provider_id": None,
+            "member_card_id": member_card_id}
+
+def entries_left(client, member_card_id: str) -> int:
+    return client.get("/member_pass/active/{card_id}".format(card_id=member_card_id)).json()[0]["entries_left"]
+
+def count_rows(db_checkins, member_card_id: str) -> int:
+    return db_checkins.execute(select(func.count()).select_from(CheckIn)
+                               .where(CheckIn.member_card_id == member_card_id)).scalar_one()
+#===========================================================
+
+""" LIVE CHECK-IN
+"""
+def test_checkin_consumes_entry_and_rejects_rescan(client, root_card_id, add_member, add_member_pass):
+    member = add_member()
+    add_member_pass(member, maximum_entries=3)
+    req = {"member_card_id": member, "validated_by_card_id": root_card_id, "external_provider_id": None}
+
+    response = client.post("/logging/checkin", json=req)
+    assert response.status_code == 202
+    assert response.json()["is_successful"] is True
+    assert entries_left(client, member) == 2
+
+    response = client.post("/logging/checkin", json=req)
+    assert response.status_code == 403
+    assert entries_left(client, member) == 2
+
+def test_checkin_without_pass_is_logged_as_rejected(client, root_card_id, add_member):
+    member = add_member()
+    response = client.post("/logging/checkin", json={"member_card_id": member, "validated_by_card_id": root_card_id,
+                                                     "external_provider_id": None})
+    assert response.status_code == 202
+    assert response.json()["is_successful"] is False
+    assert response.json()["rejected_reason"] == "No valid MemberPass and ExternalProvider"
+
+def test_checkin_of_unknown_member(client, root_card_id):
+    response = client.post("/logging/checkin", json={"member_card_id": "NO-SUCH-CARD", "validated_by_card_id": root_card_id,
+                                                     "external_provider_id": None})
+    assert response.status_code == 400
+#===========================================================
+
+""" SYNC
+"""
+def test_sync_replays_scans_in_order_with_their_own_time(client, root_card_id, add_member, add_member_pass, db_checkins):
+    member = add_member()
+    add_member_pass(member, maximum_entries=2)
+    base = datetime.now() - timedelta(hours=3)
+    scans = [
+        scan(member, root_card_id, base),
+        scan(member, root_card_id, base + timedelta(minutes=1)),     # Inside the window of the first one
+        scan(member, root_card_id, base + timedelta(minutes=10)),
+        scan(member, root_card_id, base + timedelta(minutes=20)),    # Pass is used up
+        scan("NO-SUCH-CARD", root_card_id, base),
+    ]
+
+    response = client.post("/logging/checkin/sync", json={"scans": scans})
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [item["client_scan_id"] for item in items] == [s["client_scan_id"] for s in scans]
+    assert [item["status_code"] for item in items] == [202, 403, 202, 202, 400]
+    assert [items[i]["check_in"]["is_successful"] for i in (0, 2, 3)] == [True, True, False]
+    assert items[0]["check_in"]["date_time"] == scans[0]["date_time"]
+
+    # Rows are committed before the answer [IDs are known], entries are used
+    assert all(items[i]["check_in"]["id"] is not None for i in (0, 2, 3))
+    assert count_rows(db_checkins, member) == 3
+    assert client.get("/member_pass/active/{card_id}".format(card_id=member)).json() == []
+
+def test_sync_scan_time_in_the_future_is_clamped(client, root_card_id, add_member):
+    member = add_member()
+    future = datetime.now() + timedelta(days=1)
+    response = client.post("/logging/checkin/sync", json={"scans": [scan(member, root_card_id, future)]})
+    assert datetime.fromisoformat(response.json()["items"][0]["check_in"]["date_time"]) <= datetime.now()
+
+def test_sync_rejects_duplicate_client_scan_id_in_batch(client, root_card_id, add_member):
+    member = add_member()
+    base = datetime.now() - timedelta(hours=1)
+    scans = [scan(member, root_card_id, base, "duplicate-{member}".format(member=member)),
+             scan(member, root_card_id, base + timedelta(minutes=10), "duplicate-{member}".format(member=member))]
+
+    items = client.post("/logging/checkin/sync", json={"scans": scans}).json()["items"]
+    assert [item["status_code"] for item in items] == [202, 409]
+
+def test_sync_batch_size_is_limited(client, root_card_id, add_member):
+    member = add_member()
+    scans = [scan(member, root_card_id, datetime.now()) for _ in range(endpoints_logs.CHECKIN_SYNC_MAX_SCANS + 1)]
+    assert client.post("/logging/checkin/sync", json={"scans": scans}).status_code == 400
+#===========================================================
+
+""" SYNC: client_scan_id idempotency
+"""
+def test_sync_resent_batch_gets_original_outcomes(client, root_card_id, add_member, add_member_pass, db_checkins):
+    member = add_member()
+    add_member_pass(member, maximum_entries=5)
+    base = datetime.now() - timedelta(hours=2)
+    scans = [scan(member, root_card_id, base + timedelta(minutes=10 * i)) for i in range(3)]
+    scans.append(scan(member, root_card_id, base + timedelta(minutes=21)))     # Rejected by the window
+
+    first = client.post("/logging/checkin/sync", json={"scans": scans}).json()
+    resent = client.post("/logging/checkin/sync", json={"scans": scans}).json()
+    assert resent == first
+    assert [item["status_code"] for item in first["items"]] == [202, 202, 202, 403]
+
+    # Nothing is replayed twice
+    assert count_rows(db_checkins, member) == 3
+    assert entries_left(client, member) == 2
+
+def test_sync_partially_resent_batch_replays_only_new_scans(client, root_card_id, add_member, add_member_pass, db_checkins):
+    member = add_member()
+    add_member_pass(member, maximum_entries=5)
+    base = datetime.now() - timedelta(hours=2)
+    scans = [scan(member, root_card_id, base + timedelta(minutes=10 * i)) for i in range(4)]
+
+    first = client.post("/logging/checkin/sync", json={"scans": scans[:2]}).json()["items"]
+    second = client.post("/logging/checkin/sync", json={"scans": scans}).json()["items"]
+    assert second[:2] == first
+    assert [item["status_code"] for item in second] == [202] * 4
+    assert count_rows(db_checkins, member) == 4
+    assert entries_left(client, member) == 1
+
+def test_sync_outcomes_are_stored_by_client_scan_id(client, root_card_id, add_member, db_checkins):
+    member = add_member()
+    scans = [scan(member, root_card_id, datetime.now() - timedelta(hours=1)), scan("NO-SUCH-CARD", root_card_id, datetime.now())]
+    client.post("/logging/checkin/sync", json={"scans": scans})
+
+    stored = dict(db_checkins.execute(select(CheckInSyncScan.client_scan_id, CheckInSyncScan.status_code)
+                                      .where(CheckInSyncScan.client_scan_id.in_([s["client_scan_id"] for s in scans]))).tuples().all())
+    assert stored == {scans[0]["client_scan_id"]: 202, scans[1]["client_scan_id"]: 400}
+
+def test_sync_failed_write_consumes_nothing_and_can_be_resent(client, root_card_id, add_member, add_member_pass,
+                                                              db_checkins, monkeypatch):
+    member = add_member()
+    add_member_pass(member, maximum_entries=3)
+    scans = [scan(member, root_card_id, datetime.now() - timedelta(hours=1))]
+
+    def write(check_ins, before_commit=None):
+        raise RuntimeError("checkins.db is not writable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(endpoints_logs.checkin_writer, "write", write)
+        with pytest.raises(RuntimeError):
+            client.post("/logging/checkin/sync", json={"scans": scans})
+    assert entries_left(client, member) == 3
+    assert count_rows(db_checkins, member) == 0
+
+    # Memory of the failed attempt is dropped as well --> same scan is accepted
+    items = client.post("/logging/checkin/sync", json={"scans": scans}).json()["items"]
+    assert items[0]["status_code"] == 202
+    assert entries_left(client, member) == 2
+#===========================================================
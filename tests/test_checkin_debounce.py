@@ -0,0 +1,120 @@
+""" Anti-double-scan window: live scans, scans replayed by offline scanners and misses served from the CheckIn log """
+from datetime import datetime, timedelta
+
+import pytest
+
+from checkin_cache import CheckInDebounce, debounce
+from models import CheckIn
+
+SUCCESS = CheckInDebounce.WINDOW_SUCCESS_SECONDS
+REJECTED = CheckInDebounce.WINDOW_REJECTED_SECONDS
+#===========================================================
+
+""" HELPERS
+"""
+def nothing_logged() -> list[CheckIn]:
+    return []
+
+def not_expected() -> list[CheckIn]:
+    raise AssertionError("CheckIn log must not be read")
+
+@pytest.fixture
+def window() -> CheckInDebounce:
+    return CheckInDebounce()
+
+@pytest.fixture
+def now() -> datetime:
+    return datetime(2025, 3, 1, 18, 0, 0)
+#===========================================================
+
+""" DECISIONS [no database]
+"""
+def test_first_scan_is_allowed(window, now):
+    assert window.seconds_left("A", now, nothing_logged) == 0
+
+def test_rescan_after_successful_scan(window, now):
+    window.record("A", True, now)
+    assert window.seconds_left("A", now + timedelta(seconds=10), not_expected) == SUCCESS - 10
+    assert window.seconds_left("A", now + timedelta(seconds=SUCCESS + 1), not_expected) == 0
+
+def test_rescan_after_rejected_scan(window, now):
+    window.record("A", False, now)
+    assert window.seconds_left("A", now + timedelta(seconds=10), not_expected) == REJECTED - 10
+    assert window.seconds_left("A", now + timedelta(seconds=REJECTED + 1), not_expected) == 0
+
+def test_rescan_in_the_same_second_is_rejected(window, now):
+    window.record("A", True, now)
+    assert window.seconds_left("A", now, not_expected) == SUCCESS
+
+def test_members_are_independent(window, now):
+    window.record("A", True, now)
+    assert window.seconds_left("B", now, nothing_logged) == 0
+
+def test_replayed_old_scan_is_judged_by_its_own_time(window, now):
+    window.record("A", True, now)
+    old = now - timedelta(hours=3)
+    assert window.seconds_left("A", old, nothing_logged) == 0
+    window.record("A", True, old)
+
+    # Replayed scan does not open a new window for live scans
+    assert window.seconds_left("A", now + timedelta(seconds=SUCCESS + 1), not_expected) == 0
+
+def test_replayed_scan_before_a_logged_one_is_rejected(window, now):
+    window.record("A", True, now)
+    assert window.seconds_left("A", now - timedelta(minutes=2), not_expected) == SUCCESS
+
+def test_scan_older_than_memory_reads_the_log(window, now):
+    window.record("A", True, now)
+    old = now - timedelta(hours=3)
+    logged = [CheckIn(date_time=old - timedelta(seconds=20), is_successful=True)]
+    assert window.seconds_left("A", old, lambda: logged) == SUCCESS - 20
+
+def test_miss_reads_the_log(window, now):
+    logged = [CheckIn(date_time=now - timedelta(seconds=10), is_successful=False)]
+    assert window.seconds_left("A", now, lambda: logged) == REJECTED - 10
+
+def test_forget_drops_memory(window, now):
+    window.record("A", True, now)
+    window.forget("A")
+    assert window.seconds_left("A", now, nothing_logged) == 0
+#===========================================================
+
+""" API [scans of other workers are found in the CheckIn log]
+"""
+def sync(client, member_card_id: str, validated_by_card_id: str, date_time: datetime) -> int:
+    items = client.post("/logging/checkin/sync", json={"scans": [{
+        "client_scan_id": "debounce-{card_id}-{time}".format(card_id=member_card_id, time=date_time.isoformat()),
+        "date_time": date_time.isoformat(),
+        "validated_by_card_id": validated_by_card_id,
+        "external_provider_id": None,
+        "member_card_id": member_card_id}]}).json()["items"]
+    return items[0]["status_code"]
+
+def test_live_scan_after_replayed_old_scan(client, root_card_id, add_member, add_member_pass):
+    member = add_member()
+    add_member_pass(member)
+    assert sync(client, member, root_card_id, datetime.now() - timedelta(hours=3)) == 202
+    response = client.post("/logging/checkin", json={"member_card_id": member, "validated_by_card_id": root_card_id,
+                                                     "external_provider_id": None})
+    assert response.status_code == 202
+
+def test_replayed_scan_inside_window_of_live_scan(client, root_card_id, add_member, add_member_pass):
+    member = add_member()
+    add_member_pass(member)
+    response = client.post("/logging/checkin", json={"member_card_id": member, "validated_by_card_id": root_card_id,
+                                                     "external_provider_id": None})
+    assert response.status_code == 202
+    assert sync(client, member, root_card_id, datetime.now() - timedelta(minutes=2)) == 403
+
+def test_scan_logged_by_another_worker(client, root_card_id, add_member, add_member_pass):
+    member = add_member()
+    add_member_pass(member)
+    scan_time = datetime.now() - timedelta(minutes=1)
+    assert sync(client, member, root_card_id, scan_time) == 202
+
+    # Memory of this worker is empty --> row in the CheckIn log is found
+    debounce.forget(member)
+    assert sync(client, member, root_card_id, scan_time + timedelta(minutes=2)) == 403
+    debounce.forget(member)
+    assert sync(client, member, root_card_id, scan_time - timedelta(hours=1)) == 202
+#===========================================================
@@ -0,0 +1,93 @@
+""" Check-in rollups: maintained by the writer, rebuilt by backfill() and checked by verify() across archived months """
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, func, select
+
+import checkin_archive
+import checkin_rollup
+from checkin_writer import writer as checkin_writer
+from models import CheckIn, CheckInDailyRollup, CheckInHourlyRollup
+
+VALIDATOR = "ROLLUP-VALIDATOR"
+ARCHIVED_MONTH = date(2023, 2, 1)
+DATE_FROM = date(2023, 2, 1)
+DATE_TO = date(2023, 3, 31)
+#===========================================================
+
+""" HELPERS
+"""
+@pytest.fixture(scope="module")
+def logged(client) -> dict[date, int]:
+    """ Check-ins of February [archived] and March [live DB]. Returns check-ins per day. """
+    times = [datetime(2023, 2, day, hour) for day in (1, 14, 28) for hour in (9, 18)]
+    times += [datetime(2023, 3, day, 12) for day in (1, 2, 3)]
+    checkin_writer.write([CheckIn(member_card_id="ROLLUP", member_name="N", member_surname="S",
+                                  validated_by_card_id=VALIDATOR, validated_by_name="Validator",
+                                  date_time=date_time, is_successful=date_time.hour != 18, hall="Hall")
+                          for date_time in times])
+    assert checkin_archive.archive_month(ARCHIVED_MONTH) == 6
+
+    per_day: dict[date, int] = {}
+    for date_time in times:
+        per_day[date_time.date()] = per_day.get(date_time.date(), 0) + 1
+    return per_day
+
+def daily_totals(db) -> dict[date, tuple[int, int]]:
+    return {day: (successful, rejected) for day, successful, rejected in db.execute(
+        select(CheckInDailyRollup.day, CheckInDailyRollup.successful, CheckInDailyRollup.rejected)
+        .where(CheckInDailyRollup.validated_by_card_id == VALIDATOR)).tuples().all()}
+
+def hourly_total(db) -> int:
+    return db.execute(select(func.sum(CheckInHourlyRollup.successful + CheckInHourlyRollup.rejected))
+                      .where(CheckInHourlyRollup.hour >= DATE_FROM,
+                             CheckInHourlyRollup.hour < DATE_TO + timedelta(days=1))).scalar_one()
+#===========================================================
+
+""" TESTS
+"""
+def test_writer_keeps_rollups_in_sync(logged, db_checkins):
+    assert daily_totals(db_checkins) == {
+        date(2023, 2, 1): (1, 1), date(2023, 2, 14): (1, 1), date(2023, 2, 28): (1, 1),
+        date(2023, 3, 1): (1, 0), date(2023, 3, 2): (1, 0), date(2023, 3, 3): (1, 0)}
+    assert checkin_rollup.verify(db_checkins, DATE_FROM, DATE_TO) == []
+
+def test_backfill_rebuilds_archived_months(logged, db_checkins):
+    before = daily_totals(db_checkins)
+    db_checkins.execute(delete(CheckInDailyRollup).where(CheckInDailyRollup.day.between(DATE_FROM, DATE_TO)))
+    db_checkins.commit()
+    assert checkin_rollup.verify(db_checkins, DATE_FROM, DATE_TO) == \
+        [(day, count, 0) for day, count in sorted(logged.items())]
+
+    assert checkin_rollup.backfill(db_checkins, DATE_FROM, DATE_TO) > 0
+    assert daily_totals(db_checkins) == before
+    assert hourly_total(db_checkins) == sum(logged.values())
+    assert checkin_rollup.verify(db_checkins, DATE_FROM, DATE_TO) == []
+
+def test_backfill_of_a_range_leaves_other_days(logged, db_checkins):
+    before = daily_totals(db_checkins)
+    checkin_rollup.backfill(db_checkins, date(2023, 2, 14), date(2023, 3, 1))
+    assert daily_totals(db_checkins) == before
+
+def test_backfill_is_repeatable(logged, db_checkins):
+    checkin_rollup.backfill(db_checkins)
+    checkin_rollup.backfill(db_checkins)
+    assert sum(sum(counts) for counts in daily_totals(db_checkins).values()) == sum(logged.values())
+    assert checkin_rollup.verify(db_checkins) == []
+
+def test_verify_reports_wrong_day(logged, db_checkins):
+    day = date(2023, 2, 14)
+    db_checkins.execute(delete(CheckInDailyRollup).where(CheckInDailyRollup.day == day))
+    db_checkins.commit()
+    assert checkin_rollup.verify(db_checkins, DATE_FROM, DATE_TO) == [(day, logged[day], 0)]
+
+    checkin_rollup.backfill(db_checkins, day, day)
+    assert checkin_rollup.verify(db_checkins, DATE_FROM, DATE_TO) == []
+
+def test_instructors_statistics_count_archived_months(client, logged):
+    response = client.post("/statistics/instructors_checkins",
+                           json={"date_from": DATE_FROM.isoformat(), "date_to": DATE_TO.isoformat()})
+    assert response.status_code == 200
+    counts = {item["validated_by_card_id"]: item["count"] for item in response.json()}
+    assert counts[VALIDATOR] == 6   # Successful only
+#===========================================================
@@ -0,0 +1,168 @@
+""" CheckIn write-behind queue: batching, journal spill on failures and replay of the journal """
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+import checkin_writer
+import project_utils as utils
+from checkin_writer import CheckInWriter
+from database import SessionLocal_Checkins
+from models import CheckIn
+
+card_numbers = itertools.count()
+#===========================================================
+
+""" HELPERS
+"""
+@pytest.fixture(autouse=True)
+def tables():
+    utils.databases_init_tables()
+
+@pytest.fixture
+def card_id() -> str:
+    """ Member card ID not used by any other test --> rows of the test are counted by it """
+    return "WRITER{n:06d}".format(n=next(card_numbers))
+
+class FailingSessions:
+    """ Session factory of a DB that can be switched off """
+    def __init__(self):
+        self.failing = True
+
+    def __call__(self):
+        if self.failing:
+            raise RuntimeError("database is locked")
+        return SessionLocal_Checkins()
+
+def make_check_in(card_id: str, minute: int) -> CheckIn:
+    return CheckIn(member_card_id=card_id, member_name="Name", member_surname="Surname",
+                   date_time=datetime(2025, 1, 1, 10) + timedelta(minutes=minute), is_successful=True)
+
+def count_rows(card_id: str) -> int:
+    with SessionLocal_Checkins() as db:
+        return db.execute(select(func.count()).select_from(CheckIn).where(CheckIn.member_card_id == card_id)).scalar_one()
+
+def journal_lines(writer: CheckInWriter) -> int:
+    if not writer.journal_path.exists():
+        return 0
+    return len(writer.journal_path.read_text(encoding="utf-8").splitlines())
+#===========================================================
+
+""" QUEUE
+"""
+def test_queued_rows_are_written_on_flush(card_id):
+    writer = CheckInWriter(SessionLocal_Checkins, batch_size=3)
+    writer.start()
+    try:
+        for minute in range(10):
+            writer.submit(make_check_in(card_id, minute))
+        writer.flush()
+        assert count_rows(card_id) == 10
+    finally:
+        writer.stop()
+
+def test_stop_writes_rows_still_queued(card_id):
+    writer = CheckInWriter(SessionLocal_Checkins, flush_interval=1.0)
+    writer.start()
+    for minute in range(5):
+        writer.submit(make_check_in(card_id, minute))
+    writer.stop()
+    assert count_rows(card_id) == 5
+
+def test_submit_without_start_writes_synchronously(card_id):
+    CheckInWriter(SessionLocal_Checkins).submit(make_check_in(card_id, 0))
+    assert count_rows(card_id) == 1
+
+def test_write_rolls_back_rows_when_before_commit_fails(card_id):
+    writer = CheckInWriter(SessionLocal_Checkins)
+
+    def before_commit(db, ids):
+        assert len(ids) == 2
+        raise RuntimeError("outcomes not stored")
+
+    with pytest.raises(RuntimeError):
+        writer.write([make_check_in(card_id, 0), make_check_in(card_id, 1)], before_commit=before_commit)
+    assert count_rows(card_id) == 0
+#===========================================================
+
+""" JOURNAL
+"""
+def test_failed_batch_is_spilled_and_written_after_recovery(card_id, tmp_path):
+    sessions = FailingSessions()
+    writer = CheckInWriter(sessions, journal_dir=tmp_path, spill_after=2, max_retry_delay=0.01)
+    writer.start()
+    try:
+        for minute in range(3):
+            writer.submit(make_check_in(card_id, minute))
+        writer.flush()
+        assert journal_lines(writer) == 3
+        assert count_rows(card_id) == 0
+
+        # Next successful batch writes the journal as well
+        sessions.failing = False
+        writer.submit(make_check_in(card_id, 3))
+        writer.flush()
+        assert count_rows(card_id) == 4
+        assert list(tmp_path.iterdir()) == []
+    finally:
+        writer.stop()
+
+def test_stop_during_outage_spills_queue_and_start_replays_it(card_id, tmp_path):
+    sessions = FailingSessions()
+    writer = CheckInWriter(sessions, journal_dir=tmp_path, flush_interval=1.0)
+    writer.start()
+    for minute in range(4):
+        writer.submit(make_check_in(card_id, minute))
+    writer.stop()
+    assert journal_lines(writer) == 4
+    assert count_rows(card_id) == 0
+
+    sessions.failing = False
+    writer.start()
+    writer.stop()
+    assert count_rows(card_id) == 4
+    assert list(tmp_path.iterdir()) == []
+
+def test_replay_takes_journals_of_other_processes(card_id, tmp_path):
+    # Journal of a crashed worker + a file left by a replay that crashed before removing it
+    row = CheckInWriter._to_row
+    tmp_path.joinpath(checkin_writer.JOURNAL_PREFIX + "99999.jsonl").write_text(
+        checkin_writer.encode_row(row(make_check_in(card_id, 0))) + "\n", encoding="utf-8")
+    tmp_path.joinpath(checkin_writer.JOURNAL_PREFIX + "99998.1.replaying").write_text(
+        checkin_writer.encode_row(row(make_check_in(card_id, 1))) + "\n" +
+        checkin_writer.encode_row(row(make_check_in(card_id, 2))) + "\n", encoding="utf-8")
+
+    writer = CheckInWriter(SessionLocal_Checkins, journal_dir=tmp_path)
+    assert writer.replay_journal() == 3
+    assert writer.replay_journal() == 0
+    assert count_rows(card_id) == 3
+    assert list(tmp_path.iterdir()) == []
+
+def test_journal_rows_keep_their_values(card_id, tmp_path):
+    check_in = make_check_in(card_id, 0)
+    check_in.hall = "Hall"
+    check_in.is_successful = False
+    check_in.rejected_reason = "No valid MemberPass and ExternalProvider"
+    path = tmp_path.joinpath(checkin_writer.JOURNAL_PREFIX + "99999.jsonl")
+    path.write_text(checkin_writer.encode_row(CheckInWriter._to_row(check_in)) + "\n", encoding="utf-8")
+
+    CheckInWriter(SessionLocal_Checkins, journal_dir=tmp_path).replay_journal()
+    with SessionLocal_Checkins() as db:
+        stored = db.execute(select(CheckIn).where(CheckIn.member_card_id == card_id)).scalar_one()
+    assert (stored.date_time, stored.hall, stored.is_successful, stored.rejected_reason) == \
+           (check_in.date_time, check_in.hall, check_in.is_successful, check_in.rejected_reason)
+
+@pytest.mark.skipif(checkin_writer.fcntl is None, reason="File locks are not available")
+def test_journal_locked_by_another_replay_is_skipped(card_id, tmp_path):
+    path = tmp_path.joinpath(checkin_writer.JOURNAL_PREFIX + "99999.jsonl")
+    path.write_text(checkin_writer.encode_row(CheckInWriter._to_row(make_check_in(card_id, 0))) + "\n", encoding="utf-8")
+
+    writer = CheckInWriter(SessionLocal_Checkins, journal_dir=tmp_path)
+    with open(path, encoding="utf-8") as file:
+        assert checkin_writer.lock_file(file, blocking=False)
+        assert writer.replay_journal() == 0
+    assert path.exists()
+    assert writer.replay_journal() == 1
+    assert count_rows(card_id) == 1
+#===========================================================
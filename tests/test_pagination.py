@@ -0,0 +1,108 @@
+""" Keyset cursor pagination: "/members" and "/statistics/instructor_checkins/detailed" [archived months included] """
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import checkin_archive
+from checkin_writer import writer as checkin_writer
+from models import CheckIn
+
+VALIDATOR = "PAGINATION-VALIDATOR"
+#===========================================================
+
+""" MEMBERS
+"""
+def members_pages(client, page_size: int) -> list[dict]:
+    pages = [client.get("/members", params={"page_size": page_size}).json()]
+    while pages[-1]["next_cursor"] is not None:
+        pages.append(client.get("/members", params={"page_size": page_size, "cursor": pages[-1]["next_cursor"]}).json())
+    return pages
+
+def test_members_cursor_walks_every_member_once(client, add_member):
+    for _ in range(7):
+        add_member()
+
+    pages = members_pages(client, page_size=3)
+    card_ids = [item["card_id"] for page in pages for item in page["items"]]
+    assert len(card_ids) == len(set(card_ids)) == pages[0]["total"]
+    assert all(len(page["items"]) == 3 for page in pages[:-1])
+
+    # Same order as offset pages
+    offset_pages = [client.get("/members", params={"page": page, "page_size": 3}).json() for page in range(len(pages))]
+    assert card_ids == [item["card_id"] for page in offset_pages for item in page["items"]]
+
+def test_members_total_is_counted_for_first_page_only(client, add_member):
+    for _ in range(3):
+        add_member()
+    first = client.get("/members", params={"page_size": 2}).json()
+    assert first["total"] is not None
+    assert first["remaining"] == first["total"] - 2
+
+    following = client.get("/members", params={"page_size": 2, "cursor": first["next_cursor"]}).json()
+    assert following["total"] is None and following["remaining"] is None
+    counted = client.get("/members", params={"page_size": 2, "cursor": first["next_cursor"], "include_total": True}).json()
+    assert counted["total"] == first["total"]
+
+def test_members_invalid_cursor(client):
+    assert client.get("/members", params={"cursor": "not-a-cursor"}).status_code == 400
+#===========================================================
+
+""" DETAILED INSTRUCTOR STATISTICS
+"""
+@pytest.fixture(scope="module")
+def logged(client) -> list[str]:
+    """ 5 check-ins in an archived month [2 of them at the same time], 5 in the live DB.
+        Returns member names in the expected order [(date_time, id)].
+    """
+    times = [datetime(2023, 5, 2, 10), datetime(2023, 5, 3, 10), datetime(2023, 5, 3, 10),
+             datetime(2023, 5, 20, 10), datetime(2023, 5, 31, 23, 59)]
+    times += [datetime(2023, 6, 1) + timedelta(days=day, hours=8) for day in range(5)]
+    names = ["N{i:02d}".format(i=i) for i in range(len(times))]
+    checkin_writer.write([CheckIn(member_card_id="PAGINATION", member_name=name, member_surname="S",
+                                  validated_by_card_id=VALIDATOR, date_time=date_time, is_successful=True)
+                          for name, date_time in zip(names, times)])
+    assert checkin_archive.archive_month(date(2023, 5, 1)) == 5
+    return names
+
+def detailed(client, **req) -> dict:
+    req = {"validated_by_card_id": VALIDATOR, "date_from": "2023-05-01", "date_to": "2023-06-30", **req}
+    response = client.post("/statistics/instructor_checkins/detailed", json=req)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def names(page: dict) -> list[str]:
+    return [item["name"] for item in page["items"]]
+
+def test_detailed_cursor_walks_across_archive(client, logged):
+    pages = [detailed(client, page_size=3)]
+    while pages[-1]["next_cursor"] is not None:
+        pages.append(detailed(client, page_size=3, cursor=pages[-1]["next_cursor"]))
+
+    assert [len(page["items"]) for page in pages] == [3, 3, 3, 1]
+    assert [name for page in pages for name in names(page)] == logged
+    assert (pages[0]["total"], pages[0]["remaining"]) == (10, 7)
+    assert all(page["total"] is None for page in pages[1:])
+
+def test_detailed_offset_page_across_archive(client, logged):
+    page = detailed(client, page=1, page_size=3)
+    assert names(page) == logged[3:6]
+    assert page["total"] == 10
+    assert names(detailed(client, page=3, page_size=3)) == logged[9:]
+    assert detailed(client, page=4, page_size=3)["items"] == []
+
+def test_detailed_cursor_page_with_total(client, logged):
+    first = detailed(client, page_size=6)
+    following = detailed(client, page_size=6, cursor=first["next_cursor"], include_total=True)
+    assert names(following) == logged[6:]
+    assert following["total"] == 10
+    assert following["next_cursor"] is None
+
+def test_detailed_range_inside_one_partition(client, logged):
+    assert names(detailed(client, date_from="2023-06-01", date_to="2023-06-30")) == logged[5:]
+    assert names(detailed(client, date_from="2023-05-01", date_to="2023-05-30")) == logged[:4]
+
+def test_detailed_invalid_cursor(client, logged):
+    response = client.post("/statistics/instructor_checkins/detailed", json={
+        "validated_by_card_id": VALIDATOR, "date_from": "2023-05-01", "date_to": "2023-06-30", "cursor": "e30"})
+    assert response.status_code == 400
+#===========================================================
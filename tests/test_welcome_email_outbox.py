@@ -0,0 +1,142 @@
+""" Welcome e-mail outbox: delivery after the commit, retries, resend at start-up and claims of concurrent workers """
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select
+
+import endpoints_userManagement
+import password_hashing
+import project_utils as utils
+from models import Member, WelcomeEmailOutbox
+from post_commit import pipeline as post_commit_pipeline
+#===========================================================
+
+""" HELPERS
+"""
+class Mailbox:
+    """ Stand-in for SendGrid: records accepted mails, "accept" decides the answer """
+    def __init__(self):
+        self.accept = True
+        self.sent: list[tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, member: Member, qr_path, password: str) -> bool:
+        if self.accept:
+            with self._lock:
+                self.sent.append((member.card_id, password))
+        return self.accept
+
+@pytest.fixture
+def mailbox(client, monkeypatch) -> Mailbox:
+    mailbox = Mailbox()
+    monkeypatch.setattr(utils, "SendGrid_send_welcome_email_member", mailbox)
+    monkeypatch.setattr(post_commit_pipeline, "max_attempts", 3)
+    monkeypatch.setattr(post_commit_pipeline, "retry_delay", 0.01)
+    yield mailbox
+    with utils.SessionLocal_Members() as db:
+        db.execute(delete(WelcomeEmailOutbox))
+        db.commit()
+
+def outbox(card_id: str) -> list[WelcomeEmailOutbox]:
+    with utils.SessionLocal_Members() as db:
+        return db.execute(select(WelcomeEmailOutbox).where(WelcomeEmailOutbox.card_id == card_id)).scalars().all()
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+def queue_claimed(card_id: str, claimed_at: datetime) -> int:
+    """ Outbox entry claimed by a worker of another host """
+    with utils.SessionLocal_Members() as db:
+        entry = utils.queue_welcome_email(db, card_id, reset_password=False)
+        entry.claimed_at = claimed_at
+        entry.claimed_by = "other-host:1"
+        db.commit()
+        return entry.id
+#===========================================================
+
+""" DELIVERY
+"""
+def test_new_member_gets_mail_with_working_password(add_member, mailbox, db_members):
+    card_id = add_member(send_welcome_email=True)
+    post_commit_pipeline.flush()
+
+    assert [card for card, _ in mailbox.sent] == [card_id]
+    member = utils.get_member_by_card_id(db_members, card_id)
+    assert password_hashing.verify_password(mailbox.sent[0][1], member.password_hash)[0] is True
+    assert outbox(card_id) == []
+
+def test_member_without_welcome_email_has_no_outbox_entry(add_member, mailbox):
+    card_id = add_member(send_welcome_email=False)
+    post_commit_pipeline.flush()
+    assert mailbox.sent == []
+    assert outbox(card_id) == []
+
+def test_rejected_mail_is_retried_and_kept(add_member, mailbox):
+    mailbox.accept = False
+    card_id = add_member(send_welcome_email=True)
+    wait_until(lambda: outbox(card_id)[0].attempts == post_commit_pipeline.max_attempts)
+
+    entry = outbox(card_id)[0]
+    assert "not accepted" in entry.last_error
+    assert entry.claimed_at is None and entry.claimed_by is None
+
+    # Next start-up sends it again
+    mailbox.accept = True
+    assert endpoints_userManagement.resend_pending_welcome_emails() >= 1
+    wait_until(lambda: outbox(card_id) == [])
+    assert [card for card, _ in mailbox.sent] == [card_id]
+
+def test_retry_succeeds_after_temporary_failure(add_member, mailbox, monkeypatch):
+    calls = []
+
+    def flaky(member: Member, qr_path, password: str) -> bool:
+        calls.append(password)
+        return len(calls) > 1
+
+    monkeypatch.setattr(utils, "SendGrid_send_welcome_email_member", flaky)
+    card_id = add_member(send_welcome_email=True)
+    wait_until(lambda: outbox(card_id) == [])
+    assert len(calls) == 2
+    assert calls[0] != calls[1]     # Every attempt sets a fresh password
+#===========================================================
+
+""" CLAIMS [several workers]
+"""
+def test_entry_claimed_by_another_worker_is_skipped(add_member, mailbox):
+    card_id = add_member()
+    outbox_id = queue_claimed(card_id, datetime.now())
+
+    utils.deliver_welcome_email(outbox_id)
+    assert mailbox.sent == []
+    assert [entry.id for entry in outbox(card_id)] == [outbox_id]
+    with utils.SessionLocal_Members() as db:
+        assert outbox_id not in [id for id, _ in utils.get_pending_welcome_emails(db)]
+
+def test_stale_claim_is_taken_over_and_delivered_once(add_member, mailbox):
+    card_id = add_member()
+    outbox_id = queue_claimed(card_id, datetime.now() - utils.WELCOME_EMAIL_CLAIM_TIMEOUT - timedelta(minutes=1))
+    with utils.SessionLocal_Members() as db:
+        assert outbox_id in [id for id, _ in utils.get_pending_welcome_emails(db)]
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(utils.deliver_welcome_email, [outbox_id] * 4))
+    assert mailbox.sent == [(card_id, "Confidential")]     # Password set by the member is kept
+    assert outbox(card_id) == []
+
+def test_delivered_entry_is_not_sent_again(add_member, mailbox):
+    card_id = add_member()
+    with utils.SessionLocal_Members() as db:
+        entry = utils.queue_welcome_email(db, card_id, reset_password=False)
+        db.commit()
+        outbox_id = entry.id
+
+    utils.deliver_welcome_email(outbox_id)
+    utils.deliver_welcome_email(outbox_id)
+    assert len(mailbox.sent) == 1
+#===========================================================